@@ -0,0 +1,72 @@
+# Microbenchmark del camino de envío: paquetes/segundo con el _send_packet anterior
+# (struct.pack_into + copia del payload al datagrama + sendto) y con el actual
+# (Struct.pack_into + sendmsg del header y el payload por separado).
+# Los dos caminos sellan el checksum y sólo formatean el log en modo verbose, así la
+# diferencia medida es únicamente la del armado y envío del datagrama.
+import argparse
+import os
+import socket
+import statistics
+import struct
+import time
+
+from lib.logger import logger
+from lib.protocolo import HEADER_FORMAT, HEADER_SIZE, PAYLOAD_SIZE, Protocol, seal_header
+
+
+def _sink():
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    return sink
+
+
+def bench_legacy(conn, payload, packets):
+    """_send_packet previo: header y payload copiados a un datagrama reutilizable y sendto."""
+    packet = bytearray(HEADER_SIZE + len(payload))
+    start = time.perf_counter()
+    for seq in range(packets):
+        payload_len = len(payload)
+        if HEADER_SIZE + payload_len > len(packet):
+            packet = bytearray(HEADER_SIZE + payload_len)
+        struct.pack_into(HEADER_FORMAT, packet, 0, seq, conn.ack_num, 0, 0)
+        seal_header(memoryview(packet)[:HEADER_SIZE], payload)
+        packet[HEADER_SIZE:HEADER_SIZE + payload_len] = payload
+        if logger.verbose:
+            logger.vprint(
+                f"-> Sending [SEQ={seq}, ACK={conn.ack_num}, Flags={bin(0)}, LEN={payload_len}] a {conn.peer_address}"
+            )
+        conn.socket.sendto(memoryview(packet)[:HEADER_SIZE + payload_len], conn.peer_address)
+    return packets / (time.perf_counter() - start)
+
+
+def bench_current(conn, payload, packets):
+    start = time.perf_counter()
+    for seq in range(packets):
+        conn._send_packet(0, payload, seq=seq)
+    return packets / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Send path microbenchmark")
+    parser.add_argument("-n", "--packets", type=int, default=200000, help="packets per run")
+    parser.add_argument("-l", "--length", type=int, default=PAYLOAD_SIZE, help="payload length")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="alternating runs per path (median reported)")
+    args = parser.parse_args()
+
+    logger.set_quiet(True)
+    sink = _sink()
+    conn = Protocol("127.0.0.1", 0, client=True)
+    conn.peer_address = sink.getsockname()
+    payload = memoryview(os.urandom(args.length))
+
+    # Corridas alternadas: el calentamiento y el ruido de la máquina se reparten entre los dos
+    legacy_runs, current_runs = [], []
+    for _ in range(args.rounds):
+        legacy_runs.append(bench_legacy(conn, payload, args.packets))
+        current_runs.append(bench_current(conn, payload, args.packets))
+    legacy = statistics.median(legacy_runs)
+    current = statistics.median(current_runs)
+    print(f"legacy  (pack_into + copy + sendto):   {legacy:12.0f} pkt/s")
+    print(f"current (Struct.pack_into + sendmsg):   {current:12.0f} pkt/s")
+    print(f"speedup: {current / legacy:.2f}x")
+    sink.close()
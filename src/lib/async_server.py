@@ -0,0 +1,821 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .demux import new_connection_id
+from .file_manager import DURABILITY_NONE
+from .logger import logger
+from .protocolo import (
+    CID_HEADER_SIZE,
+    CID_STRUCT,
+    DEFAULT_CONGESTION,
+    FAST_OPEN_ACCEPTED,
+    FLAG_ACK,
+    FLAG_CID,
+    FLAG_FIN,
+    FLAG_FNAME,
+    FLAG_OP,
+    FLAG_PSH,
+    FLAG_SYN,
+    HEADER_SIZE,
+    HEADER_STRUCT,
+    IDLE_TIME,
+    MSS_STRUCT,
+    PAYLOAD_SIZE,
+    PROBE_FLAGS,
+    REJECT_FLAGS,
+    Protocol,
+    checksum_ok,
+    seal_header,
+)
+from .server import SYN_BACKLOG, expected_end, log_session, open_transfer, transfer_reply
+from .sockets import grow_receive_buffer
+
+HANDSHAKE_ATTEMPTS = 6   # SYN-ACKs antes de abandonar, como Protocol.accept
+FIN_ATTEMPTS = 6         # FINs antes de cerrar igual, como Protocol.close
+SW_ATTEMPTS_LIMIT = 12   # intentos por paquete SW (3 por llamada x 4 llamadas en _send_reliable_packet)
+MAX_CONNECTIONS = 4096   # Conexiones abiertas; más allá se rechaza el SYN (server busy)
+DISK_WORKERS = 16        # Threads para disco, compresión y digests, fuera del loop
+MAX_WRITE_BACKLOG = 16 * 1024 * 1024  # Bytes de un upload esperando al disco; más allá no se ACKea
+
+
+class _TransportSocket:
+    """Adaptador de un DatagramTransport a la interfaz de lib.sockets.Socket que usa Protocol."""
+
+    def __init__(self, owned=True):
+        self.transport = None
+        self.owned = owned  # False: transporte de escucha compartido, no se cierra con la conexión
+        self.gso = False
+        self.gro = False
+
+    def sendto(self, message, addr=None):
+        self.transport.sendto(message, addr)
+
+    def sendmsg(self, buffers, addr=None):
+        # El transporte copia el datagrama si no lo puede mandar en el momento
+        self.transport.sendto(b"".join(buffers), addr)
+
+    def sendmsg_batch(self, datagrams, addr=None):
+        for buffers in datagrams:
+            self.sendmsg(buffers, addr)
+
+    def grow_receive_buffer(self, nbytes):
+        # El transporte de escucha compartido es de todas las conexiones: no se toca
+        sock = self.transport.get_extra_info("socket") if self.owned else None
+        return grow_receive_buffer(sock, nbytes) if sock is not None else None
+
+    def close(self):
+        if self.transport is not None and self.owned:
+            self.transport.close()
+
+
+class _Connection(asyncio.DatagramProtocol):
+    """Una transferencia: la misma máquina de estados que Protocol.accept + handle_client,
+    manejada por callbacks del loop en lugar de recvfrom bloqueantes.
+
+    Cada conexión tiene su propio puerto efímero, igual que el servidor con threads, así
+    que los clientes existentes no notan la diferencia. Con cid, en cambio, usa el socket
+    de escucha y el _Listener le reenvía los datagramas con ese connection ID.
+    """
+
+    def __init__(self, server, key, client_addr, client_isn, cid=None, syn_data=b""):
+        self.server = server
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.sock = _TransportSocket(owned=cid is None)
+        self.proto = Protocol(server.host, 0, client=True, congestion=server.congestion, sock=self.sock,
+                              max_mss=server.max_mss)
+        self.proto.cid = cid
+        self.proto.peer_address = client_addr
+        self.proto.ack_num = client_isn + 1
+        self.server_isn = self.proto.seq_num
+        self.syn_data = syn_data   # MSS + OP + FNAME del fast open (vacío si el cliente no negocia)
+        self.synack_data = b""
+        self.fast_open = False
+
+        self.handler = self._on_syn_rcvd
+        self.file_manager = None
+        self.stream = None  # file_manager o sus envoltorios de rango y compresión (ver open_transfer)
+        self.eof = False
+        self.paused = False
+        self.closed = False
+
+        self.timer = None          # retransmisión del estado actual (SYN-ACK, SW, FIN, TIME-WAIT)
+        self.timer_deadline = None  # deadline (time.time()) del timer SR armado
+        self.ack_timer = None      # ACK demorado del receptor SR
+        self.idle_timer = None
+        self.last_rx = time.monotonic()
+        self.attempts = 0
+        self.rto = float(self.proto.retransmission_timeout)
+        self.fin_seq = None
+        self.fin_reply = FLAG_ACK  # respuesta a FINs duplicados durante TIME-WAIT
+        self.half_open = True      # cuenta en el backlog de handshakes del servidor
+        self.synack_sent = False
+
+        # Disco, compresión y digests corren en el pool del servidor, de a un trabajo por conexión
+        self.jobs = deque()        # (func, then, failed) esperando su turno
+        self.job_running = False
+        self.reading = False       # lectura adelantada del archivo en curso (download)
+        self.sw_waiting = False    # el emisor SW espera esa lectura para seguir
+        self.write_queue = deque()  # datos en orden del upload que esperan ser escritos
+        self.write_backlog = 0
+        self.writing = False
+
+    # --- Callbacks de asyncio ---
+
+    def connection_made(self, transport):
+        self.sock.transport = transport
+        if self.sock.owned:
+            logger.vprint(f"[ASYNC] Per-connection socket in {transport.get_extra_info('sockname')}")
+        else:
+            logger.vprint(f"[ASYNC] Connection ID {self.proto.cid} on the listening socket")
+        self.idle_timer = self.loop.call_later(IDLE_TIME, self._on_idle)
+        self._accept_syn()
+
+    def datagram_received(self, data, addr):
+        if self.closed or addr != self.proto.peer_address or len(data) < HEADER_SIZE:
+            return
+        if not checksum_ok(data):
+            self.proto.stats["checksum_drops"] += 1
+            logger.vprint(f"Received corrupted packet from {addr} (bad checksum). Dropping.")
+            return
+        header = HEADER_STRUCT.unpack_from(data, 0)
+        offset = CID_HEADER_SIZE if header[2] & FLAG_CID else HEADER_SIZE
+        if logger.verbose:
+            logger.vprint(
+                f"<- Received [SEQ={header[0]}, ACK={header[1]}, Flags={bin(header[2])}, LEN={len(data) - offset}] from addr: {addr}"
+            )
+        self.last_rx = time.monotonic()
+        if header[2] & PROBE_FLAGS == PROBE_FLAGS:
+            self.proto._on_probe(header, memoryview(data)[offset:])
+            return
+        try:
+            self.handler(header, memoryview(data)[offset:])
+        except Exception as e:
+            logger.info(f"[ASYNC] Error with client {self.proto.peer_address}: {e}")
+            self._drop()
+
+    def error_received(self, exc):
+        logger.vprint(f"[ASYNC] Socket error with {self.proto.peer_address}: {exc}")
+
+    def connection_lost(self, exc):
+        self._drop()
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self.handler == self._on_sending_sr:
+            self._sr_pump()
+
+    # --- Timers ---
+
+    def _set_timer(self, delay, callback):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(delay, callback)
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def _cancel_timers(self):
+        for handle in (self.timer, self.ack_timer, self.idle_timer):
+            if handle is not None:
+                handle.cancel()
+        self.timer = self.ack_timer = self.idle_timer = None
+
+    # --- Trabajos bloqueantes, fuera del loop ---
+
+    def _run_blocking(self, func, then=None, failed=None):
+        """Corre func en el pool del servidor, en orden con los demás trabajos de la conexión.
+
+        then(resultado) o failed(excepción) siguen en el loop, salvo que la conexión ya se
+        haya cerrado; sin failed, un error cierra la conexión.
+        """
+        self.jobs.append((func, then, failed))
+        if not self.job_running:
+            self._next_job()
+
+    def _next_job(self):
+        func, then, failed = self.jobs.popleft()
+        self.job_running = True
+        self.server.busy.add(self)
+        future = self.loop.run_in_executor(self.server.executor, func)
+        future.add_done_callback(lambda f: self._job_done(f, then, failed))
+
+    def _job_done(self, future, then, failed):
+        self.job_running = False
+        if not self.closed:
+            try:
+                error = future.exception()
+                if error is not None:
+                    (failed or self._on_job_error)(error)
+                elif then is not None:
+                    then(future.result())
+            except Exception as e:
+                self._on_job_error(e)
+        if self.job_running:
+            return
+        if self.jobs:
+            self._next_job()
+        else:
+            self.server.busy.discard(self)
+
+    def _on_job_error(self, e):
+        logger.info(f"[ASYNC] Error with client {self.proto.peer_address}: {e}")
+        self._drop()
+
+    def _on_idle(self):
+        left = self.last_rx + IDLE_TIME - time.monotonic()
+        if left > 0:
+            self.idle_timer = self.loop.call_later(left, self._on_idle)
+            return
+        logger.info(f"[ASYNC] Idle timeout with {self.proto.peer_address}. Closing.")
+        self._drop()
+
+    # --- Handshake: SYN_RCVD -> OP -> FNAME ---
+
+    def _accept_syn(self):
+        """MSS y, con fast open, OP y FNAME del SYN: manda el SYN-ACK o rechaza la transferencia."""
+        proto = self.proto
+        fast_open = proto._accept_syn(self.syn_data, proto.peer_address)
+        if len(self.syn_data) >= MSS_STRUCT.size:
+            self.synack_data = MSS_STRUCT.pack(proto.mss)
+        if not fast_open:
+            self._send_synack()
+            return
+        self.fast_open = True
+        try:
+            fname = proto._unpack_fast_open(fast_open)
+        except ValueError as e:
+            self._refuse_fast_open(e)
+            return
+        # transfer_reply toca el disco (y puede calcular el digest de un prefijo)
+        self._run_blocking(lambda: transfer_reply(self.server.storage_dir, proto, fname),
+                           self._on_fast_open_reply, failed=self._refuse_fast_open)
+
+    def _on_fast_open_reply(self, reply):
+        self.synack_data += FAST_OPEN_ACCEPTED + reply
+        self._send_synack()
+
+    def _refuse_fast_open(self, e):
+        proto = self.proto
+        logger.vprint(f"[ASYNC] Fast open from {proto.peer_address} refused: {e}")
+        proto._send_packet(REJECT_FLAGS, str(e).encode("utf-8")[:PAYLOAD_SIZE], seq=0)
+        self._drop()
+
+    def _send_synack(self):
+        proto = self.proto
+        self.synack_sent = True
+        proto._send_packet(FLAG_SYN | FLAG_ACK, self.synack_data, seq=self.server_isn)
+        logger.vprint(f"[ASYNC] SYN-ACK (ISN={self.server_isn}) enviado a {proto.peer_address}")
+        self._set_timer(self.rto, self._on_synack_timeout)
+
+    def _on_synack_timeout(self):
+        self.attempts += 1
+        if self.attempts >= HANDSHAKE_ATTEMPTS:
+            logger.vprint("[ASYNC] Failed handshake after several tries. Closing connection.")
+            self._drop()
+            return
+        self.rto = min(self.rto * 2.0, 8.0)
+        self._send_synack()
+
+    def on_duplicate_syn(self):
+        """El cliente no vio nuestro SYN-ACK y repitió el SYN al puerto principal."""
+        if self.handler == self._on_syn_rcvd and self.synack_sent and self.sock.transport is not None:
+            logger.vprint("[ASYNC] duplicate SYN; re-sending SYN-ACK.")
+            self.proto._send_packet(FLAG_SYN | FLAG_ACK, self.synack_data, seq=self.server_isn)
+
+    def _on_syn_rcvd(self, header, data):
+        if header[1] != self.server_isn + 1:
+            logger.vprint(f"[ASYNC] Unexpected packet during handshake: flags={bin(header[2])}")
+            return
+        if not (header[2] & (FLAG_ACK | FLAG_PSH)):
+            return
+        if not self.proto._on_final_ack(header, data):
+            logger.vprint("[ASYNC] data before the final ACK; re-sending SYN-ACK for the MSS.")
+            self.proto._send_packet(FLAG_SYN | FLAG_ACK, self.synack_data, seq=self.server_isn)
+            return
+        logger.vprint("[ASYNC] final ACK OK. Completed handshake.")
+        self.proto.seq_num = self.server_isn + 1
+        self.proto.is_connected = True
+        self._cancel_timer()
+        self._leave_backlog()
+        if self.fast_open:
+            self._start_transfer()
+            if header[2] & FLAG_PSH and self.handler == self._on_receiving:
+                # El ACK final se perdió pero llegó el primer segmento del upload
+                self._on_receiving(header, data)
+            return
+        self.handler = self._on_op
+        if header[2] & FLAG_OP:
+            # El ACK final se perdió pero la operación ya lo confirma
+            self._on_op(header, data)
+
+    def _leave_backlog(self):
+        if self.half_open:
+            self.half_open = False
+            self.server.half_open -= 1
+
+    def _recv_control(self, header, data, flag):
+        """Recepción Stop & Wait del OP. Devuelve el payload si llegó en orden."""
+        proto = self.proto
+        if not (header[2] & flag):
+            return None
+        if header[0] != proto.ack_num:
+            proto._send_packet(FLAG_ACK)
+            return None
+        proto.ack_num += len(data)
+        proto._send_packet(FLAG_ACK)
+        return data
+
+    def _on_op(self, header, data):
+        data = self._recv_control(header, data, FLAG_OP)
+        if not data:
+            return
+        self.proto._unpack_op(data)
+        self.handler = self._on_fname
+
+    def _on_fname(self, header, data):
+        if header[2] & FLAG_OP:
+            # Retransmisión de OP: nuestro ACK se perdió
+            self.proto._send_packet(FLAG_ACK)
+            return
+        proto = self.proto
+        if not (header[2] & FLAG_FNAME):
+            return
+        if header[0] != proto.ack_num:
+            proto._send_packet(FLAG_ACK)
+            return
+        fname = bytes(data).decode("utf-8", errors="replace").strip()
+        if not fname:
+            logger.vprint("[ASYNC] Empty filename.")
+            self._drop()
+            return
+        # El ACK del FNAME lleva la respuesta de transfer_reply, que toca el disco
+        self.handler = self._on_fname_pending
+        size = len(data)
+        self._run_blocking(lambda: transfer_reply(self.server.storage_dir, proto, fname),
+                           lambda reply: self._on_fname_reply(fname, size, reply))
+
+    def _on_fname_pending(self, header, data):
+        """FNAMEs repetidos mientras se arma la respuesta: el ACK sale cuando esté lista."""
+
+    def _on_fname_reply(self, fname, size, reply):
+        proto = self.proto
+        proto.ack_num += size
+        proto._send_packet(FLAG_ACK, reply)
+        proto.filename = fname
+        self._start_transfer()
+
+    # --- Transferencia ---
+
+    def _start_transfer(self):
+        proto = self.proto
+        filepath = os.path.join(self.server.storage_dir, proto.filename)
+        logger.info(f"[ASYNC] Connection accepted from {proto.peer_address}. File: {proto.filename}")
+        logger.info(f"[ASYNC] Saving in: {filepath}" if proto.operation != 1 else f"[ASYNC] Reading from: {filepath}")
+        # Los trabajos de la conexión corren en orden: las lecturas y escrituras que se
+        # encolen desde ya encuentran el archivo abierto
+        self._run_blocking(self._open_transfer, failed=self._on_open_failed)
+
+        if proto.operation != 1:
+            self.handler = self._on_receiving
+        elif proto.recovery_mode == Protocol.SELECTIVE_REPEAT:
+            self.handler = self._on_sending_sr
+            self._sr_pump()
+        else:
+            self.handler = self._on_sending_sw
+            self.attempts = 0
+            self._sw_send()
+
+    def _open_transfer(self):
+        self.file_manager, self.stream = open_transfer(self.server.storage_dir, self.proto, self.server.durability)
+
+    def _on_open_failed(self, e):
+        logger.info(f"[ASYNC] Error with client {self.proto.peer_address}: {e}")
+        self._start_fin()
+
+    def _close_file(self):
+        if self.file_manager is not None:
+            self.file_manager.close()
+
+    def _refill(self):
+        """Pide al pool una lectura adelantada hasta send_buffer_limit bytes pendientes en la cola del emisor."""
+        proto = self.proto
+        pending = proto._sr_pending_bytes()
+        want = proto.send_buffer_limit - pending
+        if self.eof or self.reading or want <= 0:
+            return
+        if pending and want < proto.send_buffer_limit // 4:
+            # Todavía hay cola: se espera lugar para una lectura grande en vez de muchas chicas
+            return
+        self.reading = True
+        self._run_blocking(lambda: self._read_ahead(want), self._on_read)
+
+    def _read_ahead(self, want):
+        """En el pool: lee (y comprime) hasta want bytes. El digest recorre cada chunk, así
+        los fallos de página del mmap se pagan acá y no en el loop. Devuelve (chunks, eof)."""
+        chunks = []
+        read = 0
+        while read < want and self.stream is not None:
+            chunk = self.stream.read_chunk()
+            if not chunk:
+                return chunks, True
+            self.proto._digest_sent(chunk)
+            chunks.append(chunk)
+            read += len(chunk)
+        return chunks, self.stream is None
+
+    def _on_read(self, result):
+        chunks, self.eof = result
+        self.reading = False
+        for chunk in chunks:
+            self.proto._sr_queue(chunk)
+        if self.handler == self._on_sending_sr:
+            self._sr_pump()
+        elif self.handler == self._on_sending_sw and self.sw_waiting:
+            self.sw_waiting = False
+            self._sw_send()
+
+    # Upload (cliente -> servidor)
+
+    def _on_receiving(self, header, data):
+        proto = self.proto
+        flags = header[2]
+        if flags & FLAG_PSH and not (flags & (FLAG_OP | FLAG_FNAME)):
+            if self.write_backlog > MAX_WRITE_BACKLOG:
+                # El disco no da abasto: sin ACK, el emisor lo retransmite más tarde
+                logger.vprint(f"[ASYNC] Write backlog full ({self.write_backlog}[B]). Dropping SEQ {header[0]}.")
+                return
+            if proto.recovery_mode == Protocol.SELECTIVE_REPEAT:
+                proto._sr_on_data(header[0], data, self._deliver)
+                if proto.ack_deadline is not None and self.ack_timer is None:
+                    self.ack_timer = self.loop.call_later(proto.ack_delay, self._on_ack_timer)
+            elif header[0] == proto.ack_num:
+                proto.rx_digest.update(data)
+                self._deliver(data)
+                proto.ack_num += len(data)
+                proto._send_packet(FLAG_ACK)
+            else:
+                logger.vprint(f"Unexpected SEQ {header[0]}. Resending last ACK.")
+                proto._send_packet(FLAG_ACK)
+        elif flags & FLAG_FIN:
+            # El veredicto del digest sale de lo recibido: el FIN+ACK no espera al disco, lo
+            # encolado se termina de escribir en el pool (y el fsync, si hay, al cerrar)
+            logger.info(f"[ASYNC] End of transmission for {proto.filename}.")
+            proto.ack_num = header[0] + 1
+            self.fin_reply = FLAG_ACK | FLAG_FIN
+            proto._send_packet(self.fin_reply, proto._on_peer_fin(data))
+            if proto.stream_verified() is False:
+                logger.info(f"[ASYNC] Upload of {proto.filename} is corrupted (digest mismatch).")
+            self._time_wait()
+            self._run_blocking(self._finish_upload)
+        elif flags & (FLAG_OP | FLAG_FNAME):
+            # Retransmisión del handshake: nuestro ACK se perdió
+            proto._send_packet(FLAG_ACK)
+
+    def _deliver(self, data):
+        """Datos en orden del upload: quedan en cola hasta que el pool los escribe (y descomprime).
+
+        data es un memoryview sobre el datagrama (bytes inmutables): se puede guardar sin copiar.
+        """
+        self.write_queue.append(data)
+        self.write_backlog += len(data)
+        if not self.writing:
+            self.writing = True
+            self._run_blocking(self._write_queued, self._on_written)
+
+    def _write_queued(self):
+        written = 0
+        queue = self.write_queue
+        while queue:
+            data = queue.popleft()
+            if self.stream is not None:
+                self.stream.write_chunk(data)
+            written += len(data)
+        return written
+
+    def _on_written(self, written):
+        self.writing = False
+        self.write_backlog -= written
+        if self.write_queue and self.handler == self._on_receiving:
+            self.writing = True
+            self._run_blocking(self._write_queued, self._on_written)
+
+    def _finish_upload(self):
+        """En el pool, después del FIN: escribe lo que quedó en cola y revisa que el archivo esté completo."""
+        self._write_queued()
+        if self.file_manager is None:
+            return
+        proto = self.proto
+        self.file_manager.flush()
+        expected = expected_end(proto)
+        if proto.session:
+            log_session(proto, self.file_manager)
+        elif expected is not None and self.file_manager.write_pos != expected:
+            logger.info(f"[ASYNC] Upload of {proto.filename} is incomplete: "
+                        f"{self.file_manager.write_pos}/{expected} bytes.")
+        if proto.compression and not self.stream.complete():
+            logger.info(f"[ASYNC] Upload of {proto.filename} ended in the middle of a compressed frame.")
+
+    def _on_ack_timer(self):
+        self.ack_timer = None
+        proto = self.proto
+        if proto.ack_deadline is not None:
+            proto._send_sr_ack(proto.ack_num)
+
+    # Download SR (servidor -> cliente)
+
+    def _sr_pump(self):
+        """Rellena la cola desde el archivo, llena la ventana y rearma el timer de retransmisión."""
+        proto = self.proto
+        self._refill()
+        if not self.paused:
+            proto._sr_fill_window()
+        if self.eof and not proto.in_flight and not proto.tx_unsent:
+            self._finish_download()
+            return
+        deadline = proto._next_rtx_deadline()
+        if deadline is None:
+            return
+        # Los timers se rearman sólo si el nuevo vence antes: un ACK no cuesta un cancel
+        if self.timer_deadline is None or deadline < self.timer_deadline:
+            self.timer_deadline = deadline
+            self._set_timer(max(0.0, deadline - time.time()), self._on_sr_timer)
+
+    def _on_sr_timer(self):
+        self.timer = None
+        self.timer_deadline = None
+        if not self.proto._sr_on_timeout(time.time()):
+            logger.info(f"[ASYNC] Data could not be delivered to {self.proto.peer_address}.")
+            self._drop()
+            return
+        self._sr_pump()
+
+    def _on_sending_sr(self, header, data):
+        if header[2] & FLAG_ACK:
+            self.proto._sr_on_ack(header, data)
+            self._sr_pump()
+        elif header[2] & FLAG_FIN:
+            self._on_peer_fin(header, data)
+
+    # Download SW
+
+    def _sw_payload(self):
+        unsent = self.proto.tx_unsent
+        return unsent[0][:self.proto.mss] if unsent else None
+
+    def _sw_send(self):
+        self._refill()
+        payload = self._sw_payload()
+        if payload is None:
+            if self.reading:
+                self.sw_waiting = True
+                return
+            self._finish_download()
+            return
+        self.sent_at = time.time()
+        self.proto._send_packet(FLAG_PSH, payload)
+        self._set_timer(self.proto.rto_estimator.get_timeout(), self._on_sw_timeout)
+
+    def _on_sw_timeout(self):
+        proto = self.proto
+        self.attempts += 1
+        if self.attempts >= SW_ATTEMPTS_LIMIT:
+            logger.info(f"[ASYNC] Data could not be delivered to {proto.peer_address}.")
+            self._drop()
+            return
+        logger.vprint("Timeout o incorrect ACK. Retransmitting packet reliably...")
+        proto.rto_estimator.backoff()
+        self.sent_at = None  # Karn: sin muestra de RTT para retransmisiones
+        proto._send_packet(FLAG_PSH, self._sw_payload())
+        self._set_timer(proto.rto_estimator.get_timeout(), self._on_sw_timeout)
+
+    def _on_sending_sw(self, header, data):
+        proto = self.proto
+        if header[2] & FLAG_FIN:
+            self._on_peer_fin(header, data)
+            return
+        payload = self._sw_payload()
+        if not (header[2] & FLAG_ACK) or header[1] < proto.seq_num + len(payload):
+            return
+        if self.sent_at is not None:
+            proto.rto_estimator.note_sample(time.time() - self.sent_at)
+        proto.seq_num += len(payload)
+        unsent = proto.tx_unsent
+        if len(unsent[0]) > proto.mss:
+            unsent[0] = unsent[0][proto.mss:]
+        else:
+            unsent.popleft()
+        proto.tx_unsent_bytes -= len(payload)
+        self.attempts = 0
+        self._sw_send()
+
+    def _finish_download(self):
+        stats = self.proto.stats
+        logger.info(f"[ASYNC] Download completed for {self.proto.filename}.")
+        logger.vprint(
+            f"[ASYNC] Retransmissions for {self.proto.filename}: "
+            f"timeout={stats['timeout_retransmits']}, fast={stats['fast_retransmits']}, "
+            f"avoided by SACK={stats['sack_skips']}"
+        )
+        self._start_fin()
+
+    # --- Cierre: FIN -> ACK -> TIME-WAIT ---
+
+    def _on_peer_fin(self, header, data):
+        self.proto.ack_num = header[0] + 1
+        self.proto._send_packet(FLAG_ACK, self.proto._on_peer_fin(data))
+
+    def _start_fin(self):
+        self.fin_seq = self.proto.seq_num
+        self.attempts = 0
+        self.handler = self._on_fin_wait
+        self.rto = max(0.3, float(self.proto.rto_estimator.get_timeout()))
+        self._send_fin()
+
+    def _send_fin(self):
+        self.proto._send_packet(FLAG_FIN, self.proto._fin_payload(), seq=self.fin_seq)
+        self._set_timer(self.rto, self._on_fin_timeout)
+
+    def _on_fin_timeout(self):
+        self.attempts += 1
+        if self.attempts >= FIN_ATTEMPTS:
+            logger.vprint("Connection closure best-effort (FIN not confirmed).")
+            self._drop()
+            return
+        self.proto.rto_estimator.backoff()
+        self.rto = min(8.0, self.proto.rto_estimator.get_timeout())
+        self._send_fin()
+
+    def _on_fin_wait(self, header, data):
+        if header[2] & FLAG_FIN:
+            self._on_peer_fin(header, data)
+        if (header[2] & FLAG_ACK) and header[1] >= self.fin_seq + 1:
+            self.proto.seq_num = header[1]
+            self.proto._on_fin_ack(data)
+            if self.proto.peer_verified is False:
+                logger.info(f"[ASYNC] {self.proto.peer_address} reports a digest mismatch for {self.proto.filename}.")
+            logger.vprint("Connection closure (FIN ACKed) confirmed.")
+            self._time_wait()
+
+    def _time_wait(self):
+        """Queda un rato para re-ACKear FINs duplicados del peer y cierra."""
+        self.handler = self._on_time_wait
+        linger = max(1.0, 2.0 * self.proto.rto_estimator.get_timeout())
+        self._set_timer(linger, self._drop)
+
+    def _on_time_wait(self, header, data):
+        if header[2] & FLAG_FIN:
+            self.proto.ack_num = header[0] + 1
+            self.proto._send_packet(self.fin_reply, self.proto._on_peer_fin(data))
+
+    def _drop(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._cancel_timers()
+        self._leave_backlog()
+        if self.file_manager is not None or self.job_running or self.jobs:
+            # Cerrar el archivo puede hacer fsync: va al pool, detrás de lo pendiente
+            self._run_blocking(self._close_file)
+        # Sin is_connected, Protocol.close() sólo cierra el transporte (no bloquea)
+        self.proto.is_connected = False
+        self.proto.close()
+        self.server.connections.pop(self.key, None)
+        if self.proto.cid is not None:
+            self.server.by_cid.pop(self.proto.cid, None)
+        logger.info(f"[ASYNC] Connection with {self.proto.peer_address} closed.")
+
+
+class _Listener(asyncio.DatagramProtocol):
+    """Socket principal: sólo atiende SYNs y crea una _Connection por cliente."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        if len(data) < HEADER_SIZE:
+            return
+        header = HEADER_STRUCT.unpack_from(data, 0)
+        flags = header[2]
+        if flags & FLAG_CID and len(data) >= CID_HEADER_SIZE:
+            cid = CID_STRUCT.unpack_from(data, HEADER_SIZE)[0]
+            if cid:
+                conn = self.server.by_cid.get(cid)
+                if conn is not None:
+                    conn.datagram_received(data, addr)
+                return
+        if not (flags & FLAG_SYN) or (flags & FLAG_ACK):
+            logger.vprint("[ASYNC] SYN expected. Ignoring packet.")
+            return
+        if not checksum_ok(data):
+            logger.vprint(f"[ASYNC] Corrupted SYN from {addr}. Dropping.")
+            return
+        key = (addr, header[0])
+        server = self.server
+        conn = server.connections.get(key)
+        if conn is not None:
+            conn.on_duplicate_syn()
+            return
+        if len(server.connections) >= server.max_connections:
+            # Sin lugar para otra transferencia: se avisa al cliente en lugar de dejarlo reintentar
+            server.reject(header, addr)
+            return
+        if server.half_open >= server.backlog:
+            logger.vprint(f"[ASYNC] SYN backlog full ({server.backlog}). Dropping SYN from {addr}.")
+            return
+        offset = CID_HEADER_SIZE if flags & FLAG_CID else HEADER_SIZE
+        self.server.open_connection(key, addr, header[0], shared=bool(flags & FLAG_CID), syn_data=bytes(data[offset:]))
+
+
+class AsyncServer:
+    """Servidor de un solo thread sobre asyncio: miles de transferencias sin un thread por cliente."""
+
+    def __init__(self, host, port, storage_dir=".", congestion=DEFAULT_CONGESTION, shared=False,
+                 durability=DURABILITY_NONE, max_mss=None, backlog=SYN_BACKLOG, max_connections=MAX_CONNECTIONS,
+                 disk_workers=DISK_WORKERS):
+        self.host = host
+        self.port = port
+        self.storage_dir = storage_dir
+        self.congestion = congestion
+        self.max_mss = max_mss  # None: el MSS sale del MTU de la ruta hacia cada cliente
+        self.durability = durability
+        self.shared = shared
+        self.connections = {}  # (addr, ISN del cliente) -> _Connection
+        self.by_cid = {}       # connection ID -> _Connection (modo de socket compartido)
+        self.backlog = backlog                  # handshakes en curso; más allá se descartan los SYNs
+        self.max_connections = max_connections  # conexiones abiertas; más allá se rechazan los SYNs
+        self.half_open = 0
+        # Disco, compresión y digests: el loop sólo mueve paquetes y timers
+        self.executor = ThreadPoolExecutor(max_workers=disk_workers, thread_name_prefix="async-disk")
+        self.busy = set()      # conexiones con trabajos en el pool
+        self.transport = None
+        self._stopped = None
+
+        if self.storage_dir and not os.path.exists(self.storage_dir):
+            os.makedirs(self.storage_dir)
+            logger.info(f"Storage directory:'{self.storage_dir}' created.")
+
+    def start(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Listener(self), local_addr=(self.host, self.port)
+        )
+        logger.info(f"Async server listening on {self.host}:{self.port}")
+        try:
+            await self._stopped
+        finally:
+            self.transport.close()
+            for conn in list(self.connections.values()):
+                conn._drop()
+            # Las escrituras y cierres pendientes terminan antes de soltar el pool
+            while self.busy:
+                await asyncio.sleep(0.01)
+            self.executor.shutdown()
+
+    def reject(self, header, address):
+        """Rechaza el SYN de header (servidor ocupado), como Protocol.reject."""
+        reply = bytearray(HEADER_SIZE)
+        HEADER_STRUCT.pack_into(reply, 0, 0, header[0] + 1, REJECT_FLAGS, 0)
+        seal_header(reply)
+        self.transport.sendto(bytes(reply), address)
+        logger.vprint(f"[ASYNC] Server busy: SYN from {address} rejected.")
+
+    def open_connection(self, key, addr, client_isn, shared=False, syn_data=b""):
+        if self.shared and shared:
+            # El cliente ofreció connection ID: todo pasa por el socket de escucha
+            cid = new_connection_id(self.by_cid)
+            conn = _Connection(self, key, addr, client_isn, cid=cid, syn_data=syn_data)
+            self.half_open += 1
+            self.connections[key] = conn
+            self.by_cid[cid] = conn
+            conn.connection_made(self.transport)
+            return
+        conn = _Connection(self, key, addr, client_isn, syn_data=syn_data)
+        self.half_open += 1
+        self.connections[key] = conn
+        asyncio.ensure_future(self._bind(conn))
+
+    async def _bind(self, conn):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(lambda: conn, local_addr=(self.host, 0))
+        except OSError as e:
+            logger.info(f"[ASYNC] Could not open a socket for {conn.proto.peer_address}: {e}")
+            conn._leave_backlog()
+            self.connections.pop(conn.key, None)
+
+    def close(self):
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
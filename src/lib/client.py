@@ -1,24 +1,47 @@
 import ipaddress
 import os
+import threading
+import time
 
-from .file_manager import FileManager
+from .compression import CompressedReader, CompressedWriter, parse_codec
+from .file_manager import FileManager, RangeWriter, prefix_digest
 from .logger import logger
-from .protocolo import HEADER_SIZE, Protocol
+from .congestion import CONGESTION_CONTROLLERS
+from .protocolo import DEFAULT_CONGESTION, HEADER_SIZE, MAX_MSS, MIN_MSS, PAYLOAD_SIZE, Protocol
+from .session import SessionReader, SessionWriter, collect_entries
 
 CHUNK_SIZE = 1024 * 4
+STREAM_MIN_BYTES = 1024 * 1024  # Con --streams, cada conexión transfiere al menos esto
 
 class Client:
 
-    def __init__(self, addr, port, filepath, filename, verbose, quiet, fileop=0, protocolo=Protocol.STOP_AND_WAIT):
+    def __init__(self, addr, port, filepath, filename, verbose, quiet, fileop=0, protocolo=Protocol.STOP_AND_WAIT,
+                 congestion=DEFAULT_CONGESTION, offload=False, resume=False, compression=None,
+                 compression_level=None, streams=1, mss=None, probe_mtu=False):
         """Inicializa el cliente y crea la conexión del protocolo.
 
         Args:
             addr (str): Dirección del servidor (IP literal; no resuelve hostname).
             port (int|str): Puerto del servidor (1..65535).
-            filepath (str): Ruta local del archivo (lectura en upload, escritura en download).
-            filename (str): Nombre remoto/destino en el servidor.
+            filepath (str|list): Ruta local del archivo (lectura en upload, escritura en download).
+                En upload, varias rutas o un directorio se mandan en una sola sesión.
+            filename (str|list): Nombre remoto/destino en el servidor. En una sesión de upload
+                es el directorio remoto (vacío = el de almacenamiento); en download, varios
+                nombres o uno terminado en "/" (directorio remoto) piden una sesión y filepath
+                es el directorio local de destino.
             verbose (bool): Modo detallado.
             quiet (bool): Silencioso (anula salida normal).
+            congestion (str): Algoritmo de control de congestión para SR (reno, cubic).
+            offload (bool): Usar I/O en lotes con UDP GSO/GRO si el kernel lo soporta.
+            resume (bool): Reanudar una transferencia cortada desde el prefijo que ya tiene el
+                destino (verificado con su SHA-256).
+            compression (str): Comprimir los datos en tránsito ("zlib" o "lzma"; None = no).
+            compression_level (int): Nivel del códec (0..9); por defecto el del códec.
+            streams (int): Conexiones en paralelo; el archivo se parte en rangos de bytes y
+                cada uno viaja por la suya.
+            mss (int): Tope del payload por segmento que se anuncia al servidor; None = el que
+                entra en el MTU de la ruta.
+            probe_mtu (bool): Probar el camino con datagramas grandes antes de fijar el MSS.
 
         Raises:
             ValueError/TypeError: Si cualquier validación falla.
@@ -27,19 +50,59 @@ class Client:
         self.addr = _validate_addr(addr)
         self.port = _validate_port(port)
         self.protocolo = _parse_protocol_arg(protocolo)
+        self.congestion = _validate_congestion(congestion)
 
         if _is_string(filepath):
-            self.filepath = filepath
+            self.filepaths = [filepath]
+        elif isinstance(filepath, (list, tuple)) and filepath and all(_is_string(p) for p in filepath):
+            self.filepaths = list(filepath)
         else:
-            raise TypeError("filepath must be a string")
-
-        self.filename = _validate_filename(filename)
+            raise TypeError("filepath must be a string or a list of strings")
+        self.filepath = self.filepaths[0]
+
+        # Sesión: varios archivos (o un directorio) por una sola conexión
+        names = list(filename) if isinstance(filename, (list, tuple)) else [filename]
+        if fileop == 1:
+            self.session = len(names) > 1 or (_is_string(names[0]) and names[0].endswith("/"))
+            if self.session and len(self.filepaths) > 1:
+                raise ValueError("A session download needs a single destination directory")
+        else:
+            self.session = len(self.filepaths) > 1 or os.path.isdir(self.filepath)
+        if self.session and fileop != 1:
+            if len(names) > 1:
+                raise ValueError("A session upload takes a single remote directory")
+            self.filename = _validate_filename(names[0] or ".")
+        else:
+            self.filename = "\n".join(_validate_filename(name) for name in names)
+        if self.session and len(self.filename.encode("utf-8")) > PAYLOAD_SIZE:
+            raise ValueError("Too many file names for one session")
         self.verbose, self.quiet = _validate_verbose_and_quiet(verbose, quiet)
 
         logger.set_verbose(self.verbose)
         logger.set_quiet(self.quiet)
 
-        self.conn = Protocol(addr, port, client=True, recovery_mode=self.protocolo)
+        if not _is_boolean(offload):
+            raise TypeError("offload must be a boolean")
+        if not _is_boolean(resume):
+            raise TypeError("resume must be a boolean")
+        self.offload = offload
+        self.resume = resume
+        self.compression = parse_codec(compression, compression_level)
+        self.streams = _validate_streams(streams)
+        self.mss = _validate_mss(mss)
+        if not _is_boolean(probe_mtu):
+            raise TypeError("probe_mtu must be a boolean")
+        self.probe_mtu = probe_mtu
+        if self.streams > 1 and self.resume:
+            raise ValueError("resume is not supported with more than one stream")
+        if self.session and (self.streams > 1 or self.resume):
+            raise ValueError("resume and streams are not supported with several files")
+
+        self.conn = self._new_connection()
+
+    def _new_connection(self):
+        return Protocol(self.addr, self.port, client=True, recovery_mode=self.protocolo, congestion=self.congestion,
+                        offload=self.offload, max_mss=self.mss, probe_mtu=self.probe_mtu)
 
     def close(self):
         if self.conn.is_connected:
@@ -47,85 +110,395 @@ class Client:
 
     def upload(self):
         self._print_info(string_verbose="Validating filepath...")
-        _validate_filepath(self.filepath)
+        for filepath in self.filepaths:
+            _validate_filepath(filepath)
         self._print_info(string_verbose="filepath validated")
+        if self.session:
+            return self._upload_session()
+        if self.streams > 1:
+            return self._upload_striped()
 
         
         # 1. Crear una instancia de FileManager en modo lectura
         #    (esto lanzará excepción si el archivo no existe o no se puede leer)
         self._print_info(string_verbose="Creating file_manager...")
-        file_manager = FileManager(self.filepath, "r", chunk_size=CHUNK_SIZE)
+        file_manager = FileManager(self.filepath, "r", chunk_size=CHUNK_SIZE, use_mmap=True)
         self._print_info(string_verbose="File_manager has been created")
 
         # 2. Conectar al servidor
         self._print_info(string_verbose="Connecting with server...")
         logger.vprint(self.addr, self.port, self.filename)
-        if not self.conn.connect((self.addr, self.port), self.filename):
-            self._print_info(string_normal="Could not connect to the server.", string_verbose="Connection failed.")
+        file_size = file_manager.get_file_size()
+        if not self.conn.connect((self.addr, self.port), self.filename, file_size=file_size,
+                                 resume_offset=0 if self.resume else None, compression=self.compression):
+            self._print_connect_error()
             return
+
+        offset = self.conn.resume_offset if self.resume else 0
+        if offset and not self._server_prefix_matches(offset, file_size):
+            # The server's partial file is not a prefix of ours: start over on a new connection
+            self._print_info(string_normal="The file on the server differs, uploading it from the start.")
+            self.conn.close()
+            self.conn = self._new_connection()
+            if not self.conn.connect((self.addr, self.port), self.filename, file_size=file_size,
+                                     compression=self.compression):
+                self._print_connect_error()
+                return
+            offset = 0
+        if offset:
+            self._print_info(string_normal=f"Resuming upload at byte {offset}.")
+        # Cada lectura del archivo son segmentos enteros del MSS acordado
+        file_manager.chunk_size = self.conn.io_size(CHUNK_SIZE)
+        file_manager.seek(offset)
+        # Si el servidor aceptó comprimir, se mandan frames en lugar de los bytes del archivo
+        source = file_manager
+        if self.conn.compression:
+            source = CompressedReader(file_manager, *self.conn.compression)
         
-        # 3. Enviar el primer chunk y luego sucesivos
+        # 3. Enviar el archivo completo; la ventana SR se mantiene llena entre chunks
         self._print_info(string_verbose="Connected with server")
-        self._print_info(string_verbose="Reading first chunk...")
-        chunk = file_manager.read_chunk()
-
-        read_bytes_count = len(chunk)
-        file_size = file_manager.get_file_size()
-        percentage = read_bytes_count / file_size * 100
-
-        while chunk:
-            self.conn.send(chunk, type=self.protocolo)
-            self._print_info(string_normal=f"Percentage uploaded: {percentage}%")
-            self._print_info(string_verbose=f"Bytes sent: {read_bytes_count}/{file_size}[B]")
-
-            chunk = file_manager.read_chunk()
-            read_bytes_count += len(chunk)
-            percentage = read_bytes_count / file_size * 100
+        start = time.monotonic()
+
+        def report(sent_bytes_count):
+            done = offset + (source.consumed if source is not file_manager else sent_bytes_count)
+            self._print_info(string_normal=f"Uploaded {_format_progress(done, file_size, start, offset)}")
+            self._print_info(string_verbose=f"Bytes sent: {done}/{file_size}[B]")
+
+        sent_bytes_count = self.conn.sendfile(source, type=self.protocolo, progress=report)
+        read_bytes_count = source.consumed if source is not file_manager else sent_bytes_count
+        # El servidor confirma el digest de lo recibido al aceptar nuestro FIN
+        self.conn.close()
+        if self.conn.peer_verified is False:
+            self._print_info(
+                string_normal="Upload corrupted: the server's digest does not match, try again.",
+                string_verbose=f"Digest mismatch reported by the server for {self.filename}"
+            )
+            return
 
         self._print_info(
             string_normal=f"{read_bytes_count}[B] have been uploaded to {self.filename} in the server"
+            + (f" ({sent_bytes_count}[B] compressed)" if source is not file_manager else "")
+            # Al reanudar, read_bytes_count es sólo lo de esta corrida: el resto ya estaba en el servidor
+            + (f", resumed at byte {offset} ({offset + read_bytes_count}/{file_size}[B] in total)" if offset else "")
         )
+        self._print_info(string_verbose=_format_stats(self.conn.stats))
+
+    def _server_prefix_matches(self, offset, file_size):
+        if offset > file_size:
+            return False
+        if self.conn.peer_digest is None:
+            return True
+        return prefix_digest(self.filepath, offset) == self.conn.peer_digest
         
     def download(self):
+        if self.session:
+            return self._download_session()
+        if self.streams > 1:
+            return self._download_striped()
+        # Lo que ya hay del archivo sirve para reanudar si el servidor lo confirma
+        local_size = 0
+        if self.resume and os.path.isfile(self.filepath):
+            local_size = os.path.getsize(self.filepath)
         
         # 1. Validar que la ruta de destino exista (no el archivo, que se creará)
         self._print_info(string_verbose="Creating file_manager...")
-        file_manager = FileManager(self.filepath, "w")
+        file_manager = FileManager(self.filepath, "w", resume_from=local_size)
         self._print_info(string_verbose="File_manager has been created")
 
         self._print_info(string_verbose="Connecting with server...")
         logger.vprint(self.addr, self.port, self.filename)
 
         # 2. Conectar al servidor con fileop=1 para descarga
-        if not self.conn.connect((self.addr, self.port), self.filename, fileop=1):
-            self._print_info(string_normal="Could not connect to the server.", string_verbose="Connection failed.")
+        resume_digest = prefix_digest(self.filepath, local_size) if local_size else None
+        if not self.conn.connect((self.addr, self.port), self.filename, fileop=1,
+                                 resume_offset=local_size if self.resume else None, resume_digest=resume_digest,
+                                 compression=self.compression):
+            self._print_connect_error()
             return
 
         self._print_info(string_verbose="Connected with server. Starting download...")
 
-        received_bytes_count = 0
-        # No podemos saber el tamaño del archivo de antemano en el download,
-        # así que no mostraremos porcentaje, solo bytes recibidos.
-        chunk_size = file_manager.getChunkSize()
-        size = chunk_size
+        offset = self.conn.resume_offset if self.resume else 0
+        if offset != local_size:
+            # The server did not accept our prefix (or only part of it)
+            file_manager.truncate(offset)
+        if offset:
+            self._print_info(string_normal=f"Resuming download at byte {offset}.")
+        received_bytes_count = offset
+        wire_bytes_count = 0
+        # Con compresión llegan frames: el writer los descomprime hacia el archivo
+        sink = CompressedWriter(file_manager) if self.conn.compression else file_manager
+        # El servidor anuncia el tamaño en el handshake (None si es un servidor viejo)
+        file_size = self.conn.peer_file_size
+        if file_size is not None:
+            file_manager.preallocate(file_size)
+        start = time.monotonic()
+        # Un único buffer reutilizable: el protocolo escribe los payloads directamente en él
+        buffer = bytearray(self.conn.io_size(CHUNK_SIZE))
+        view = memoryview(buffer)
         while True:
-            chunk = self.conn.recv(size, type=self.protocolo)
-            if not chunk:
+            n = self.conn.recv_into(buffer, type=self.protocolo)
+            if not n:
                 break
 
-            file_manager.write_chunk(chunk)
-            received_bytes_count += len(chunk)
+            sink.write_chunk(view[:n])
+            wire_bytes_count += n
+            received_bytes_count = file_manager.write_pos
 
+            if file_size is not None:
+                progress = _format_progress(received_bytes_count, file_size, start, offset)
+            else:
+                progress = f"{received_bytes_count} bytes..."
             self._print_info(
-                string_normal=f"Received {received_bytes_count} bytes...",
+                string_normal=f"Received {progress}",
                 string_verbose=f"Received {received_bytes_count} bytes for {self.filename}"
             )
+        # Writes are coalesced in FileManager: closing it flushes the tail to disk
+        file_manager.close()
+        self.close()
+
+        if file_size is not None and received_bytes_count != file_size:
+            self._print_info(
+                string_normal=f"Download incomplete: {received_bytes_count}/{file_size}[B] received.",
+                string_verbose=f"Download of {self.filename} truncated: {received_bytes_count}/{file_size}[B]"
+            )
+            return
+        if self.conn.stream_verified() is False:
+            self._print_info(
+                string_normal="Download corrupted: the file digest does not match, try again.",
+                string_verbose=f"Digest mismatch for {self.filename}"
+            )
+            return
 
         self._print_info(
             string_normal=f"Total {received_bytes_count}[B] have been downloaded to {os.path.join(self.filepath, self.filename)}"
+            + (f" ({wire_bytes_count}[B] compressed)" if sink is not file_manager else "")
         )
 
 
+    # --- Sesiones: varios archivos por una conexión ---
+
+    def _upload_session(self):
+        entries = collect_entries(self.filepaths)
+        total = sum(os.path.getsize(path) for path, _ in entries)
+        self._print_info(string_verbose=f"Uploading {len(entries)} files ({total}[B]) in one session")
+        if not self.conn.connect((self.addr, self.port), self.filename, compression=self.compression, session=True):
+            self._print_connect_error()
+            return
+        if not self.conn.session:
+            self._print_info(string_normal="The server does not support sending several files per connection.")
+            self.conn.close()
+            return
+
+        reader = SessionReader(entries, self.conn.io_size(CHUNK_SIZE))
+        source = CompressedReader(reader, *self.conn.compression) if self.conn.compression else reader
+        start = time.monotonic()
+
+        def report(sent_bytes_count):
+            self._print_info(
+                string_normal=f"Uploaded {_format_progress(reader.bytes_read, total, start)}",
+                string_verbose=f"Bytes sent: {reader.bytes_read}/{total}[B] ({reader.files_sent}/{len(entries)} files)"
+            )
+
+        try:
+            sent_bytes_count = self.conn.sendfile(source, type=self.protocolo, progress=report)
+        finally:
+            reader.close()
+        self.conn.close()
+        if self.conn.peer_verified is False:
+            self._print_info(
+                string_normal="Upload corrupted: the server's digest does not match, try again.",
+                string_verbose=f"Digest mismatch reported by the server for the session to {self.filename}"
+            )
+            return
+
+        self._print_info(
+            string_normal=f"{len(entries)} files ({total}[B]) have been uploaded to {self.filename} in the server"
+            + (f" ({sent_bytes_count}[B] on the wire)" if source is not reader else "")
+        )
+        self._print_info(string_verbose=_format_stats(self.conn.stats))
+
+    def _download_session(self):
+        os.makedirs(self.filepath, exist_ok=True)
+        if not self.conn.connect((self.addr, self.port), self.filename, fileop=1, compression=self.compression,
+                                 session=True):
+            self._print_connect_error()
+            return
+        if not self.conn.session:
+            self._print_info(string_normal="The server does not support sending several files per connection.")
+            self.conn.close()
+            return
+
+        total = self.conn.peer_file_size or 0
+        files = self.conn.session_files
+        self._print_info(string_verbose=f"Downloading {files} files ({total}[B]) in one session")
+        writer = SessionWriter(self.filepath)
+        sink = CompressedWriter(writer) if self.conn.compression else writer
+        start = time.monotonic()
+        buffer = bytearray(self.conn.io_size(CHUNK_SIZE))
+        view = memoryview(buffer)
+        try:
+            while True:
+                n = self.conn.recv_into(buffer, type=self.protocolo)
+                if not n:
+                    break
+                sink.write_chunk(view[:n])
+                self._print_info(
+                    string_normal=f"Received {_format_progress(writer.bytes_written, total, start)}",
+                    string_verbose=f"Received {writer.bytes_written}/{total}[B] ({len(writer.results)}/{files} files)"
+                )
+        finally:
+            writer.close()
+            self.close()
+
+        for name, size, ok in writer.results:
+            if not ok:
+                self._print_info(string_normal=f"Download corrupted: the digest of {name} does not match, try again.")
+        if not writer.complete() or len(writer.results) != files:
+            self._print_info(
+                string_normal=f"Download incomplete: {len(writer.results)}/{files} files received.",
+                string_verbose=f"Session truncated: {writer.bytes_written}/{total}[B]"
+            )
+            return
+        if self.conn.stream_verified() is False:
+            self._print_info(string_normal="Download corrupted: the session digest does not match, try again.")
+            return
+        if all(ok for _, _, ok in writer.results):
+            self._print_info(
+                string_normal=f"Total {files} files ({total}[B]) have been downloaded to {self.filepath}"
+            )
+
+    # --- Transferencias en paralelo (--streams) ---
+
+    def _run_streams(self, ranges, target, conns=None):
+        """Corre target(conn, byte_range, progress) en un thread por rango; devuelve los errores."""
+        conns = conns or [self._new_connection() for _ in ranges]
+        progress = _StripeProgress(self, sum(length for _, length in ranges))
+        errors = []
+
+        def run(conn, byte_range):
+            try:
+                target(conn, byte_range, progress)
+            except Exception as e:
+                errors.append(f"range {byte_range}: {e}")
+            finally:
+                if conn.is_connected:
+                    conn.close()
+
+        threads = [threading.Thread(target=run, args=(conn, r)) for conn, r in zip(conns, ranges)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+
+    def _upload_striped(self):
+        file_size = os.path.getsize(self.filepath)
+        ranges = _split_ranges(file_size, self.streams)
+        self._print_info(string_verbose=f"Uploading {file_size}[B] over {len(ranges)} connections: {ranges}")
+        conns = [self.conn] + [self._new_connection() for _ in ranges[1:]]
+        errors = self._run_streams(ranges, self._upload_range, conns)
+        if errors:
+            self._print_info(string_normal="Upload failed: " + "; ".join(errors))
+            return
+        self._print_info(
+            string_normal=f"{file_size}[B] have been uploaded to {self.filename} in the server ({len(ranges)} streams)"
+        )
+
+    def _upload_range(self, conn, byte_range, progress):
+        file_manager = FileManager(self.filepath, "r", chunk_size=CHUNK_SIZE, use_mmap=True)
+        try:
+            if not conn.connect((self.addr, self.port), self.filename, file_size=file_manager.get_file_size(),
+                                compression=self.compression, byte_range=byte_range):
+                raise ConnectionError(_connect_error(conn))
+            if conn.byte_range != tuple(byte_range):
+                raise ConnectionError("the server does not support ranges")
+            file_manager.chunk_size = conn.io_size(CHUNK_SIZE)
+            file_manager.seek(*byte_range)
+            source = file_manager
+            if conn.compression:
+                source = CompressedReader(file_manager, *conn.compression)
+            done = 0
+
+            def report(sent):
+                nonlocal done
+                consumed = source.consumed if source is not file_manager else sent
+                progress.add(consumed - done)
+                done = consumed
+
+            conn.sendfile(source, type=self.protocolo, progress=report)
+            conn.close()
+            if conn.peer_verified is False:
+                raise ValueError("the server's digest does not match")
+        finally:
+            file_manager.close()
+
+    def _download_striped(self):
+        # Una conexión con un rango vacío sólo trae el tamaño del archivo
+        probe = self.conn
+        if not probe.connect((self.addr, self.port), self.filename, fileop=1, byte_range=(0, 0)):
+            self._print_connect_error()
+            return
+        file_size = probe.peer_file_size
+        if probe.byte_range is None or file_size is None:
+            self._print_info(string_normal="The server does not support --streams.")
+            return
+        probe_closer = threading.Thread(target=probe.close)
+        probe_closer.start()
+
+        ranges = _split_ranges(file_size, self.streams)
+        self._print_info(string_verbose=f"Downloading {file_size}[B] over {len(ranges)} connections: {ranges}")
+        # Se crea (vacío) una sola vez; cada conexión escribe su rango sin truncarlo
+        with open(self.filepath, "wb"):
+            pass
+        errors = self._run_streams(ranges, self._download_range)
+        probe_closer.join()
+        if errors:
+            self._print_info(string_normal="Download failed: " + "; ".join(errors))
+            return
+        self._print_info(
+            string_normal=f"Total {file_size}[B] have been downloaded to {self.filepath} ({len(ranges)} streams)"
+        )
+
+    def _download_range(self, conn, byte_range, progress):
+        file_manager = FileManager(self.filepath, "w", in_place=True)
+        try:
+            if not conn.connect((self.addr, self.port), self.filename, fileop=1, compression=self.compression,
+                                byte_range=byte_range):
+                raise ConnectionError(_connect_error(conn))
+            if conn.byte_range != tuple(byte_range):
+                raise ConnectionError("the server does not support ranges")
+            if conn.peer_file_size is not None:
+                file_manager.preallocate(conn.peer_file_size)
+            writer = RangeWriter(file_manager, byte_range[0])
+            sink = CompressedWriter(writer) if conn.compression else writer
+            buffer = bytearray(conn.io_size(CHUNK_SIZE))
+            view = memoryview(buffer)
+            while True:
+                n = conn.recv_into(buffer, type=self.protocolo)
+                if not n:
+                    break
+                before = writer.position
+                sink.write_chunk(view[:n])
+                progress.add(writer.position - before)
+            received = writer.position - byte_range[0]
+            if received != byte_range[1]:
+                raise ValueError(f"incomplete: {received}/{byte_range[1]}[B] received")
+            if conn.stream_verified() is False:
+                raise ValueError("the file digest does not match")
+        finally:
+            file_manager.close()
+
+    def _print_connect_error(self):
+        if self.conn.reject_reason:
+            self._print_info(string_normal=f"The server refused the transfer: {self.conn.reject_reason}",
+                             string_verbose=f"Connection rejected: {self.conn.reject_reason}")
+        elif self.conn.rejected:
+            self._print_info(string_normal="The server is busy, try again later.",
+                             string_verbose="Connection rejected: server busy.")
+        else:
+            self._print_info(string_normal="Could not connect to the server.", string_verbose="Connection failed.")
+
     def _print_info(self, string_normal=None, string_verbose=None):
         if self.verbose:
             if string_verbose is not None:
@@ -135,6 +508,57 @@ class Client:
                 logger.info(string_normal)
 
 
+def _connect_error(conn):
+    if conn.reject_reason:
+        return f"the server refused the transfer: {conn.reject_reason}"
+    return "the server is busy" if conn.rejected else "could not connect"
+
+
+def _format_progress(done, total, start, offset=0):
+    """Porcentaje y tiempo restante estimado a partir de la velocidad promedio (desde offset)."""
+    if not total:
+        return "100%"
+    percentage = done / total * 100
+    elapsed = time.monotonic() - start
+    if done > offset and elapsed > 0:
+        eta = (total - done) / ((done - offset) / elapsed)
+        return f"{percentage:.1f}% (ETA {eta:.1f}s)"
+    return f"{percentage:.1f}%"
+
+
+class _StripeProgress:
+    """Progreso total de las conexiones en paralelo (cada thread suma lo suyo)."""
+
+    def __init__(self, client, total):
+        self.client = client
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            done = self.done
+        self.client._print_info(string_normal=f"Transferred {_format_progress(done, self.total, self.start)}",
+                                string_verbose=f"Bytes transferred: {done}/{self.total}[B]")
+
+
+def _split_ranges(size, streams):
+    """Parte [0, size) en a lo sumo streams rangos contiguos, alineados a CHUNK_SIZE."""
+    streams = max(1, min(streams, size // STREAM_MIN_BYTES))
+    step = -(-size // streams)
+    step = max(CHUNK_SIZE, -(-step // CHUNK_SIZE) * CHUNK_SIZE)
+    return [(offset, min(step, size - offset)) for offset in range(0, size, step)] or [(0, 0)]
+
+
+def _format_stats(stats):
+    return (
+        f"Retransmissions: timeout={stats['timeout_retransmits']}, "
+        f"fast={stats['fast_retransmits']}, avoided by SACK={stats['sack_skips']}"
+    )
+
+
 def _validate_port(port):
     try:
         p = int(port)
@@ -156,6 +580,24 @@ def _validate_addr(addr):
     raise ValueError(f"Dirección no es IP literal válida: {addr!r}")
 
 
+def _validate_streams(streams):
+    if isinstance(streams, bool) or not isinstance(streams, int):
+        raise TypeError("streams must be an integer")
+    if streams < 1:
+        raise ValueError("streams must be at least 1")
+    return streams
+
+
+def _validate_mss(mss):
+    if mss is None:
+        return None
+    if isinstance(mss, bool) or not isinstance(mss, int):
+        raise TypeError("mss must be an integer")
+    if not MIN_MSS <= mss <= MAX_MSS:
+        raise ValueError(f"mss must be between {MIN_MSS} and {MAX_MSS}")
+    return mss
+
+
 def _is_boolean(boolean):
     if not isinstance(boolean, bool):
         return False
@@ -193,6 +635,13 @@ def _validate_verbose_and_quiet(verbose, quiet):
         raise ValueError("You can't have both verbose and quiet")
     return verbose, quiet
 
+def _validate_congestion(congestion):
+    if not congestion:
+        return DEFAULT_CONGESTION
+    if not _is_string(congestion) or congestion.lower() not in CONGESTION_CONTROLLERS:
+        raise ValueError(f"Invalid congestion control algorithm: {congestion!r}")
+    return congestion.lower()
+
 def _parse_protocol_arg(protocolo):
     if protocolo is None or protocolo == "":
         return Protocol.STOP_AND_WAIT
@@ -0,0 +1,155 @@
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:  # Python compilado sin liblzma
+    lzma = None
+
+# Códecs que se negocian en el OP (el id viaja en un byte)
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_NAMES = {"zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+DEFAULT_LEVELS = {
+    CODEC_ZLIB: 6,
+    CODEC_LZMA: 1,  # los presets altos de lzma sólo convienen en enlaces muy lentos
+}
+MAX_LEVEL = 9
+
+BLOCK_SIZE = 64 * 1024  # Bytes del archivo que se comprimen juntos (un frame)
+MIN_RATIO = 0.9         # Si el bloque comprimido no baja del 90%, va crudo
+MAX_SKIP = 16           # Tras un bloque incompresible no se intenta en los 1, 2, 4... siguientes
+# Cada frame: códec del bloque, largo del cuerpo y largo original (para validar al descomprimir)
+FRAME_STRUCT = struct.Struct("!BII")
+
+
+def available_codecs():
+    """Códecs que este Python puede usar."""
+    return [name for name, codec in CODEC_NAMES.items() if codec != CODEC_LZMA or lzma is not None]
+
+
+def is_supported(codec):
+    if codec == CODEC_ZLIB:
+        return True
+    return codec == CODEC_LZMA and lzma is not None
+
+
+def parse_codec(name, level=None):
+    """(codec, level) a partir del nombre de la CLI; None si no se pidió compresión."""
+    if not name or name == "none":
+        return None
+    codec = CODEC_NAMES.get(name.lower())
+    if codec is None or not is_supported(codec):
+        raise ValueError(f"Unknown or unavailable compression: {name!r} (available: {', '.join(available_codecs())})")
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if not 0 <= level <= MAX_LEVEL:
+        raise ValueError(f"Compression level must be between 0 and {MAX_LEVEL}")
+    return codec, level
+
+
+def _compress(codec, level, data):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, level)
+    return lzma.compress(data, preset=level)
+
+
+def _decompress(codec, data, length):
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj()
+    elif codec == CODEC_LZMA and lzma is not None:
+        decompressor = lzma.LZMADecompressor()
+    else:
+        raise ValueError(f"Unknown compression codec in frame: {codec}")
+    # max_length acota la salida: un frame malicioso no puede inflarse más de lo anunciado
+    block = decompressor.decompress(data, length)
+    if len(block) != length:
+        raise ValueError("Corrupted compressed frame")
+    return block
+
+
+class CompressedReader:
+    """Envuelve un FileManager de lectura: read_chunk() devuelve frames con bloques comprimidos.
+
+    Cada bloque se comprime por separado y, si no rinde (MIN_RATIO), se manda crudo; tras
+    un bloque incompresible se saltean cada vez más intentos para no gastar CPU en datos
+    que ya vienen comprimidos.
+    """
+
+    def __init__(self, file_manager, codec, level, block_size=BLOCK_SIZE):
+        self.file_manager = file_manager
+        self.codec = codec
+        self.level = level
+        self.block_size = block_size
+        self.consumed = 0      # bytes del archivo ya convertidos en frames
+        self.wire_bytes = 0    # bytes de frames generados
+        self.skip = 0          # bloques que faltan saltear
+        self.backoff = 1
+        self.leftover = b""    # resto del último chunk que no entró en el bloque anterior
+
+    def read_chunk(self):
+        parts = [self.leftover] if self.leftover else []
+        size = len(self.leftover)
+        while size < self.block_size:
+            chunk = self.file_manager.read_chunk()
+            if not chunk:
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        if not size:
+            return b""
+        block = b"".join(parts)
+        # Los chunks no tienen por qué dividir al bloque (son segmentos enteros del MSS)
+        self.leftover = block[self.block_size:]
+        block = block[:self.block_size]
+        size = len(block)
+        self.consumed += size
+
+        body, codec = block, CODEC_NONE
+        if self.skip:
+            self.skip -= 1
+        else:
+            compressed = _compress(self.codec, self.level, block)
+            if len(compressed) <= size * MIN_RATIO:
+                body, codec = compressed, self.codec
+                self.backoff = 1
+            else:
+                self.skip = self.backoff
+                self.backoff = min(MAX_SKIP, self.backoff * 2)
+        frame = FRAME_STRUCT.pack(codec, len(body), size) + body
+        self.wire_bytes += len(frame)
+        return frame
+
+
+class CompressedWriter:
+    """Envuelve un FileManager de escritura: write_chunk() recibe el stream de frames."""
+
+    def __init__(self, file_manager, max_block=BLOCK_SIZE):
+        self.file_manager = file_manager
+        self.max_block = max_block
+        self.pending = bytearray()   # frame incompleto (el stream llega en pedazos arbitrarios)
+
+    def write_chunk(self, data):
+        pending = self.pending
+        pending += data
+        pos = 0
+        while len(pending) - pos >= FRAME_STRUCT.size:
+            codec, length, original = FRAME_STRUCT.unpack_from(pending, pos)
+            if original > self.max_block or (codec == CODEC_NONE and length != original):
+                raise ValueError("Corrupted compressed frame")
+            end = pos + FRAME_STRUCT.size + length
+            if len(pending) < end:
+                break
+            body = memoryview(pending)[pos + FRAME_STRUCT.size:end]
+            if codec == CODEC_NONE:
+                self.file_manager.write_chunk(body)
+            else:
+                self.file_manager.write_chunk(_decompress(codec, body, original))
+            body.release()
+            pos = end
+        del pending[:pos]
+
+    def complete(self):
+        """True si no quedó un frame a medias (el stream terminó en un borde de frame)."""
+        return not self.pending
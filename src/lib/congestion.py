@@ -0,0 +1,148 @@
+import time
+
+# Appropriate Byte Counting (RFC 3465): en slow start un ACK hace crecer cwnd hasta L*MSS.
+# Con L=2 los ACKs demorados (uno cada ACK_EVERY=2 segmentos) no frenan el crecimiento
+ABC_LIMIT = 2
+
+
+class CongestionController:
+    """Interfaz común de los algoritmos de control de congestión.
+
+    La ventana (cwnd) se lleva en bytes. El emisor SR llama a:
+      - on_ack(acked_bytes)  cuando el ACK acumulativo avanza; lo SACKeado cuenta recién
+                             cuando el ACK acumulativo lo cubre
+      - on_loss()            ante una pérdida detectada por ACKs duplicados
+      - on_timeout()         cuando expira el RTO de un segmento
+    """
+
+    name = None
+
+    def __init__(self, mss, max_window, initial_window=4):
+        self.mss = mss
+        self.max_window = max_window
+        self.cwnd = min(initial_window * mss, max_window)
+        self.ssthresh = max_window
+
+    def window(self) -> int:
+        """Bytes que se pueden tener en vuelo."""
+        return int(max(self.mss, min(self.cwnd, self.max_window)))
+
+    def in_slow_start(self) -> bool:
+        return self.cwnd < self.ssthresh
+
+    def _slow_start(self, acked_bytes):
+        self.cwnd = min(self.cwnd + min(acked_bytes, ABC_LIMIT * self.mss), self.max_window)
+
+    def on_ack(self, acked_bytes: int):
+        raise NotImplementedError
+
+    def on_loss(self):
+        raise NotImplementedError
+
+    def on_timeout(self):
+        """Igual que TCP: volver a slow start con una ventana de un segmento."""
+        self.ssthresh = max(2 * self.mss, self.cwnd / 2)
+        self.cwnd = self.mss
+
+
+class Reno(CongestionController):
+    """Slow start + AIMD (RFC 5681), contando bytes confirmados (RFC 3465)."""
+
+    name = "reno"
+
+    def __init__(self, mss, max_window, initial_window=4):
+        super().__init__(mss, max_window, initial_window)
+        self.bytes_acked = 0   # bytes confirmados en congestion avoidance desde el último aumento
+
+    def on_ack(self, acked_bytes: int):
+        if self.in_slow_start():
+            self._slow_start(acked_bytes)
+            return
+        # +1 MSS por cada cwnd de bytes confirmados (un RTT), sin importar cuántos ACKs fueron
+        self.bytes_acked += acked_bytes
+        if self.bytes_acked >= self.cwnd:
+            self.bytes_acked -= self.cwnd
+            self.cwnd = min(self.cwnd + self.mss, self.max_window)
+
+    def on_loss(self):
+        self.ssthresh = max(2 * self.mss, self.cwnd / 2)
+        self.cwnd = self.ssthresh
+        self.bytes_acked = 0
+
+    def on_timeout(self):
+        super().on_timeout()
+        self.bytes_acked = 0
+
+
+class Cubic(CongestionController):
+    """CUBIC (RFC 8312), con la región TCP-friendly. Trabaja en segmentos."""
+
+    name = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss, max_window, initial_window=4):
+        super().__init__(mss, max_window, initial_window)
+        self.w_max = 0.0          # ventana (segmentos) antes de la última reducción
+        self.k = 0.0
+        self.epoch_start = None
+        self.w_est = 0.0          # estimación Reno para la región TCP-friendly
+
+    def on_ack(self, acked_bytes: int):
+        if self.in_slow_start():
+            self._slow_start(acked_bytes)
+            return
+
+        now = time.monotonic()
+        cwnd_seg = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd_seg < self.w_max:
+                self.k = ((self.w_max - cwnd_seg) / self.C) ** (1 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = cwnd_seg
+            self.w_est = cwnd_seg
+
+        t = now - self.epoch_start
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * (acked_bytes / self.mss) / cwnd_seg
+        target = max(target, self.w_est)
+
+        if target > cwnd_seg:
+            cwnd_seg += (target - cwnd_seg) / cwnd_seg * (acked_bytes / self.mss)
+        else:
+            cwnd_seg += 0.01 * (acked_bytes / self.mss) / cwnd_seg
+        self.cwnd = min(cwnd_seg * self.mss, self.max_window)
+
+    def on_loss(self):
+        self.epoch_start = None
+        self.w_max = self.cwnd / self.mss
+        self.cwnd = max(2 * self.mss, self.cwnd * self.BETA)
+        self.ssthresh = self.cwnd
+
+    def on_timeout(self):
+        self.epoch_start = None
+        self.w_max = self.cwnd / self.mss
+        super().on_timeout()
+
+
+CONGESTION_CONTROLLERS = {
+    Reno.name: Reno,
+    Cubic.name: Cubic,
+}
+
+
+def register_congestion_controller(name, cls):
+    """Registra un algoritmo nuevo (subclase de CongestionController)."""
+    if not issubclass(cls, CongestionController):
+        raise TypeError("cls must be a CongestionController subclass")
+    CONGESTION_CONTROLLERS[name.lower()] = cls
+
+
+def make_congestion_controller(name, mss, max_window):
+    try:
+        cls = CONGESTION_CONTROLLERS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown congestion control algorithm: {name!r}")
+    return cls(mss, max_window)
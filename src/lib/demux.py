@@ -0,0 +1,150 @@
+import queue
+import random
+import socket
+import threading
+
+from .logger import logger
+from .protocolo import (
+    CID_HEADER_SIZE,
+    CID_STRUCT,
+    FLAG_ACK,
+    FLAG_CID,
+    FLAG_SYN,
+    HEADER_SIZE,
+    HEADER_STRUCT,
+    MAX_UDP_PAYLOAD,
+    checksum_ok,
+)
+
+
+def new_connection_id(table):
+    """CID aleatorio de 32 bits, distinto de 0 (reservado para el SYN) y libre en table."""
+    while True:
+        cid = random.getrandbits(32)
+        if cid and cid not in table:
+            return cid
+
+
+class DemuxSocket:
+    """Vista de una conexión sobre el socket de escucha compartido.
+
+    Implementa la parte de la interfaz de lib.sockets.Socket que usa Protocol: los envíos
+    salen por el socket compartido y la recepción lee de la cola que llena el Demultiplexer.
+    """
+
+    def __init__(self, demux, cid, key):
+        self.demux = demux
+        self.cid = cid
+        self.key = key
+        self.inbox = queue.SimpleQueue()  # (datagrama, address)
+        self.timeout = None
+        self.gso = demux.sock.gso
+        self.gro = False
+        self.on_datagram = None  # Aviso de datagrama nuevo (lo usa el thread de teardown)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def grow_receive_buffer(self, nbytes):
+        # El buffer del kernel es el del socket de escucha, compartido por todas las conexiones
+        return self.demux.sock.grow_receive_buffer(nbytes)
+
+    def sendto(self, message, addr=None):
+        self.demux.sock.sendto(message, addr)
+
+    def sendmsg(self, buffers, addr=None):
+        self.demux.sock.sendmsg(buffers, addr)
+
+    def sendmsg_batch(self, datagrams, addr=None):
+        self.demux.sock.sendmsg_batch(datagrams, addr)
+
+    def recvfrom_into(self, buffer):
+        try:
+            data, address = self.inbox.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+        n = min(len(data), len(buffer))
+        buffer[:n] = data[:n]
+        return n, address
+
+    def close(self):
+        self.demux.unregister(self)
+
+
+class Demultiplexer:
+    """Lee el socket de escucha y reparte cada datagrama a su conexión según el connection ID.
+
+    Los SYN nuevos van a la cola de accept(); los SYN repetidos de un handshake en curso
+    van a esa conexión, que reenvía su SYN-ACK.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.connections = {}  # cid -> DemuxSocket
+        self.handshakes = {}   # (address, ISN del cliente) -> DemuxSocket
+        self.syns = queue.SimpleQueue()  # (header, address, payload del SYN)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def next_syn(self, timeout=None):
+        """Bloquea hasta el próximo SYN nuevo; devuelve (header, address, payload)."""
+        return self.syns.get(timeout=timeout)
+
+    def open(self, address, client_isn):
+        """Registra una conexión nueva y devuelve su DemuxSocket."""
+        key = (address, client_isn)
+        with self.lock:
+            conn = DemuxSocket(self, new_connection_id(self.connections), key)
+            self.connections[conn.cid] = conn
+            self.handshakes[key] = conn
+        return conn
+
+    def unregister(self, conn):
+        with self.lock:
+            self.connections.pop(conn.cid, None)
+            if self.handshakes.get(conn.key) is conn:
+                del self.handshakes[conn.key]
+
+    def _run(self):
+        buffer = bytearray(MAX_UDP_PAYLOAD)  # cualquier MSS que se negocie
+        view = memoryview(buffer)  # rebanar el bytearray ya copia; bytes(view[...]) copia una sola vez
+        while True:
+            try:
+                nbytes, address = self.sock.recvfrom_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                # El socket de escucha se cerró
+                return
+            if nbytes < HEADER_SIZE:
+                continue
+            seq, _, flags, _ = HEADER_STRUCT.unpack_from(buffer, 0)
+
+            if flags & FLAG_CID and nbytes >= CID_HEADER_SIZE:
+                cid = CID_STRUCT.unpack_from(buffer, HEADER_SIZE)[0]
+                if cid:
+                    conn = self.connections.get(cid)
+                    if conn is not None:
+                        conn.inbox.put((bytes(view[:nbytes]), address))
+                        if conn.on_datagram is not None:
+                            conn.on_datagram()
+                    else:
+                        logger.vprint(f"[DEMUX] Unknown connection ID {cid} from {address}. Ignoring.")
+                    continue
+
+            if flags & FLAG_SYN and not flags & FLAG_ACK:
+                if not checksum_ok(buffer, nbytes):
+                    logger.vprint(f"[DEMUX] Corrupted SYN from {address}. Dropping.")
+                    continue
+                conn = self.handshakes.get((address, seq))
+                if conn is not None:
+                    conn.inbox.put((bytes(view[:nbytes]), address))
+                else:
+                    offset = CID_HEADER_SIZE if flags & FLAG_CID else HEADER_SIZE
+                    self.syns.put((HEADER_STRUCT.unpack_from(buffer, 0), address, bytes(view[offset:nbytes])))
+                continue
+
+            logger.vprint(f"[DEMUX] Packet without connection ID from {address}. Ignoring.")
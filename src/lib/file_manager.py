@@ -1,39 +1,291 @@
+import ctypes
+import hashlib
+import mmap
 import os
+import threading
+import time
+
+# Política de durabilidad de las escrituras
+DURABILITY_NONE = "none"          # sólo se escribe al page cache; el kernel decide cuándo
+DURABILITY_CLOSE = "close"        # fsync al cerrar el archivo
+DURABILITY_PERIODIC = "periodic"  # fdatasync cada SYNC_INTERVAL segundos y al cerrar
+DURABILITY_POLICIES = (DURABILITY_NONE, DURABILITY_CLOSE, DURABILITY_PERIODIC)
+
+WRITE_BUFFER_SIZE = 1024 * 1024  # las escrituras chicas se juntan hasta este tamaño
+SYNC_INTERVAL = 1.0
+DIGEST_CHUNK = 1024 * 1024
+
+# Achicar un archivo mapeado mata al proceso (SIGBUS) cuando se toca el mapeo: se lleva la
+# cuenta de los inodos mapeados y de las rutas con escrituras abiertas en este proceso
+_open_lock = threading.Lock()
+_mapped = {}    # (st_dev, st_ino) -> lecturas con mmap abiertas
+_writing = {}   # ruta real -> escrituras abiertas
+
+# fallocate(2) con KEEP_SIZE reserva los bloques sin mover st_size (posix_fallocate sí lo mueve)
+FALLOC_FL_KEEP_SIZE = 0x01
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _fallocate = getattr(_libc, "fallocate64", None) or _libc.fallocate
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+except (OSError, AttributeError):
+    _fallocate = None
+
+
+def prefix_digest(path, length):
+    """SHA-256 de los primeros length bytes del archivo (None si el archivo es más corto)."""
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining > 0:
+            block = f.read(min(DIGEST_CHUNK, remaining))
+            if not block:
+                return None
+            digest.update(block)
+            remaining -= len(block)
+    return digest.digest()
+
+
+def _count(registry, key, delta):
+    n = registry.get(key, 0) + delta
+    if n > 0:
+        registry[key] = n
+    else:
+        registry.pop(key, None)
+
+
+def _detach(path, keep):
+    """Reemplaza path por un inodo nuevo con sus primeros keep bytes; los mapeos siguen sobre el viejo."""
+    if not keep:
+        os.unlink(path)
+        return
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        remaining = keep
+        while remaining > 0:
+            block = src.read(min(DIGEST_CHUNK, remaining))
+            if not block:
+                break
+            dst.write(block)
+            remaining -= len(block)
+    os.replace(tmp, path)
+
 
 class FileManager:
-    def __init__(self, path, mode, chunk_size=400):
+    def __init__(self, path, mode, chunk_size=400, use_mmap=False, durability=DURABILITY_NONE,
+                 write_buffer_size=WRITE_BUFFER_SIZE, resume_from=None, in_place=False):
+        """
+        Args:
+            use_mmap (bool): En modo "r", mapear el archivo en memoria: read_chunk() y
+                read_view() devuelven memoryviews sobre el page cache, sin copias. Si el
+                proceso lo tiene abierto para escritura, se lee con read() (podría achicarse).
+            durability (str): En modo "w", cuándo forzar los datos a disco (none, close, periodic).
+            write_buffer_size (int): Bytes que se juntan antes de cada escritura al archivo.
+            resume_from (int): En modo "w", no truncar el archivo: conservar sus primeros
+                resume_from bytes y seguir escribiendo a continuación.
+            in_place (bool): En modo "w", abrir (o crear) el archivo sin truncarlo: otras
+                conexiones escriben otros rangos del mismo archivo con write_chunk(offset=...).
+        """
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(f"Política de durabilidad desconocida: {durability!r}")
         self.path = path
         self.chunk_size = chunk_size
+        self.map = None
+        self.view = None
+        self.position = 0
+        self.read_end = None     # fin del rango de lectura (seek con length); None = hasta el final
+        self.in_place = in_place
+
+        self.durability = durability
+        self.write_buffer_size = write_buffer_size
+        self.write_buffer = bytearray()
+        self.buffer_offset = 0   # offset en el archivo del primer byte de write_buffer
+        self.write_pos = 0       # offset de la próxima escritura sin offset explícito
+        self.written_end = 0     # mayor offset escrito (para recortar lo preasignado de más)
+        self.preallocated = 0
+        self.last_sync = time.monotonic()
+        self.file = None
+        self.map_key = None
+        self.write_key = None
+        with _open_lock:
+            try:
+                self._open(path, mode, resume_from, in_place)
+            except BaseException:
+                if self.write_key is not None:
+                    _count(_writing, self.write_key, -1)
+                raise
+            self.file.seek(0, 2)
+            self.file_size = self.file.tell()
+            self.file.seek(0)
+            if use_mmap and mode == "r" and self.file_size > 0 and os.path.realpath(path) not in _writing:
+                self._map()
+                st = os.fstat(self.file.fileno())
+                self.map_key = (st.st_dev, st.st_ino)
+                _count(_mapped, self.map_key, 1)
+
+    def _open(self, path, mode, resume_from, in_place):
+        """Abre el archivo; en escritura, primero se separa del inodo si alguna lectura lo tiene mapeado."""
+        if mode == "w":
+            self.write_key = os.path.realpath(path)
+            _count(_writing, self.write_key, 1)
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is not None and (st.st_dev, st.st_ino) in _mapped:
+                # Se va a escribir (y quizás achicar) un archivo que se está sirviendo mapeado
+                keep = st.st_size if in_place else (resume_from or 0)
+                _detach(path, min(keep, st.st_size))
         try:
-            self.file = open(path, mode + "b")
+            if mode == "w" and in_place:
+                # O_CREAT sin O_TRUNC: todas las conexiones del archivo abren el mismo inodo
+                self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o666), "r+b")
+            elif mode == "w" and resume_from and os.path.exists(path):
+                self.file = open(path, "r+b")
+                # Nunca se extiende: si el archivo se acortó mientras tanto, se sigue desde su final
+                resume_from = min(resume_from, os.fstat(self.file.fileno()).st_size)
+                self.file.truncate(resume_from)
+                self.write_pos = self.written_end = resume_from
+            else:
+                self.file = open(path, mode + "b")
         except FileNotFoundError:
             raise FileNotFoundError(f"El archivo '{path}' no existe.")
         except PermissionError:
             raise PermissionError(f"No hay permisos para acceder al archivo '{path}'.")
-        self.file.seek(0, 2)
-        self.file_size = self.file.tell()
-        self.file.seek(0)
+
+    def _map(self):
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Lectura secuencial: el kernel agranda el read-ahead y libera lo ya leído antes
+        if hasattr(self.map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.map)
 
     def getChunkSize(self):
         return self.chunk_size
 
+    def seek(self, offset, length=None):
+        """Posiciona la próxima lectura de read_chunk() (p. ej. para reanudar un envío).
+
+        Con length, read_chunk() termina al llegar a offset + length (envío de un rango).
+        """
+        if offset < 0 or offset > self.file_size:
+            raise ValueError(f"El offset {offset} está fuera del rango del archivo ({self.file_size} bytes).")
+        self.read_end = None if length is None else min(self.file_size, offset + length)
+        if self.view is not None:
+            self.position = offset
+        else:
+            self.file.seek(offset)
+
     def read_chunk(self, offset = None) -> bytes:
+        """Lee el próximo chunk (o el de offset). Con mmap devuelve un memoryview, no bytes."""
         if offset is not None:
             if offset < 0:
                 raise ValueError("El offset no puede ser negativo")
             if offset > self.file_size:
                 raise ValueError(f"El offset {offset} está fuera del rango del archivo ({self.file_size} bytes).")
-            self.file.seek(offset)
-        return self.file.read(self.chunk_size)
+            if self.view is not None:
+                self.position = offset
+            else:
+                self.file.seek(offset)
+        if self.view is not None:
+            end = self.position + self.chunk_size
+            if self.read_end is not None:
+                end = min(end, self.read_end)
+            chunk = self.view[self.position:end]
+            self.position += len(chunk)
+            return chunk
+        size = self.chunk_size
+        if self.read_end is not None:
+            size = max(0, min(size, self.read_end - self.file.tell()))
+        return self.file.read(size)
+
+    def read_view(self, offset, length) -> memoryview:
+        """memoryview de length bytes desde offset (más corto al final del archivo).
+
+        Con mmap no copia nada; el view es válido mientras el FileManager esté abierto.
+        """
+        if offset < 0 or offset > self.file_size:
+            raise ValueError(f"El offset {offset} está fuera del rango del archivo ({self.file_size} bytes).")
+        if self.view is not None:
+            return self.view[offset:offset + length]
+        self.file.seek(offset)
+        return memoryview(self.file.read(length))
+
+    def preallocate(self, size):
+        """Reserva size bytes en disco de una vez, si el sistema lo soporta.
+
+        El tamaño del archivo no cambia: si la transferencia se corta, queda con lo que
+        realmente se escribió y --resume sigue desde ahí, no desde una cola en ceros.
+        """
+        if size <= 0 or _fallocate is None:
+            return False
+        if _fallocate(self.file.fileno(), FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+            # Algunos filesystems no lo implementan; el archivo crece a medida que se escribe
+            return False
+        self.preallocated = size
+        return True
+
+    def truncate(self, length):
+        """Descarta todo lo escrito desde length; la próxima escritura sigue desde ahí."""
+        self.flush()
+        self.file.truncate(length)
+        self.write_pos = self.written_end = length
 
     def write_chunk(self, data, offset=None):
+        """Escribe data en offset (por defecto, a continuación de la escritura anterior).
+
+        Las escrituras contiguas se juntan en write_buffer y salen al archivo con una sola
+        escritura posicional cuando se llena; data se copia, así que puede ser un buffer
+        que el llamador reutiliza.
+        """
         if self.file.writable() is False:
             raise ValueError(f"El archivo '{self.path}' no fue abierto en modo escritura.")
 
-        if offset is not None:
-            self.file.seek(offset)
-        self.file.write(data)
-        self.file.flush()
+        if offset is None:
+            offset = self.write_pos
+        buffer = self.write_buffer
+        if buffer and offset != self.buffer_offset + len(buffer):
+            self.flush()
+        self.write_pos = offset + len(data)
+
+        if not buffer and len(data) >= self.write_buffer_size:
+            # Ya es grande: va directo, sin pasar por el buffer
+            self._write_at(data, offset)
+            return
+        if not buffer:
+            self.buffer_offset = offset
+        buffer += data
+        if len(buffer) >= self.write_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Escribe lo acumulado en write_buffer y aplica la política periódica de durabilidad."""
+        if self.write_buffer:
+            self._write_at(self.write_buffer, self.buffer_offset)
+            self.write_buffer.clear()
+        if self.durability == DURABILITY_PERIODIC and time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+            self._sync(data_only=True)
+
+    def _write_at(self, data, offset):
+        fd = self.file.fileno()
+        view = memoryview(data)
+        end = offset + len(view)
+        while view:
+            if hasattr(os, "pwrite"):
+                n = os.pwrite(fd, view, offset)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+                n = os.write(fd, view)
+            view = view[n:]
+            offset += n
+        self.written_end = max(self.written_end, end)
+
+    def _sync(self, data_only=False):
+        fd = self.file.fileno()
+        if data_only and hasattr(os, "fdatasync"):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+        self.last_sync = time.monotonic()
 
     def get_file_size(self):
         return self.file_size
@@ -48,8 +300,33 @@ class FileManager:
             raise PermissionError(f"No hay permisos para eliminar el archivo '{self.path}'.")
 
     def close(self):
+        if self.file is None:
+            return
+        if self.map is not None:
+            self.view.release()
+            try:
+                self.map.close()
+            except BufferError:
+                # Algún segmento todavía apunta al archivo; el mapeo se libera con él
+                pass
+            self.map = None
+            self.view = None
         if not self.file.closed:
+            if self.file.writable():
+                self.flush()
+                if self.preallocated > self.written_end and not self.in_place:
+                    # Transferencia incompleta: no dejar la cola preasignada en ceros
+                    os.ftruncate(self.file.fileno(), self.written_end)
+                if self.durability == DURABILITY_CLOSE:
+                    self._sync()
+                elif self.durability == DURABILITY_PERIODIC:
+                    self._sync(data_only=True)
             self.file.close()
+            with _open_lock:
+                if self.map_key is not None:
+                    _count(_mapped, self.map_key, -1)
+                if self.write_key is not None:
+                    _count(_writing, self.write_key, -1)
 
     def __del__(self):
         self.close()
@@ -59,3 +336,15 @@ class FileManager:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+
+class RangeWriter:
+    """Escribe un stream en el archivo a partir de offset (un rango de una transferencia en paralelo)."""
+
+    def __init__(self, file_manager, offset):
+        self.file_manager = file_manager
+        self.position = offset
+
+    def write_chunk(self, data):
+        self.file_manager.write_chunk(data, offset=self.position)
+        self.position += len(data)
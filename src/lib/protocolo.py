@@ -1,11 +1,20 @@
+import hashlib
+import heapq
 import random
 import struct
+import sys
+import threading
 import time
+import zlib
+from collections import deque
 
-from lib.sockets import Socket
+from lib.sockets import Socket, path_mtu
 
+from .compression import CODEC_NONE
+from .congestion import make_congestion_controller
 from .logger import logger
 from .rto_estimator import RTOEstimator
+from .teardown import teardown
 
 # --- Definición de Flags para el Encabezado del Protocolo ---
 FLAG_SYN = 0b00000001  # Iniciar conexión
@@ -14,28 +23,159 @@ FLAG_FIN = 0b00000100  # Finalizar conexión
 FLAG_PSH = 0b00001000  # Empujar datos (indica que el paquete tiene payload)
 FLAG_FNAME = 0b00010000  # Indica que el payload es un nombre de archivo
 FLAG_OP = 0b00100000
-
-WINDOW_SIZE = 25
+FLAG_SACK = 0b01000000  # El payload de un ACK lleva bloques SACK (start, end)
+FLAG_CID = 0b10000000  # El header extendido lleva un connection ID (socket de escucha compartido)
+# Respuesta del servidor a un SYN cuando no admite más conexiones ("server busy").
+# Lleva ACK=ISN+1 del cliente para que no se confunda con un paquete viejo.
+REJECT_FLAGS = FLAG_SYN | FLAG_FIN
+
+WINDOW_SIZE = 256  # Ventana de recepción SR (segmentos); tope para la cwnd del emisor
+DEFAULT_CONGESTION = "reno"
 BUFFER_SIZE = 1024  # Tamaño del buffer para recv/send para selective repeat
-PAYLOAD_SIZE = 1024
-MAX_DGRAM = 2048
+PAYLOAD_SIZE = 1024  # Payload por segmento si el peer no negocia el MSS
+MAX_DGRAM = 2048     # Tamaño mínimo del buffer de recepción (handshake, ACKs con SACK)
 IDLE_TIME = 30.0
+SEND_BUFFER_LIMIT = 4 * WINDOW_SIZE * PAYLOAD_SIZE  # Bytes encolados antes de que send() bloquee en SR (escala con el MSS)
+SR_ATTEMPTS_LIMIT = 10  # Retransmisiones máximas por segmento SR
+ACK_EVERY = 2      # El receptor SR confirma cada N segmentos en orden...
+ACK_DELAY = 0.02   # ...o a lo sumo tras este tiempo (segundos)
+DUP_ACK_THRESHOLD = 3  # ACKs duplicados que disparan fast retransmit en SR
+MAX_SACK_BLOCKS = 16  # Cantidad máxima de rangos SACK por ACK
+# Cada bloque SACK es un par (start, end) de números de secuencia absolutos,
+# con end exclusivo, de datos recibidos por encima del ACK acumulativo.
+SACK_BLOCK_FORMAT = "!II"
+SACK_BLOCK_STRUCT = struct.Struct(SACK_BLOCK_FORMAT)
+SACK_BLOCK_SIZE = SACK_BLOCK_STRUCT.size
 # Formato del encabezado:
 # ! -> Network Byte Order (big-endian)
 # I -> Unsigned Integer (4 bytes) para número de secuencia
 # I -> Unsigned Integer (4 bytes) para número de ack
 # B -> Unsigned Char (1 byte) para flags
-# H -> Unsigned Short (2 bytes) para checksum (no implementado, pero reservado)
+# H -> Unsigned Short (2 bytes) para checksum (CRC32 del datagrama plegado a 16 bits)
 HEADER_FORMAT = "!IIBH"
-HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Struct precompilado: evita re-parsear el formato en cada paquete
+HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
+HEADER_SIZE = HEADER_STRUCT.size
+# El checksum cubre todo el datagrama (header con el campo en 0, CID y payload).
+# 0 significa "sin checksum" (peers viejos): un CRC que da 0 se manda como 0xFFFF, como en UDP.
+CHECKSUM_OFFSET = 9
+CHECKSUM_STRUCT = struct.Struct("!H")
+_CHECKSUM_END = CHECKSUM_OFFSET + CHECKSUM_STRUCT.size
+_ZERO_CHECKSUM = bytes(CHECKSUM_STRUCT.size)
+# Header extendido (FLAG_CID): el header normal seguido de un connection ID de 4 bytes.
+# En el SYN el cliente manda CID=0 para ofrecer el modo; el servidor asigna el CID en el SYN-ACK.
+CID_HEADER_FORMAT = HEADER_FORMAT + "I"
+CID_HEADER_STRUCT = struct.Struct(CID_HEADER_FORMAT)
+CID_HEADER_SIZE = CID_HEADER_STRUCT.size
+CID_STRUCT = struct.Struct("!I")
+# Tamaño del archivo en el handshake: al final del payload de OP (upload) y como payload
+# del ACK del FNAME (download). Si falta, el tamaño es desconocido (peers viejos).
+SIZE_STRUCT = struct.Struct("!Q")
+UNKNOWN_SIZE = 2**64 - 1
+# Reanudación: después del tamaño, el OP lleva (offset, verify) y el ACK del FNAME el
+# offset aceptado; cada lado agrega el digest SHA-256 del prefijo que tiene si corresponde:
+#   download: el cliente manda su offset y digest; el servidor contesta el offset aceptado (o 0)
+#   upload:   el cliente pide reanudar; el servidor contesta cuánto tiene y su digest
+RESUME_STRUCT = struct.Struct("!QB")
+OFFSET_STRUCT = struct.Struct("!Q")
+DIGEST_SIZE = 32
+NO_RESUME = 2**64 - 1  # offset del OP cuando sólo hace falta llegar a los campos siguientes
+# Compresión: el OP termina con (códec, nivel) pedidos y el ACK del FNAME con el códec
+# aceptado (CODEC_NONE si el servidor no lo soporta)
+COMPRESSION_STRUCT = struct.Struct("!BB")
+# Rango (offset, length) para transferir un archivo por varias conexiones en paralelo: va
+# al final del OP y el servidor lo devuelve (ajustado al archivo) al final del ACK del FNAME.
+# Los campos anteriores se completan con NO_RESUME / CODEC_NONE si no se usan.
+RANGE_STRUCT = struct.Struct("!QQ")
+NO_RANGE = (NO_RESUME, 0)
+# Sesión (varios archivos por una conexión, ver session.py): el OP termina con un byte en 1
+# y el ACK del FNAME con la cantidad de archivos que va a mandar el servidor (0 en upload).
+# El tamaño del ACK es el total de bytes de los archivos y el RANGE va con NO_RANGE.
+SESSION_STRUCT = struct.Struct("!I")
+# Digest de todo lo transferido: el emisor lo manda en el payload de su FIN y el receptor
+# contesta en el ACK de ese FIN si coincide con el suyo (DIGEST_OK / DIGEST_MISMATCH)
+STREAM_DIGEST = hashlib.sha256
+# Estados del cierre (ver Protocol.close y teardown.py)
+_FIN_WAIT, _FIN_WAIT_2, _LAST_ACK, _TIME_WAIT = range(4)
+DIGEST_OK = b"\x01"
+DIGEST_MISMATCH = b"\x00"
+# Fast open: el SYN lleva (largo del OP) + OP + FNAME después del MSS y el servidor contesta
+# en el SYN-ACK (también después del MSS) con FAST_OPEN_ACCEPTED + el payload del ACK del
+# FNAME, o rechaza con REJECT_FLAGS y el motivo como payload. Un SYN-ACK sin nada después
+# del MSS es de un servidor que no lo soporta (sin payload, ni siquiera negocia el MSS).
+FAST_OPEN_STRUCT = struct.Struct("!H")
+FAST_OPEN_ACCEPTED = b"\x01"
+MAX_SYN_PAYLOAD = MAX_DGRAM - CID_HEADER_SIZE
+# MSS (payload por segmento): el SYN empieza con el máximo del cliente y el SYN-ACK con el
+# acordado (el mínimo de los dos); el ACK final lo confirma. El máximo de cada lado es el
+# configurado o el que entra en el MTU de la ruta hacia el peer (sockets.path_mtu). Con un
+# peer que no lo anuncia se sigue usando PAYLOAD_SIZE.
+MSS_STRUCT = struct.Struct("!H")
+UDP_OVERHEAD = 28        # Headers IPv4 + UDP
+MAX_UDP_PAYLOAD = 65507
+MIN_MSS = 536
+MAX_MSS = MAX_UDP_PAYLOAD - CID_HEADER_SIZE
+# Sin --mss, el máximo también se limita para que el buffer del socket (SO_RCVBUF, que se
+# agranda si el kernel deja) retenga una ráfaga de estos datagramas sin descartarlos
+RCVBUF_SEGMENTS = 8
+# Probing del MTU del camino (opcional, lo hace el cliente entre el SYN-ACK y el ACK final):
+# datagramas PROBE_FLAGS con payload = su largo (MSS_STRUCT) + relleno, de los tamaños de
+# MTU_PLATEAUS (RFC 1191) que entran en el MSS acordado. El peer los devuelve iguales con
+# ACK, así que cada probe prueba los dos sentidos; se usa el mayor que volvió entero.
+PROBE_FLAGS = FLAG_SYN | FLAG_PSH
+MTU_PLATEAUS = (65535, 32000, 17914, 9000, 8166, 4352, 2002, 1500, 1492, 1280)
+PROBE_ROUNDS = 3         # Rondas de probes (las perdidas se repiten con el doble de espera)
+PROBE_MIN_WAIT = 0.05    # Espera mínima de una ronda, en segundos
+
+
+def _fold_crc(crc):
+    crc = (crc ^ (crc >> 16)) & 0xFFFF
+    return crc or 0xFFFF
+
+
+def seal_header(header, data=b""):
+    """Escribe en header (bytearray, con el campo checksum en 0) el checksum de header + data."""
+    crc = zlib.crc32(header)
+    if data:
+        crc = zlib.crc32(data, crc)
+    CHECKSUM_STRUCT.pack_into(header, CHECKSUM_OFFSET, _fold_crc(crc))
+
+
+def checksum_ok(datagram, nbytes=None):
+    """True si el datagrama (los primeros nbytes) llegó sano o no trae checksum."""
+    view = memoryview(datagram)
+    if nbytes is not None:
+        view = view[:nbytes]
+    received = CHECKSUM_STRUCT.unpack_from(view, CHECKSUM_OFFSET)[0]
+    if not received:
+        return True
+    crc = zlib.crc32(view[:CHECKSUM_OFFSET])
+    crc = zlib.crc32(_ZERO_CHECKSUM, crc)
+    crc = zlib.crc32(view[_CHECKSUM_END:], crc)
+    return _fold_crc(crc) == received
+
+
+class _Segment:
+    """Segmento SR en vuelo. data es un memoryview sobre el chunk original (sin copias)."""
+
+    __slots__ = ("data", "sent", "attempts", "sacked")
+
+    def __init__(self, data, sent):
+        self.data = data
+        self.sent = sent
+        self.attempts = 1
+        self.sacked = False
 
 
 class Protocol:
     STOP_AND_WAIT = 1
     SELECTIVE_REPEAT = 2
-    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    HEADER_SIZE = HEADER_STRUCT.size
 
-    def __init__(self, local_host="127.0.0.1", local_port=0, client=False, recovery_mode=STOP_AND_WAIT):
+    def __init__(self, local_host="127.0.0.1", local_port=0, client=False, recovery_mode=STOP_AND_WAIT,
+                 dup_ack_threshold=DUP_ACK_THRESHOLD, congestion=DEFAULT_CONGESTION,
+                 ack_every=ACK_EVERY, ack_delay=ACK_DELAY, offload=False, sock=None, shared=False,
+                 max_mss=None, probe_mtu=False):
         self.is_connected = False
         self.socket = None
         self.peer_address = None
@@ -43,32 +183,239 @@ class Protocol:
         self.ack_num = 0
         self.filename = None
         self.operation = None
+        self.rejected = False  # El servidor rechazó la conexión (ocupado o, con fast open, la transferencia)
+        self.reject_reason = None  # Motivo del rechazo de un fast open (None = servidor ocupado)
+        self.synack_pending = False  # Cliente: el servidor puede no haber visto aún el ACK final
+        self.peer_file_size = None  # Tamaño del archivo anunciado por el peer (None = desconocido)
+        # Reanudación: pedido del cliente (offset, verify, digest) y offset acordado
+        self.resume_request = None
+        self.resume_offset = 0
+        self.peer_digest = None
+        # Compresión: pedido del cliente (codec, level) y lo acordado (None = sin compresión)
+        self.compression_request = None
+        self.compression = None
+        # Rango del archivo de esta conexión: pedido (offset, length) y el aceptado por el servidor
+        self.range_request = None
+        self.byte_range = None
+        # Sesión: pedida por el cliente y aceptada por el servidor; session_files es la
+        # cantidad de archivos anunciada y session_entries las entradas del servidor en download
+        self.session_request = False
+        self.session = False
+        self.session_files = None
+        self.session_entries = None
+        self.ack_data = b""         # Payload del último ACK recibido por el emisor Stop & Wait
+        # MSS: tope local (None = el que entra en el MTU de la ruta) y el acordado con el peer
+        self.max_mss = max_mss
+        self.mss = PAYLOAD_SIZE
+        self.probe_mtu = probe_mtu  # Cliente: probar el camino antes de fijar el MSS
+        self.send_buffer_limit = SEND_BUFFER_LIMIT
+        self.probe_echoes = None    # Cliente: tamaños de los probes que el peer devolvió
+        self._final_ack = b""       # Payload del ACK final (el MSS elegido), para repetirlo
+        self.mss_unconfirmed = False  # Servidor: el cliente negocia el MSS y su ACK final no llegó aún
 
         self.recovery_mode = recovery_mode
         self.retransmission_timeout = 1
-        self.socket = Socket(local_host, local_port)
+        self.offload = offload
+        # sock permite inyectar otro transporte con la misma interfaz (p. ej. el del servidor asyncio)
+        self.socket = sock if sock is not None else Socket(local_host, local_port, offload=offload)
         if not client:
             self.socket.bind()
 
-        self.rto_estimator = RTOEstimator()
+        # Connection ID: None = conexión con socket propio (sin header extendido)
+        self.cid = None
+        self.rx_cid = None  # CID del último paquete recibido
+        self.shared = shared
+        self.demux = None
+        if shared and not client:
+            # Todas las conexiones usan el socket de escucha; un thread reparte por CID
+            from .demux import Demultiplexer
+            self.demux = Demultiplexer(self.socket)
+            self.demux.start()
+
+        # El RTO nunca baja del doble del ACK demorado, para no retransmitir segmentos que el peer retiene
+        self.rto_estimator = RTOEstimator(min_rto=2 * ack_delay)
+        self.congestion = congestion
+        self.cc = make_congestion_controller(congestion, PAYLOAD_SIZE, WINDOW_SIZE * PAYLOAD_SIZE)
+
+        # Segmentos fuera de orden del receptor SR: seq -> bytes.
+        # Vive en la conexión para no perder lo ya anunciado por SACK entre llamadas a recv().
+        self.sr_buffer = {}
+        # Datos ya confirmados en orden que no entraron en el buffer del llamador
+        self.rx_pending = bytearray()
+        self.peer_finished = False  # Llegó el FIN del peer
+        self.fin_ack_payload = b""  # Payload del ACK de ese FIN (veredicto del digest)
+        # Cierre en curso (ver close()); lo avanza el thread de teardown
+        self._close_state = None
+        self._teardown_deadline = None
+
+        # Política de ACKs del receptor SR (ACKs demorados y agrupados)
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.pending_acks = 0      # segmentos en orden aún sin confirmar
+        self.ack_deadline = None   # instante en que hay que mandar el ACK demorado
+        self.dup_ack_threshold = dup_ack_threshold
+
+        # Estado del emisor SR; persiste entre llamadas a send() para no vaciar el pipe por chunk
+        self.tx_unsent = deque()      # memoryviews de datos encolados aún no segmentados
+        self.tx_unsent_bytes = 0
+        self.snd_nxt = self.seq_num   # próximo seq a enviar
+        self.in_flight = {}           # seq -> _Segment (no confirmados acumulativamente)
+        self.in_flight_order = deque()  # seqs de in_flight en orden de envío (= orden de seq)
+        self.rtx_heap = []            # timers de retransmisión: (deadline, seq, attempts)
+        self.sacked_until = {}        # inicio de bloque SACK -> seq hasta donde ya se marcó
+        self.dup_acks = 0             # consecutive duplicate cumulative ACKs for send_base
+        self.recover = 0              # one window reduction per loss episode (until ACK passes recover)
+
+        # Contadores del emisor SR
+        self.stats = {
+            "timeout_retransmits": 0,
+            "fast_retransmits": 0,
+            "sack_skips": 0,  # Retransmisiones evitadas gracias a SACK
+            "checksum_drops": 0,  # Datagramas recibidos descartados por checksum inválido
+        }
+
+        # Digest de extremo a extremo de los datos de la transferencia (sin el handshake)
+        self.tx_digest = STREAM_DIGEST()
+        self.tx_stream_bytes = 0
+        self.rx_digest = STREAM_DIGEST()
+        self.peer_stream_digest = None  # Digest recibido en el FIN del peer
+        self.peer_verified = None       # Veredicto del peer sobre lo que le mandamos (None = no informó)
+
+        # Header de salida reutilizable; el payload viaja aparte (scatter-gather con sendmsg)
+        self._tx_header = bytearray(HEADER_SIZE)
+        self._tx_cid_header = bytearray(CID_HEADER_SIZE)
+        # Buffer de recepción reutilizable; el payload se entrega como memoryview sobre él
+        self._rx_buffer = bytearray(MAX_DGRAM)
+        self._rx_view = memoryview(self._rx_buffer)
 
     def send(self, data: bytes, type=STOP_AND_WAIT) -> int:
         if not self.is_connected:
             raise ConnectionError("Socket could not be connected")
 
+        self._digest_sent(data)
         if self._send_reliable_packet(FLAG_PSH, data, type=type):
             return len(data)
 
+    def flush(self) -> bool:
+        """Espera a que todo lo encolado por send() sea confirmado (sólo afecta a SR)."""
+        if self.in_flight or self.tx_unsent:
+            return self._flush_selective_repeat()
+        return True
+
+    def io_size(self, chunk_size):
+        """chunk_size redondeado a segmentos enteros del MSS acordado (lecturas del archivo y buffers de recv)."""
+        return -(-chunk_size // self.mss) * self.mss
+
+    def sendfile(self, file_manager, type=None, progress=None) -> int:
+        """Envía el archivo completo manteniendo la ventana llena durante toda la transferencia.
+
+        Args:
+            file_manager (FileManager): Archivo abierto en modo lectura.
+            type (int): Modo de recuperación; por defecto el de la conexión.
+            progress (callable): Opcional, recibe los bytes encolados hasta el momento.
+
+        Returns:
+            int: Bytes enviados y confirmados.
+        """
+        if type is None:
+            type = self.recovery_mode
+        total = 0
+        chunk = file_manager.read_chunk()
+        while chunk:
+            if not self.send(chunk, type=type):
+                raise ConnectionError("Data could not be delivered to the peer")
+            total += len(chunk)
+            if progress is not None:
+                progress(total)
+            chunk = file_manager.read_chunk()
+        if not self.flush():
+            raise ConnectionError("Data could not be delivered to the peer")
+        return total
+
+    def _digest_sent(self, data):
+        self.tx_digest.update(data)
+        self.tx_stream_bytes += len(data)
+
+    def stream_verified(self):
+        """Compara el digest que mandó el peer en su FIN con lo recibido (None si no mandó ninguno).
+
+        Llamarla después de que recv() devolvió todo (b"").
+        """
+        if self.peer_stream_digest is None:
+            return None
+        return self.peer_stream_digest == self.rx_digest.digest()
+
+    def _fin_payload(self):
+        """Payload de nuestro FIN: el digest de lo enviado, si se envió algo."""
+        return self.tx_digest.digest() if self.tx_stream_bytes else b""
+
+    def _on_peer_fin(self, data):
+        """Guarda el digest del FIN del peer y devuelve el payload para el ACK de ese FIN."""
+        self.peer_finished = True
+        if len(data) >= DIGEST_SIZE:
+            self.peer_stream_digest = bytes(data[:DIGEST_SIZE])
+        verified = self.stream_verified()
+        self.fin_ack_payload = b"" if verified is None else (DIGEST_OK if verified else DIGEST_MISMATCH)
+        return self.fin_ack_payload
+
+    def _on_fin_ack(self, data):
+        if len(data) >= 1:
+            self.peer_verified = bytes(data[:1]) == DIGEST_OK
+
     def recv(self, payload_size: int, type: int) -> bytes:
-        if not self.is_connected:
-            raise ConnectionError("Socket could not be connected.")
-        header, data = self._receive_reliable_packet(payload_size=payload_size, expected_flags=FLAG_PSH, type = type) 
-        if data:
-            return bytes(data)
+        """Recibe hasta payload_size bytes (b"" al terminar). Para evitar la copia, usar recv_into."""
+        buffer = bytearray(payload_size)
+        n = self.recv_into(buffer, type=type)
+        if n:
+            return bytes(memoryview(buffer)[:n])
         else:
             return b""
 
-    def connect(self, server_address, filename: str, fileop=0) -> bool:
+    def recv_into(self, buffer, type: int = None) -> int:
+        """Escribe el payload recibido directamente en buffer; devuelve la cantidad de bytes (0 al terminar)."""
+        if self.peer_finished or not self.is_connected:
+            if self.rx_pending:
+                return self._take_pending(memoryview(buffer))
+            if self.peer_finished:
+                return 0
+            raise ConnectionError("Socket could not be connected.")
+        if type is None:
+            type = self.recovery_mode
+        header, data = self._receive_reliable_packet(
+            payload_size=len(buffer), expected_flags=FLAG_PSH, type=type, out=buffer
+        )
+        return len(data)
+
+    def connect(self, server_address, filename: str, fileop=0, file_size=None,
+                resume_offset=None, resume_digest=None, compression=None, byte_range=None,
+                session=False) -> bool:
+        """Handshake con el servidor y envío de la operación y el nombre del archivo.
+
+        La operación y el nombre van en el SYN (fast open) y el servidor los acepta o
+        rechaza en el SYN-ACK; con un servidor que no lo soporta se mandan después del
+        handshake como antes. En ningún caso se espera un linger fijo tras el ACK final.
+
+        file_size (upload) se anuncia al servidor; en un download, el servidor anuncia el
+        suyo y queda en peer_file_size.
+
+        resume_offset pide reanudar: en un download es lo que ya hay localmente (con su
+        digest en resume_digest, opcional); en un upload se pasa 0 y el servidor contesta
+        cuánto tiene. El offset acordado queda en resume_offset y el digest del servidor
+        (upload) en peer_digest.
+
+        compression (codec, level) pide comprimir los datos; lo que acepta el servidor queda
+        en self.compression.
+
+        byte_range (offset, length) limita la transferencia a ese rango del archivo; el
+        rango que confirma el servidor queda en self.byte_range (None si no lo soporta).
+
+        session pide transferir varios archivos (ver session.py): filename es el directorio
+        remoto (upload) o los nombres separados por "\n" (download). Si el servidor acepta,
+        self.session queda en True y peer_file_size es el total de bytes de la sesión.
+
+        El MSS se negocia en el SYN/SYN-ACK y queda en self.mss; con self.probe_mtu, antes
+        del ACK final se prueba el camino con datagramas grandes (ver _probe_mss).
+        """
 
         self.peer_address = server_address
         self.filename = filename
@@ -76,6 +423,18 @@ class Protocol:
 
         client_isn = self.seq_num 
         self.ack_num = 0
+        self.compression_request = compression
+        self.range_request = byte_range
+        self.session_request = session
+        op = self._pack_op(fileop, file_size, resume_offset, resume_digest, compression, byte_range, session)
+        max_mss = self._local_max_mss(server_address)
+        # El servidor puede contestar (y devolver probes) con hasta max_mss bytes de payload
+        self._size_rx_buffer(max_mss)
+        syn_payload = self._pack_syn(max_mss, op, self.filename)
+        synack_data = b""
+        # CID=0 en el SYN ofrece el modo de socket compartido; un servidor que no lo
+        # soporta contesta sin FLAG_CID desde su puerto efímero y seguimos como siempre
+        self.cid = 0
 
         attempts = 6
         rto = float(self.retransmission_timeout)
@@ -84,7 +443,8 @@ class Protocol:
         while attempts > 0 and not synack_ok:
             saved_seq = self.seq_num
             self.seq_num = client_isn
-            self._send_packet(FLAG_SYN)
+            syn_sent = time.monotonic()
+            self._send_packet(FLAG_SYN, syn_payload)
             self.seq_num = saved_seq
             logger.vprint(f"[CLIENT] SYN (ISN={client_isn}) sent. Waiting SYN-ACK...")
 
@@ -93,12 +453,20 @@ class Protocol:
                 remaining = deadline - time.monotonic()
                 if remaining <= 0:
                     break
-                header, _, addr = self._receive_packet(max(0.0, remaining))
+                header, data, addr = self._receive_packet(max(0.0, remaining))
                 if not header:
                     continue
                 if addr[0] != server_address[0]:
                     logger.vprint(f"[CLIENT] Unexpected source {addr}, ignoring.")
                     continue
+                if (header[2] & REJECT_FLAGS) == REJECT_FLAGS and not (header[2] & FLAG_ACK):
+                    if header[1] == client_isn + 1:
+                        self.rejected = True
+                        self.reject_reason = bytes(data).decode("utf-8", errors="replace") or None
+                        logger.vprint(f"[CLIENT] Connection rejected: {self.reject_reason or 'server busy'}.")
+                        self.cid = None
+                        return False
+                    continue
                 if (header[2] & FLAG_SYN) and (header[2] & FLAG_ACK):
                     if header[1] != client_isn + 1:
                         logger.vprint(f"[CLIENT] SYN-ACK with unexpected ACK number{header[1]} (expected: {client_isn+1}). Ignoring.")
@@ -106,8 +474,10 @@ class Protocol:
                     server_isn = header[0]
                     # Set our post-SYN numbers
                     self.peer_address = addr
+                    self.cid = self.rx_cid if header[2] & FLAG_CID else None
                     self.seq_num = client_isn + 1
                     self.ack_num = server_isn + 1
+                    synack_data = bytes(data)
                     synack_ok = True
                     logger.vprint(f"[CLIENT] SYN-ACK ok: server_isn={server_isn}.")
                     break
@@ -122,79 +492,128 @@ class Protocol:
 
         if not synack_ok:
             logger.vprint("[CLIENT] Failed handshake: no SYN-ACK valid was received.")
+            self.cid = None
             return False
 
-        # --- 2) Send final ACK and LINGER to re-ACK duplicates ---
-        # We send the final ACK once, then listen briefly; if a duplicate SYN-ACK arrives,
-        # re-send the ACK so the server can transition to ESTABLISHED.
-        self._send_packet(FLAG_ACK)
-        logger.vprint("[CLIENT] final ACK sent. Linger for SYN-ACK duplicates ...")
-
-        linger_end = time.monotonic() + 2.0  # short linger window
-        while time.monotonic() < linger_end:
-            logger.vprint("[CLIENT] ")
-            remaining = linger_end - time.monotonic()
-            header, _, addr = self._receive_packet(max(0.0, remaining))
-            if not header:
-                continue
-            if addr != self.peer_address:
-                continue
-            if (header[2] & FLAG_SYN) and (header[2] & FLAG_ACK):
-                # Server likely missed our ACK; re-ACK
-                self.ack_num = header[0] + 1   # next expected from server
-                # Keep seq_num at client_isn+1 (no new data yet)
-                self._send_packet(FLAG_ACK)
-                logger.vprint("[CLIENT] Re-ACKing SYN-ACK duplicates.")
-            else:
-                # Ignore anything else in linger (no state advance yet)
-                pass
+        if len(synack_data) >= MSS_STRUCT.size:
+            # El servidor anunció el MSS acordado; el ACK final confirma el que se usa
+            self._set_mss(min(max_mss, MSS_STRUCT.unpack_from(synack_data)[0]))
+            synack_data = synack_data[MSS_STRUCT.size:]
+            if self.probe_mtu:
+                self._probe_mss(time.monotonic() - syn_sent)
+            self._final_ack = MSS_STRUCT.pack(self.mss)
+        else:
+            self._set_mss(PAYLOAD_SIZE)
+        logger.vprint(f"[CLIENT] MSS: {self.mss} bytes")
 
+        # --- 2) Final ACK, sin linger: si se pierde, el servidor repite el SYN-ACK y
+        # _receive_packet lo vuelve a confirmar desde cualquier estado de la conexión ---
+        self._send_packet(FLAG_ACK, self._final_ack)
+        self.synack_pending = True
+        self.is_connected = True
         logger.vprint(f"[CLIENT] Complete handshake with peer: {self.peer_address}")
 
-        # --- 3) Send OP and FNAME reliably (as you already do) ---
-        self.is_connected = True
-        chosen_protocol = self.recovery_mode
-        payload = bytes([fileop & 0xFF, chosen_protocol & 0xFF])
-        if not self._send_reliable_packet(FLAG_PSH | FLAG_OP, payload):
-            logger.vprint("[CLIENT] Operation could not be confirmed with the server.")
-            self.is_connected = False
-            return False
+        if synack_data[:1] == FAST_OPEN_ACCEPTED:
+            logger.vprint("[CLIENT] Fast open: operation and filename accepted in the SYN-ACK.")
+            self._unpack_transfer_reply(synack_data[1:])
+        else:
+            # --- 3) Servidor sin fast open: OP y FNAME como mensajes confiables aparte ---
+            if not self._send_reliable_packet(FLAG_PSH | FLAG_OP, op):
+                logger.vprint("[CLIENT] Operation could not be confirmed with the server.")
+                self.is_connected = False
+                return False
 
-        logger.vprint(f"[CLIENT] Sending filename: {self.filename}")
-        if not self._send_reliable_packet(FLAG_PSH | FLAG_FNAME, self.filename.encode("utf-8")):
-            logger.vprint("[CLIENT] Filename could not be sent to the server.")
-            self.is_connected = False
-            return False
+            logger.vprint(f"[CLIENT] Sending filename: {self.filename}")
+            if not self._send_reliable_packet(FLAG_PSH | FLAG_FNAME, self.filename.encode("utf-8")):
+                logger.vprint("[CLIENT] Filename could not be sent to the server.")
+                self.is_connected = False
+                return False
+            self._unpack_transfer_reply(self.ack_data)
+        if self.peer_file_size is not None:
+            logger.vprint(f"[CLIENT] Server file size: {self.peer_file_size} bytes")
+        if resume_offset is not None:
+            logger.vprint(f"[CLIENT] Resuming at offset {self.resume_offset}")
+        if compression is not None:
+            logger.vprint(f"[CLIENT] Compression: {self.compression or 'refused by the server'}")
+        if byte_range is not None:
+            logger.vprint(f"[CLIENT] Range: {self.byte_range or 'not supported by the server'}")
+        if session:
+            logger.vprint(f"[CLIENT] Session: {'accepted' if self.session else 'not supported by the server'}")
 
         logger.vprint(f"[CLIENT] Connection stablished with peer: {self.peer_address}")
         return True
 
     def accept(self):
+        """Espera un SYN y completa el handshake (bloqueante). Ver next_syn() y handshake()."""
+        header, address, syn_data = self.next_syn()
+        return self.handshake(header, address, syn_data=syn_data)
+
+    def next_syn(self):
+        """Bloquea hasta que llega un SYN al socket de escucha; devuelve (header, address, payload).
+
+        El payload (una copia) es el del fast open, vacío si el cliente no lo usa.
 
+        Es lo único que hace el camino de accept: el handshake se puede completar después
+        en otro thread con handshake(), sin frenar a los demás clientes.
+        """
         logger.vprint("[SERVER] Waiting for an SYN...")
 
         # 1) Wait for a SYN on the listening socket (block)
         while True:
-            header, _, address = self._receive_packet(timeout=None)
+            if self.demux is not None:
+                header, address, data = self.demux.next_syn()
+            else:
+                header, data, address = self._receive_packet(timeout=None)
             logger.vprint(f"[SERVER] Received: {header} from {address}")
-            if header and (header[2] & FLAG_SYN):
-                break
+            if header and (header[2] & FLAG_SYN) and not (header[2] & FLAG_ACK):
+                return header, address, bytes(data)
             logger.vprint("[SERVER] SYN expected. Ignoring packet.")
 
+    def reject(self, header, address):
+        """Rechaza el SYN de header (servidor ocupado) desde el socket de escucha."""
+        reply = bytearray(HEADER_SIZE)
+        HEADER_STRUCT.pack_into(reply, 0, 0, header[0] + 1, REJECT_FLAGS, 0)
+        seal_header(reply)
+        self.socket.sendto(reply, address)
+        logger.vprint(f"[SERVER] Server busy: SYN from {address} rejected.")
+
+    def handshake(self, header, address, fname_reply=None, syn_data=b""):
+        """Completa el handshake de un SYN recibido por next_syn() (SYN-ACK, ACK, OP y FNAME).
+
+        Args:
+            fname_reply (callable): Opcional, fname_reply(protocol, filename) arma el payload
+                del ACK del FNAME (ver pack_transfer_reply), con el OP ya procesado. Si
+                levanta ValueError/OSError, la transferencia se rechaza.
+            syn_data (bytes): Payload del SYN. Con fast open trae el OP y el FNAME, que se
+                contestan en el SYN-ACK.
+
+        Returns:
+            Protocol: La conexión con el cliente, o None si el handshake falló.
+        """
         client_isn = header[0]
         client_addr = address
 
-        # 2) Create per-client Protocol (new UDP socket on ephemeral port)
+        # 2) Create per-client Protocol
         local_host, _ = self.socket.addr
-        client_protocol = Protocol(local_host, 0, client=True)
-        client_protocol.socket.bind()
-
-        # Log the actual bound port (not the requested 0)
-        try:
-            bound_addr = client_protocol.socket.socket.getsockname()
-            logger.vprint(f"[SERVER] Per-connection socket in {bound_addr}")
-        except Exception:
-            pass
+        if self.demux is not None and header[2] & FLAG_CID:
+            # Shared listening socket: the client is reached through its connection ID
+            sock = self.demux.open(client_addr, client_isn)
+            client_protocol = Protocol(local_host, 0, client=True, congestion=self.congestion,
+                                       offload=self.offload, sock=sock, max_mss=self.max_mss)
+            client_protocol.cid = sock.cid
+            logger.vprint(f"[SERVER] Connection ID {sock.cid} on the listening socket")
+        else:
+            # New UDP socket on ephemeral port
+            client_protocol = Protocol(local_host, 0, client=True, congestion=self.congestion, offload=self.offload,
+                                       max_mss=self.max_mss)
+            client_protocol.socket.bind()
+
+            # Log the actual bound port (not the requested 0)
+            try:
+                bound_addr = client_protocol.socket.socket.getsockname()
+                logger.vprint(f"[SERVER] Per-connection socket in {bound_addr}")
+            except Exception:
+                pass
 
         client_protocol.peer_address = client_addr
         client_protocol.ack_num = client_isn + 1
@@ -202,6 +621,22 @@ class Protocol:
         # FIX: capture and reuse the same server ISN for all SYN-ACK retransmissions
         server_isn = client_protocol.seq_num
 
+        synack_data = b""
+        fast_open = client_protocol._accept_syn(syn_data, client_addr)
+        if len(syn_data) >= MSS_STRUCT.size:
+            synack_data = MSS_STRUCT.pack(client_protocol.mss)
+        if fast_open:
+            # Fast open: OP y FNAME vinieron en el SYN; se aceptan o rechazan ya mismo
+            try:
+                fname = client_protocol._unpack_fast_open(fast_open)
+                reply = fname_reply(client_protocol, fname) if fname_reply is not None else b""
+            except (ValueError, OSError) as e:
+                logger.vprint(f"[SERVER] Fast open from {client_addr} refused: {e}")
+                client_protocol._send_packet(REJECT_FLAGS, str(e).encode("utf-8")[:PAYLOAD_SIZE], seq=0)
+                client_protocol.close()
+                return None
+            synack_data += FAST_OPEN_ACCEPTED + reply
+
         attempts = 6
         rto = float(self.retransmission_timeout)  # e.g., 2s
 
@@ -209,7 +644,7 @@ class Protocol:
             # 3) Send SYN-ACK with a FIXED server ISN
             saved = client_protocol.seq_num
             client_protocol.seq_num = server_isn
-            client_protocol._send_packet(FLAG_SYN | FLAG_ACK)
+            client_protocol._send_packet(FLAG_SYN | FLAG_ACK, synack_data)
             client_protocol.seq_num = saved
             logger.vprint(f"[SERVER] SYN-ACK (ISN={server_isn}) enviado a {client_addr}")
 
@@ -219,7 +654,7 @@ class Protocol:
                 remaining = deadline - time.monotonic()
                 if remaining <= 0:
                     break
-                hdr, _, addr = client_protocol._receive_packet(max(0.0, remaining))
+                hdr, data, addr = client_protocol._receive_packet(max(0.0, remaining))
                 if not hdr:
                     continue
                 if addr != client_addr:
@@ -231,33 +666,48 @@ class Protocol:
                     logger.vprint("[SERVER] duplicate SYN; re-sending SYN-ACK.")
                     saved = client_protocol.seq_num
                     client_protocol.seq_num = server_isn
-                    client_protocol._send_packet(FLAG_SYN | FLAG_ACK)
+                    client_protocol._send_packet(FLAG_SYN | FLAG_ACK, synack_data)
                     client_protocol.seq_num = saved
                     continue
 
-                # Final ACK from client; validate ACK number
-                if (hdr[2] & FLAG_ACK) and hdr[1] == server_isn + 1:
+                # Final ACK from client, or its first segment if the ACK got lost (it will
+                # be retransmitted); validate ACK number
+                if (hdr[2] & (FLAG_ACK | FLAG_PSH)) and hdr[1] == server_isn + 1:
+                    if not client_protocol._on_final_ack(hdr, data):
+                        logger.vprint("[SERVER] data before the final ACK; re-sending SYN-ACK for the MSS.")
+                        client_protocol._send_packet(FLAG_SYN | FLAG_ACK, synack_data, seq=server_isn)
+                        continue
                     logger.vprint("[SERVER] final ACK OK. Completed handshake.")
                     client_protocol.seq_num = server_isn + 1
                     client_protocol.is_connected = True
+                    if fast_open:
+                        logger.vprint(f"[SERVER] Fast open from peer:{client_protocol.peer_address}, filename: {client_protocol.filename}")
+                        return client_protocol
                     # Ready to receive OP/FNAME using the per-client socket
                     # Receive OP
                     hdr, data = client_protocol._receive_reliable_packet(expected_flags=FLAG_OP, payload_size=PAYLOAD_SIZE)
                     if not hdr or not (hdr[2] & FLAG_OP) or not data:
                         client_protocol.close(); return None
-                    if len(data) >= 2:
-                        client_protocol.operation = data[0]
-                        client_protocol.recovery_mode = data[1]
-                    else:
-                        client_protocol.operation = data[0]
-                        client_protocol.recovery_mode = self.STOP_AND_WAIT
+                    client_protocol._unpack_op(data)
 
                     # Receive FNAME
-                    hdr, data = client_protocol._receive_reliable_packet(expected_flags=FLAG_FNAME, payload_size=PAYLOAD_SIZE)
+                    def reply(fname_data):
+                        if fname_reply is None:
+                            return b""
+                        fname = bytes(fname_data).decode('utf-8', errors='replace').strip()
+                        return fname_reply(client_protocol, fname) if fname else b""
+
+                    try:
+                        hdr, data = client_protocol._receive_reliable_packet(expected_flags=FLAG_FNAME,
+                                                                             payload_size=PAYLOAD_SIZE, reply=reply)
+                    except (ValueError, OSError) as e:
+                        logger.vprint(f"[SERVER] Transfer from {client_addr} refused: {e}")
+                        client_protocol.close()
+                        return None
                     if not hdr or not (hdr[2] & FLAG_FNAME) or not data:
                         client_protocol.close(); return None
 
-                    fname = data.decode('utf-8', errors='replace').strip()
+                    fname = bytes(data).decode('utf-8', errors='replace').strip()
                     if not fname:
                         logger.vprint("[SERVER] Empty filename.")
                         client_protocol.close()
@@ -280,122 +730,506 @@ class Protocol:
         return None
 
 
-    def close(self, attempts: int = 6, linger: float = None):
+    def close(self, attempts: int = 6, linger: float = None, wait: bool = True):
         """
-        Reliable half/whole close:
-          1) Send FIN reliably (retransmit with RTO/backoff) until ACKed.
-          2) ACK the peer's FIN (whenever it arrives; possibly together with our ACK).
-          3) TIME-WAIT: linger briefly to re-ACK duplicate FINs.
+        Cierre rápido; el resto del intercambio corre en el thread compartido de teardown:
+          1) FIN con el digest de lo enviado o, si el peer ya cerró, FIN+ACK en un solo
+             paquete (LAST-ACK), retransmitido con RTO/backoff hasta que lo confirmen.
+          2) Si el peer todavía no cerró, se espera su FIN (linger) y se lo confirma.
+          3) TIME-WAIT: se re-ACKean FINs duplicados durante un rato.
+
+        Con wait, vuelve cuando el peer confirmó nuestro FIN (o se agotaron los intentos),
+        así peer_verified ya tiene su veredicto; sin wait vuelve apenas sale el FIN.
         """
         if not self.socket:
             return
+        if sys.is_finalizing():
+            # El intérprete se está cerrando: ya no se pueden arrancar threads
+            self._close_now()
+            return
+
+        if not self.is_connected:
+            # Best-effort TIME-WAIT anyway
+            self.socket.close()
+            logger.vprint("Socket has been closed.")
+            return
 
         try:
-            if not self.is_connected:
-                # Best-effort TIME-WAIT anyway
-                self.socket.close()
-                logger.vprint("Socket has been closed.")
-                return
-
-            fin_seq = self.seq_num
-            fin_acked = False
-            peer_fin_seen = False
-
-            rto = max(0.3, float(self.rto_estimator.get_timeout()))
-            tries = attempts
-
-            # 1) Send FIN reliably
-            while tries > 0 and not fin_acked:
-                t0 = time.time()
-                self._send_packet(FLAG_FIN)
-
-                deadline = time.monotonic() + rto
-                while time.monotonic() < deadline:
-                    header, _, addr = self._receive_packet(deadline - time.monotonic())
-                    if not header or addr != self.peer_address:
-                        continue
+            # Drain anything still queued in the SR window before our FIN
+            self.flush()
+        except Exception:
+            self.is_connected = False
+            self.socket.close()
+            raise
+        self.is_connected = False
 
-                    flags = header[2]
+        fin_payload = self._fin_payload()
+        if self.peer_finished:
+            # El peer ya cerró: nuestro FIN va junto con el ACK del suyo
+            self._close_state = _LAST_ACK
+            self._fin_packet = (FLAG_FIN | FLAG_ACK, fin_payload + self.fin_ack_payload)
+        else:
+            self._close_state = _FIN_WAIT
+            self._fin_packet = (FLAG_FIN, fin_payload)
+        self._fin_seq = self.seq_num
+        self._close_tries = attempts
+        self._fin_linger = linger
+        self._fin_done = threading.Event()
+        rto = max(0.3, float(self.rto_estimator.get_timeout()))
+        self._fin_sent = time.time()
+        self._send_packet(*self._fin_packet)
+        self._teardown_deadline = time.monotonic() + rto
+        teardown.add(self)
+        if wait:
+            self._fin_done.wait()
+
+    def _teardown_step(self):
+        """Un paso del cierre (ver close() y Teardown): procesa lo recibido y el timer.
+
+        Devuelve el próximo deadline (time.monotonic()) o None cuando terminó de cerrar.
+        """
+        while self._close_state is not None:
+            header, data, addr = self._receive_packet(0)
+            if not header:
+                break
+            if addr == self.peer_address:
+                self._on_teardown_packet(header, data)
+        if self._close_state is None:
+            return None
+        now = time.monotonic()
+        if now < self._teardown_deadline:
+            return self._teardown_deadline
+        if self._close_state in (_FIN_WAIT, _LAST_ACK):
+            self._close_tries -= 1
+            if self._close_tries > 0:
+                self.rto_estimator.backoff()
+                self._send_packet(*self._fin_packet)
+                self._teardown_deadline = now + min(8.0, self.rto_estimator.get_timeout())
+                return self._teardown_deadline
+            logger.vprint("Connection closure best-effort (FIN not confirmed).")
+        elif self._close_state == _FIN_WAIT_2:
+            logger.vprint("Connection closure (FIN ACKed) confirmed, FIN was not received.")
+        self._close_state = None
+        self._fin_done.set()
+        return None
 
-                    # ACK for our FIN?
-                    if (flags & FLAG_ACK) and header[1] >= fin_seq + 1:
-                        fin_acked = True
-                        self.rto_estimator.note_sample(time.time() - t0)
-                        self.seq_num = header[1]  # keep seq in sync
-                        break
+    def _on_teardown_packet(self, header, data):
+        flags = header[2]
+        now = time.monotonic()
+        acked = flags & FLAG_ACK and header[1] >= self._fin_seq + 1
+        state = self._close_state
+
+        if state == _FIN_WAIT:
+            fin_data, ack_data = (data, data)
+            if flags & FLAG_FIN and flags & FLAG_ACK:
+                fin_data, ack_data = self._split_fin_ack(data)
+            if acked:
+                self.rto_estimator.note_sample(time.time() - self._fin_sent)
+                self.seq_num = header[1]  # keep seq in sync
+                self._on_fin_ack(ack_data)
+                self._fin_done.set()
+                self._close_state = _FIN_WAIT_2
+                wait_for_fin = (self._fin_linger if self._fin_linger is not None
+                                else max(1.0, 2.0 * self.rto_estimator.get_timeout()))
+                self._teardown_deadline = now + wait_for_fin
+            if flags & FLAG_FIN:
+                self.ack_num = header[0] + 1
+                self._send_packet(FLAG_ACK, self._on_peer_fin(fin_data))
+            if self._close_state == _FIN_WAIT_2 and self.peer_finished:
+                self._time_wait(now)
+        elif state == _FIN_WAIT_2:
+            if flags & FLAG_FIN:
+                self.ack_num = header[0] + 1
+                self._send_packet(FLAG_ACK, self._on_peer_fin(data))
+                self._time_wait(now)
+        elif state == _LAST_ACK:
+            if acked:
+                self._on_fin_ack(data)
+                logger.vprint("Connection closure (FIN+ACK ACKed) confirmed.")
+                self._close_state = None
+                self._fin_done.set()
+            elif flags & FLAG_FIN:
+                # El peer no recibió nuestro FIN+ACK
+                self._send_packet(*self._fin_packet)
+        elif state == _TIME_WAIT and flags & FLAG_FIN:
+            self.ack_num = header[0] + 1
+            self._send_packet(FLAG_ACK, self.fin_ack_payload)
+
+    def _time_wait(self, now):
+        logger.vprint("Connection closure (FIN ACKed) confirmed, FIN from peer was received.")
+        self._close_state = _TIME_WAIT
+        self._teardown_deadline = now + max(0.5, self.rto_estimator.get_timeout())
+
+    def _teardown_done(self):
+        self._close_state = None
+        self.socket.close()
+        logger.vprint("Socket has been closed.")
+
+    @staticmethod
+    def _split_fin_ack(data):
+        """(payload del FIN, payload del ACK) de un FIN+ACK: el digest (si hay) y el veredicto."""
+        if len(data) >= DIGEST_SIZE:
+            return data[:DIGEST_SIZE], data[DIGEST_SIZE:]
+        return b"", data
+
+    def _pack_syn(self, max_mss, op, filename):
+        """Payload del SYN: el MSS máximo y, si entran en el datagrama, OP y FNAME (fast open)."""
+        payload = MSS_STRUCT.pack(max_mss)
+        fast_open = FAST_OPEN_STRUCT.pack(len(op)) + op + filename.encode("utf-8")
+        if len(payload) + len(fast_open) <= MAX_SYN_PAYLOAD:
+            payload += fast_open
+        return payload
+
+    def _accept_syn(self, data, address):
+        """Adopta el MSS del SYN de un cliente (el mínimo con el nuestro); devuelve el resto (fast open).
+
+        Un SYN sin payload es de un cliente que no negocia el MSS: se queda en PAYLOAD_SIZE.
+        """
+        if len(data) < MSS_STRUCT.size:
+            return b""
+        peer_mss = MSS_STRUCT.unpack_from(data)[0]
+        self._set_mss(max(MIN_MSS, min(peer_mss, self._local_max_mss(address))))
+        self.mss_unconfirmed = True
+        return data[MSS_STRUCT.size:]
 
-                    # Peer FIN (maybe together with ACK)
-                    if flags & FLAG_FIN:
-                        self.ack_num = header[0] + 1
-                        self._send_packet(FLAG_ACK)
-                        peer_fin_seen = True
-                        # keep waiting in this window; we still need our FIN ACK
+    def _on_final_ack(self, header, data):
+        """ACK final del handshake: puede traer el MSS que eligió el cliente tras el probing.
 
-                if not fin_acked:
-                    self.rto_estimator.backoff()
-                    rto = min(8.0, self.rto_estimator.get_timeout())
-                    tries -= 1
-
-            # 2) If we haven't seen peer FIN yet, wait a bit for it and ACK it
-            wait_for_fin = (linger if linger is not None
-                            else max(1.0, 2.0 * self.rto_estimator.get_timeout()))
-            end = time.monotonic() + wait_for_fin
-            while time.monotonic() < end:
-                header, _, addr = self._receive_packet(end - time.monotonic())
-                if header and addr == self.peer_address and (header[2] & FLAG_FIN):
-                    self.ack_num = header[0] + 1
-                    self._send_packet(FLAG_ACK)
-                    peer_fin_seen = True
-                    # Keep looping: this doubles as TIME-WAIT too
-
-            # 3) Short TIME-WAIT to re-ACK duplicate FINs
-            tw = max(0.5, self.rto_estimator.get_timeout())
-            tw_end = time.monotonic() + tw
-            while time.monotonic() < tw_end:
-                header, _, addr = self._receive_packet(tw_end - time.monotonic())
-                if header and addr == self.peer_address and (header[2] & FLAG_FIN):
-                    self.ack_num = header[0] + 1
-                    self._send_packet(FLAG_ACK)
+        Devuelve False si en su lugar llegó un segmento de datos de un cliente que negocia
+        el MSS: el ACK final se perdió y con él el MSS. El servidor descarta el segmento y
+        repite el SYN-ACK, así el cliente vuelve a mandar el ACK final (y reenvía el segmento).
+        """
+        if header[2] & FLAG_PSH:
+            return not self.mss_unconfirmed
+        if len(data) >= MSS_STRUCT.size:
+            mss = MSS_STRUCT.unpack_from(data)[0]
+            if MIN_MSS <= mss < self.mss:
+                self._set_mss(mss)
+        self.mss_unconfirmed = False
+        return True
 
-            logger.vprint(
-                "Connection closure"
-                + ("(FIN ACKed) confirmed" if fin_acked else "best-effort (FIN not confirmed)")
-                + (", FIN from peer was received" if peer_fin_seen else ", FIN was not received")
-                + "."
-            )
+    def _local_max_mss(self, address):
+        """MSS máximo que anunciamos a address: el configurado o el que entra en el MTU de la ruta."""
+        if self.max_mss:
+            return max(MIN_MSS, min(self.max_mss, MAX_MSS))
+        mtu = path_mtu(address)
+        if mtu is None:
+            return PAYLOAD_SIZE
+        mss = min(mtu - UDP_OVERHEAD - CID_HEADER_SIZE, MAX_MSS)
+        grow = getattr(self.socket, "grow_receive_buffer", None)
+        rcvbuf = grow(RCVBUF_SEGMENTS * (CID_HEADER_SIZE + mss)) if grow is not None else None
+        if rcvbuf is not None:
+            mss = min(mss, rcvbuf // RCVBUF_SEGMENTS - CID_HEADER_SIZE)
+        return max(MIN_MSS, mss)
+
+    def _set_mss(self, mss):
+        """Adopta el MSS acordado: segmentación, ventanas, control de congestión y buffer de recepción."""
+        self.mss = mss
+        self.send_buffer_limit = 4 * WINDOW_SIZE * mss
+        self.cc = make_congestion_controller(self.congestion, mss, WINDOW_SIZE * mss)
+        self._size_rx_buffer(mss)
+
+    def _size_rx_buffer(self, mss):
+        """Ajusta el buffer de _receive_packet a un datagrama con mss bytes de payload.
+
+        Un datagrama más grande que el buffer llega truncado y se descarta por checksum.
+        """
+        size = max(MAX_DGRAM, CID_HEADER_SIZE + mss)
+        if len(self._rx_buffer) != size:
+            self._rx_buffer = bytearray(size)
+            self._rx_view = memoryview(self._rx_buffer)
 
-        finally:
-            self.is_connected = False
-            self.socket.close()
+    def _probe_mss(self, rtt):
+        """Prueba el camino con datagramas grandes y baja self.mss al mayor que volvió entero.
+
+        Corre antes del ACK final, cuando el servidor todavía no manda datos. Los probes
+        perdidos se repiten en la ronda siguiente; si no vuelve ninguno, se usa el menor
+        entre el MSS acordado y PAYLOAD_SIZE.
+        """
+        sizes = {mtu - UDP_OVERHEAD - CID_HEADER_SIZE for mtu in MTU_PLATEAUS}
+        sizes = sorted((s for s in sizes | {self.mss} if MIN_MSS <= s <= self.mss), reverse=True)
+        self.probe_echoes = set()
+        wait = max(PROBE_MIN_WAIT, 4 * rtt)
+        for _ in range(PROBE_ROUNDS):
+            pending = [size for size in sizes if size > max(self.probe_echoes, default=0)]
+            if not pending:
+                break
+            for size in pending:
+                self._send_packet(PROBE_FLAGS, MSS_STRUCT.pack(size) + bytes(size - MSS_STRUCT.size))
+            deadline = time.monotonic() + wait
+            # Si vuelve el mayor de los pendientes no hay nada mejor que esperar
+            while pending[0] not in self.probe_echoes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._receive_packet(remaining)
+            wait *= 2
+        best = max(self.probe_echoes, default=min(self.mss, PAYLOAD_SIZE))
+        logger.vprint(f"[CLIENT] MTU probing: {sorted(self.probe_echoes)} came back; MSS {self.mss} -> {best}")
+        self.probe_echoes = None
+        if best != self.mss:
+            self._set_mss(best)
+
+    def _on_probe(self, header, data):
+        """Probe de MTU: se devuelve igual; la respuesta (con ACK) se anota en probe_echoes."""
+        if len(data) < MSS_STRUCT.size or MSS_STRUCT.unpack_from(data)[0] != len(data):
+            return
+        if header[2] & FLAG_ACK:
+            if self.probe_echoes is not None:
+                self.probe_echoes.add(len(data))
+        else:
+            self._send_packet(PROBE_FLAGS | FLAG_ACK, data)
+
+    def _unpack_fast_open(self, data):
+        """Procesa el OP y el FNAME de un SYN con fast open; devuelve el nombre."""
+        if len(data) < FAST_OPEN_STRUCT.size:
+            raise ValueError("Malformed fast open SYN")
+        end = FAST_OPEN_STRUCT.size + FAST_OPEN_STRUCT.unpack_from(data)[0]
+        if end == FAST_OPEN_STRUCT.size or len(data) <= end:
+            raise ValueError("Malformed fast open SYN")
+        self._unpack_op(data[FAST_OPEN_STRUCT.size:end])
+        fname = bytes(data[end:]).decode("utf-8", errors="replace").strip()
+        if not fname:
+            raise ValueError("Empty filename")
+        self.filename = fname
+        return fname
+
+    def _pack_op(self, fileop, file_size=None, resume_offset=None, resume_digest=None, compression=None,
+                 byte_range=None, session=False):
+        """Payload del OP: operación, modo de recuperación, tamaño, reanudación, compresión, rango y sesión."""
+        payload = bytes([fileop & 0xFF, self.recovery_mode & 0xFF])
+        if session and byte_range is None:
+            byte_range = NO_RANGE
+        if file_size is None and resume_offset is None and compression is None and byte_range is None:
+            return payload
+        payload += SIZE_STRUCT.pack(UNKNOWN_SIZE if file_size is None else file_size)
+        if resume_offset is not None:
+            # verify: en download, el digest va a continuación; en upload, se pide el del servidor
+            payload += RESUME_STRUCT.pack(resume_offset, 1 if fileop != 1 or resume_digest else 0)
+            if resume_digest:
+                payload += resume_digest
+        elif compression is not None or byte_range is not None:
+            payload += RESUME_STRUCT.pack(NO_RESUME, 0)
+        if compression is not None:
+            payload += COMPRESSION_STRUCT.pack(*compression)
+        elif byte_range is not None:
+            payload += COMPRESSION_STRUCT.pack(CODEC_NONE, 0)
+        if byte_range is not None:
+            payload += RANGE_STRUCT.pack(*byte_range)
+        if session:
+            payload += b"\x01"
+        return payload
+
+    def _unpack_op(self, data):
+        self.operation = data[0]
+        self.recovery_mode = data[1] if len(data) >= 2 else self.STOP_AND_WAIT
+        pos = 2
+        if len(data) >= pos + SIZE_STRUCT.size:
+            size = SIZE_STRUCT.unpack_from(data, pos)[0]
+            self.peer_file_size = None if size == UNKNOWN_SIZE else size
+            pos += SIZE_STRUCT.size
+        if len(data) >= pos + RESUME_STRUCT.size:
+            offset, verify = RESUME_STRUCT.unpack_from(data, pos)
+            pos += RESUME_STRUCT.size
+            digest = None
+            if len(data) >= pos + DIGEST_SIZE:
+                digest = bytes(data[pos:pos + DIGEST_SIZE])
+                pos += DIGEST_SIZE
+            if offset != NO_RESUME:
+                self.resume_request = (offset, bool(verify), digest)
+        if len(data) >= pos + COMPRESSION_STRUCT.size:
+            compression = COMPRESSION_STRUCT.unpack_from(data, pos)
+            pos += COMPRESSION_STRUCT.size
+            if compression[0] != CODEC_NONE:
+                self.compression_request = compression
+        if len(data) >= pos + RANGE_STRUCT.size:
+            byte_range = RANGE_STRUCT.unpack_from(data, pos)
+            pos += RANGE_STRUCT.size
+            if byte_range != NO_RANGE:
+                self.range_request = byte_range
+        if len(data) > pos:
+            self.session_request = data[pos] == 1
+
+    def pack_transfer_reply(self, file_size=None, resume_offset=None, digest=None, codec=None, byte_range=None,
+                            session_files=None):
+        """Payload del ACK del FNAME: tamaño del archivo, offset de reanudación, códec, rango y sesión."""
+        if session_files is not None and byte_range is None:
+            byte_range = NO_RANGE
+        if byte_range is not None and codec is None:
+            codec = CODEC_NONE
+        if resume_offset is None and codec is None:
+            return SIZE_STRUCT.pack(file_size) if file_size is not None else b""
+        payload = SIZE_STRUCT.pack(UNKNOWN_SIZE if file_size is None else file_size)
+        payload += OFFSET_STRUCT.pack(resume_offset or 0)
+        if digest:
+            payload += digest
+        if codec is not None:
+            payload += bytes([codec])
+        if byte_range is not None:
+            payload += RANGE_STRUCT.pack(*byte_range)
+        if session_files is not None:
+            payload += SESSION_STRUCT.pack(session_files)
+        return payload
+
+    def _unpack_transfer_reply(self, data):
+        pos = 0
+        if len(data) >= SIZE_STRUCT.size:
+            size = SIZE_STRUCT.unpack_from(data)[0]
+            self.peer_file_size = None if size == UNKNOWN_SIZE else size
+            pos = SIZE_STRUCT.size
+        if len(data) >= pos + OFFSET_STRUCT.size:
+            self.resume_offset = OFFSET_STRUCT.unpack_from(data, pos)[0]
+            pos += OFFSET_STRUCT.size
+            if len(data) >= pos + DIGEST_SIZE:
+                self.peer_digest = bytes(data[pos:pos + DIGEST_SIZE])
+                pos += DIGEST_SIZE
+            if len(data) > pos:
+                if self.compression_request is not None and data[pos] != CODEC_NONE:
+                    self.compression = (data[pos], self.compression_request[1])
+                pos += 1
+            if len(data) >= pos + RANGE_STRUCT.size:
+                byte_range = RANGE_STRUCT.unpack_from(data, pos)
+                pos += RANGE_STRUCT.size
+                if byte_range != NO_RANGE:
+                    self.byte_range = byte_range
+            if self.session_request and len(data) >= pos + SESSION_STRUCT.size:
+                self.session = True
+                self.session_files = SESSION_STRUCT.unpack_from(data, pos)[0]
 
     def _pack_header(self, seq, ack, flags):
-        return struct.pack(HEADER_FORMAT, seq, ack, flags, 0)
+        header = bytearray(HEADER_SIZE)
+        HEADER_STRUCT.pack_into(header, 0, seq, ack, flags, 0)
+        seal_header(header)
+        return bytes(header)
 
     def _unpack_header(self, header_bytes):
-        return struct.unpack(HEADER_FORMAT, header_bytes)
+        return HEADER_STRUCT.unpack(header_bytes)
+
+    def _pack_sack_blocks(self, expected_seq):
+        """Arma los bloques SACK a partir del buffer fuera de orden del receptor."""
+        blocks = []
+        start = end = None
+        for seq in sorted(self.sr_buffer):
+            if seq < expected_seq:
+                continue
+            seg_end = seq + len(self.sr_buffer[seq])
+            if start is not None and seq == end:
+                end = seg_end
+                continue
+            if start is not None:
+                blocks.append((start, end))
+            start, end = seq, seg_end
+        if start is not None:
+            blocks.append((start, end))
+        # Los bloques más altos son los más recientes y los más útiles para el emisor
+        blocks = blocks[-MAX_SACK_BLOCKS:]
+        return b"".join(SACK_BLOCK_STRUCT.pack(a, b) for a, b in blocks)
+
+    def _unpack_sack_blocks(self, data):
+        blocks = []
+        for off in range(0, len(data) - SACK_BLOCK_SIZE + 1, SACK_BLOCK_SIZE):
+            blocks.append(SACK_BLOCK_STRUCT.unpack_from(data, off))
+        return blocks
+
+    def _send_sr_ack(self, expected_seq):
+        """ACK acumulativo del receptor SR, con bloques SACK si hay huecos."""
+        self.ack_num = expected_seq
+        self.pending_acks = 0
+        self.ack_deadline = None
+        sack = self._pack_sack_blocks(expected_seq)
+        if sack:
+            self._send_packet(FLAG_ACK | FLAG_SACK, sack)
+        else:
+            self._send_packet(FLAG_ACK)
 
-    def _send_packet(self, flags, data=b""):
-        header = self._pack_header(self.seq_num, self.ack_num, flags)
-        payload_len = len(data) if data else 0
-        logger.vprint(
-            f"-> Sending [SEQ={self.seq_num}, ACK={self.ack_num}, Flags={bin(flags)}, LEN={payload_len}] a {self.peer_address}"
-        )
-        self.socket.sendto(header + data, self.peer_address)
+    def _delay_sr_ack(self, expected_seq):
+        """Segmento en orden: confirmar cada ack_every segmentos o al vencer ack_delay."""
+        self.ack_num = expected_seq
+        self.pending_acks += 1
+        if self.pending_acks >= self.ack_every:
+            self._send_sr_ack(expected_seq)
+        elif self.ack_deadline is None:
+            self.ack_deadline = time.monotonic() + self.ack_delay
+
+    def _send_packet(self, flags, data=b"", seq=None):
+        if seq is None:
+            seq = self.seq_num
+        if self.cid is None:
+            header = self._tx_header
+            HEADER_STRUCT.pack_into(header, 0, seq, self.ack_num, flags, 0)
+        else:
+            header = self._tx_cid_header
+            CID_HEADER_STRUCT.pack_into(header, 0, seq, self.ack_num, flags | FLAG_CID, 0, self.cid)
+        seal_header(header, data)
+        if logger.verbose:
+            payload_len = len(data) if data else 0
+            logger.vprint(
+                f"-> Sending [SEQ={seq}, ACK={self.ack_num}, Flags={bin(flags)}, LEN={payload_len}] a {self.peer_address}"
+            )
+        # Scatter-gather: the payload is never copied into a concatenated datagram
+        self.socket.sendmsg((header, data) if data else (header,), self.peer_address)
+
+    def _send_segments(self, flags, segments):
+        """Envía varios segmentos [(seq, data)]; con GSO salen en una sola syscall."""
+        if not self.socket.gso or len(segments) < 2:
+            for seq, data in segments:
+                self._send_packet(flags, data, seq=seq)
+            return
+        if self.cid is None:
+            header_struct, extra = HEADER_STRUCT, ()
+        else:
+            header_struct, extra = CID_HEADER_STRUCT, (self.cid,)
+            flags |= FLAG_CID
+        datagrams = []
+        for seq, data in segments:
+            header = bytearray(header_struct.size)
+            header_struct.pack_into(header, 0, seq, self.ack_num, flags, 0, *extra)
+            seal_header(header, data)
+            datagrams.append((header, data))
+        self.socket.sendmsg_batch(datagrams, self.peer_address)
 
     def _receive_packet(self, timeout):
-        self.socket.socket.settimeout(timeout)
+        """Recibe un datagrama en el buffer reutilizable de la conexión.
+
+        El payload devuelto es un memoryview sobre ese buffer: sólo es válido hasta la
+        próxima llamada, así que quien quiera guardarlo tiene que copiarlo.
+        """
+        self.socket.settimeout(timeout)
         try:
-            packet, address = self.socket.recvfrom(MAX_DGRAM)
-            if len(packet) < HEADER_SIZE:
+            nbytes, address = self.socket.recvfrom_into(self._rx_buffer)
+            if nbytes < HEADER_SIZE:
                 logger.vprint(
-                    f"Received packet too short ({len(packet)} bytes). Ignoring."
+                    f"Received packet too short ({nbytes} bytes). Ignoring."
                 )
                 return None, None, None
-            header = self._unpack_header(packet[:HEADER_SIZE])
-            data = packet[HEADER_SIZE:]
-            logger.vprint(
-                f"<- Received [SEQ={header[0]}, ACK={header[1]}, Flags={bin(header[2])}, LEN={len(data)}] from addr: {address}"
-            )
+            if not checksum_ok(self._rx_buffer, nbytes):
+                self.stats["checksum_drops"] += 1
+                logger.vprint(f"Received corrupted packet from {address} (bad checksum). Dropping.")
+                return None, None, None
+            header = HEADER_STRUCT.unpack_from(self._rx_buffer, 0)
+            offset = HEADER_SIZE
+            if header[2] & FLAG_CID:
+                if nbytes < CID_HEADER_SIZE:
+                    return None, None, None
+                self.rx_cid = CID_STRUCT.unpack_from(self._rx_buffer, HEADER_SIZE)[0]
+                offset = CID_HEADER_SIZE
+            data = self._rx_view[offset:nbytes]
+            if logger.verbose:
+                logger.vprint(
+                    f"<- Received [SEQ={header[0]}, ACK={header[1]}, Flags={bin(header[2])}, LEN={len(data)}] from addr: {address}"
+                )
+            if header[2] & PROBE_FLAGS == PROBE_FLAGS:
+                if address == self.peer_address:
+                    self._on_probe(header, data)
+                return None, None, None
+            if self.synack_pending and address == self.peer_address:
+                if header[2] & FLAG_SYN and header[2] & FLAG_ACK:
+                    # SYN-ACK repetido: el servidor no vio nuestro ACK final
+                    logger.vprint("[CLIENT] Re-ACKing SYN-ACK duplicate.")
+                    self._send_packet(FLAG_ACK, self._final_ack)
+                    return None, None, None
+                # Cualquier otro paquete del servidor confirma que el handshake terminó
+                self.synack_pending = False
             return header, data, address
         except Exception:
             return None, None, None
@@ -423,7 +1257,7 @@ class Protocol:
         sent_flag = False
 
         while offset < n or ((flags & (FLAG_ACK | FLAG_FIN)) != 0 and not sent_flag):
-            payload = data[offset:offset + PAYLOAD_SIZE]
+            payload = data[offset:offset + self.mss]
 
             attempts = 3                     # ← reset here, per packet
             while attempts > 0:
@@ -432,9 +1266,10 @@ class Protocol:
 
                 timeout = self.rto_estimator.get_timeout()
                 logger.vprint(f"\n[Sender] Timeout: {timeout}\n")
-                header,_ , _ = self._receive_packet(timeout)
+                header, ack_data, _ = self._receive_packet(timeout)
                 expected_ack = self.seq_num + len(payload)
                 if header and (header[2] & FLAG_ACK) and header[1] >= expected_ack:
+                    self.ack_data = bytes(ack_data)
                     rtt_sample = time.time() - send_time
                     self.rto_estimator.note_sample(rtt_sample)
 
@@ -461,16 +1296,33 @@ class Protocol:
 
         return True, None
 
-    def _recv_stop_and_wait(self, buffer_size):
+    def _deliver(self, out, pos, data):
+        """Copia data en out[pos:]; lo que no entra queda en rx_pending para la próxima llamada."""
+        if self.rx_pending:
+            self.rx_pending += data
+            return pos
+        n = min(len(data), len(out) - pos)
+        out[pos:pos + n] = data[:n]
+        if n < len(data):
+            self.rx_pending += data[n:]
+        return pos + n
+
+    def _take_pending(self, out):
+        n = min(len(self.rx_pending), len(out))
+        out[:n] = self.rx_pending[:n]
+        del self.rx_pending[:n]
+        return n
+
+    def _recv_stop_and_wait(self, out, reply=None):
         if not self.is_connected:
-            return b""
+            return None, 0
 
         expected_seq = self.ack_num
-        received_data = bytearray()
+        pos = self._take_pending(out)
+        if pos >= len(out):
+            return None, pos
         deadline = time.monotonic() + IDLE_TIME
 
-        # ack 5
-
         while True:
             remaining = max(0.0, deadline - time.monotonic())
             header, data, _ = self._receive_packet(timeout=remaining if remaining > 0 else 0)
@@ -479,7 +1331,7 @@ class Protocol:
                 if time.monotonic() >= deadline:
                     logger.vprint("Idle timeout in recv Stop&Wait. Closing.")
                     self.is_connected = False
-                    return None, bytes(received_data)
+                    return None, pos
                 # spurious/short packet case: continue waiting
                 continue
 
@@ -489,20 +1341,22 @@ class Protocol:
             seq_num = header[0]
             if header[2] & FLAG_OP or header[2] & FLAG_FNAME:
                 if seq_num == expected_seq:
-                    received_data.extend(data)
+                    ack_payload = reply(data) if reply is not None else b""
+                    pos = self._deliver(out, pos, data)
                     expected_seq += len(data)
                     self.ack_num = expected_seq
-                    self._send_packet(FLAG_ACK)
-                    return header, bytes(received_data)
+                    self._send_packet(FLAG_ACK, ack_payload)
+                    return header, pos
 
             if header[2] & FLAG_PSH:
                 if seq_num == expected_seq:
-                    received_data.extend(data)
+                    self.rx_digest.update(data)
+                    pos = self._deliver(out, pos, data)
                     expected_seq += len(data)
                     self.ack_num = expected_seq
                     self._send_packet(FLAG_ACK)
-                    if len(received_data) >= buffer_size:
-                        return header, bytes(received_data)
+                    if pos >= len(out):
+                        return header, pos
                     continue
                 else:
                     logger.vprint(f"Unexpected SEQ {seq_num}. Resending last ACK.")
@@ -511,140 +1365,295 @@ class Protocol:
             elif header[2] & FLAG_FIN:
                 logger.vprint("Recibido FIN. Cerrando.")
                 self.ack_num = header[0] + 1
-                return None, bytes(received_data)
+                # ACK inmediato con el veredicto del digest; nuestro FIN (FIN+ACK) sale desde close()
+                self._send_packet(FLAG_ACK, self._on_peer_fin(data))
+                return None, pos
 
             else:
                 logger.vprint(f"Unexpected packet with SEQ={seq_num}. Ignoring.")
 
-    def _receive_reliable_packet(self, payload_size, expected_flags=0, type=STOP_AND_WAIT):
-        buffer_size = payload_size
+    def _receive_reliable_packet(self, payload_size, expected_flags=0, type=STOP_AND_WAIT, out=None, reply=None):
+        """Devuelve (header, payload) con el payload escrito en out (o en un buffer nuevo de payload_size).
+
+        reply(payload), si se da, arma el payload del ACK de un mensaje de control (OP/FNAME).
+        """
+        if out is None:
+            out = bytearray(payload_size)
+        view = memoryview(out)
         # Seleccionar el método de recepción según el tipo solicitado.
         if type == self.STOP_AND_WAIT:
-            return self._recv_stop_and_wait(buffer_size)
+            header, n = self._recv_stop_and_wait(view, reply)
         elif type == self.SELECTIVE_REPEAT:
-            return self._recv_selective_repeat(buffer_size)
+            header, n = self._recv_selective_repeat(view)
         else:
             raise ValueError(f"Unknown type of reception: {type}")
+        return header, view[:n]
 
 
     def _send_selective_repeat(self, data: bytes):
+        """Encola data en la ventana SR persistente de la conexión.
+
+        Vuelve apenas los datos quedan encolados; sólo bloquea (procesando ACKs y
+        timers) mientras lo pendiente supere send_buffer_limit. Se guarda una referencia
+        a data (no una copia), así que el llamador no debe modificarla después.
+        """
         if not self.is_connected:
             return False
 
-        window_bytes = WINDOW_SIZE * PAYLOAD_SIZE
+        self._sr_queue(data)
+
+        while self._sr_pending_bytes() > self.send_buffer_limit:
+            if not self._sr_step():
+                return False
+        return True
+
+    def _sr_queue(self, data):
+        """Agrega data a la cola de envío SR sin transmitir nada."""
+        if not self.in_flight and not self.tx_unsent:
+            self.snd_nxt = self.seq_num
+        if isinstance(data, bytearray):
+            data = bytes(data)
+        if data:
+            self.tx_unsent.append(memoryview(data))
+            self.tx_unsent_bytes += len(data)
+
+    def _sr_pending_bytes(self):
+        """Bytes en vuelo más los encolados aún sin segmentar."""
+        return (self.snd_nxt - self.seq_num) + self.tx_unsent_bytes
+
+    def _flush_selective_repeat(self):
+        """Bloquea hasta que todo lo encolado fue confirmado por el receptor."""
+        while self.in_flight or self.tx_unsent:
+            if not self.is_connected or not self._sr_step():
+                return False
+        return True
 
-        data_len = len(data)
-        data_end_seq = self.seq_num + data_len
+    def _sr_step(self):
+        """Una vuelta del emisor SR: llenar la ventana, esperar un ACK o el próximo timer y procesarlo."""
+        self._sr_fill_window()
 
+        # Block until the nearest timer expiry (top of the heap)
+        deadline = self._next_rtx_deadline()
+        if deadline is not None:
+            min_left = max(0.0, deadline - time.time())
+        elif self.in_flight:
+            # Segmentos sin confirmar y ningún timer que los reenvíe: esperaríamos para siempre
+            self.is_connected = False
+            raise ConnectionError("Selective Repeat stalled: data in flight without a retransmission timer")
+        else:
+            # Nothing in flight, but still have data to send (rare). Don't block long.
+            min_left = 0.05
+
+        # Wait for an ACK up to the nearest timeout
+        header, ack_data, _ = self._receive_packet(timeout=min_left)
+
+        if header and (header[2] & FLAG_ACK):
+            self._sr_on_ack(header, ack_data)
+            return True
+        return self._sr_on_timeout(time.time())
+
+    def _sr_fill_window(self):
+        """Envía segmentos nuevos mientras la ventana de congestión lo permita."""
+        in_flight = self.in_flight
+        unsent = self.tx_unsent
+
+        # The new segments go out together so GSO can send them in one syscall
+        window_end = self.seq_num + self.cc.window()
+        mss = self.mss
+        new_segments = []
+        while unsent and self.snd_nxt < window_end:
+            next_seq = self.snd_nxt
+            # Segment = slice of the queued chunk (memoryview, no copy)
+            view = unsent[0]
+            chunk = view[:mss]
+            if len(view) > mss:
+                unsent[0] = view[mss:]
+            else:
+                unsent.popleft()
+            self.tx_unsent_bytes -= len(chunk)
+
+            seg = _Segment(chunk, time.time())
+            in_flight[next_seq] = seg
+            self.in_flight_order.append(next_seq)
+            self._arm_rtx_timer(next_seq, seg)
+            new_segments.append((next_seq, chunk))
+            logger.vprint(f"[SR] Sent chunk SEQ={next_seq} LEN={len(chunk)}")
+            self.snd_nxt += len(chunk)
+        if new_segments:
+            self._send_segments(FLAG_PSH, new_segments)
+
+    def _sr_on_ack(self, header, ack_data):
+        """Procesa un ACK (acumulativo + SACK) recibido por el emisor SR."""
+        in_flight = self.in_flight
         send_base = self.seq_num           # lowest unacked absolute seq
-        next_seq  = self.seq_num           # next absolute seq to send
+        ack_val = header[1]  # cumulative next expected by receiver
+
+        # SACK: mark segments the receiver already buffered above the cumulative edge
+        if (header[2] & FLAG_SACK) and ack_data:
+            self._apply_sack_blocks(self._unpack_sack_blocks(ack_data), send_base)
+
+        # Only process forward progress
+        if send_base < ack_val <= self.snd_nxt:
+            now = time.time()
+            # Pop acked segments in send order (= seq order), no sorting needed.
+            # RTT sample from the newest acked segment sent only once (Karn) and not
+            # already SACKed: with delayed ACKs it is the one that triggered the ACK, so
+            # neither the delay nor the time spent waiting behind a hole is counted
+            sample_sent = None
+            order = self.in_flight_order
+            while order and order[0] < ack_val:
+                seg = in_flight.pop(order.popleft())
+                if seg.attempts == 1 and not seg.sacked:
+                    sample_sent = seg.sent
+            if sample_sent is not None:
+                rtt_sample = now - sample_sent
+                self.rto_estimator.note_sample(rtt_sample)
+                logger.vprint(f"[SR] ACK advanced to {ack_val}, RTT={rtt_sample:.4f}, RTO={self.rto_estimator.get_timeout():.4f}")
+
+            self.cc.on_ack(ack_val - send_base)
+
+            # Slide the window
+            self.seq_num = ack_val  # keep sender seq in sync with peer’s cumulative ACK
+            self.dup_acks = 0
+        elif ack_val == send_base and send_base in in_flight:
+            # Duplicate ACK -> after N of them resend send_base without waiting its timer
+            self.dup_acks += 1
+            logger.vprint(f"[SR] Dup ACK={ack_val} (count={self.dup_acks})")
+            if self.dup_acks == self.dup_ack_threshold:
+                seg = in_flight[send_base]
+                self._retransmit(send_base, seg)
+                self.stats["fast_retransmits"] += 1
+                if send_base >= self.recover:
+                    self.cc.on_loss()
+                    self.recover = self.snd_nxt
+                logger.vprint(f"[SR] Fast retransmit SEQ={send_base} (attempt {seg.attempts})")
+        else:
+            # Old ACK -> ignore
+            logger.vprint(f"[SR] Dup/old ACK={ack_val} (base={send_base})")
 
-        # in_flight: seq -> { "data": bytes, "sent": float, "attempts": int }
-        in_flight = {}
+    def _sr_on_timeout(self, now):
+        """Retransmite todos los segmentos cuyo timer venció.
 
-        attempts_limit = 10  # per-segment cap to avoid infinite retries
+        False si se agotaron los intentos: la conexión queda caída (is_connected en False),
+        así send()/flush() no siguen esperando timers que ya se sacaron del heap.
+        """
+        expired = self._pop_expired_timers(now)
+        for seq, seg in expired:
+            if seg.attempts >= SR_ATTEMPTS_LIMIT:
+                logger.vprint(f"[SR] Attempts exceeded for SEQ={seq}. Aborting.")
+                self.is_connected = False
+                return False
+            self._retransmit(seq, seg)
+            self.stats["timeout_retransmits"] += 1
+            logger.vprint(f"[SR] Retransmit SEQ={seq} (attempt {seg.attempts})")
+        if expired:
+            # Apply backoff once per expiry event
+            self.rto_estimator.backoff()
+            if expired[0][0] >= self.recover:
+                self.cc.on_timeout()
+                self.recover = self.snd_nxt
+            logger.vprint(f"[SR] {len(expired)} timer(s) expired, new RTO={self.rto_estimator.get_timeout():.4f}, cwnd={self.cc.window()}")
+        # else: no expired (race with receive timeout) or nothing in flight; loop again
+        return True
 
-        while send_base < data_end_seq or in_flight:
-            # 1. Fill the window
-            while next_seq < data_end_seq and next_seq < send_base + window_bytes:
-                off = next_seq - self.seq_num
-                chunk = data[off : off + PAYLOAD_SIZE]
-                if not chunk:
+    def _retransmit(self, seq, seg):
+        self._send_packet(FLAG_PSH, seg.data, seq=seq)
+        seg.sent = time.time()
+        seg.attempts += 1
+        self._arm_rtx_timer(seq, seg)
+
+    def _arm_rtx_timer(self, seq, seg):
+        """Agenda el timer de retransmisión del segmento en el heap (deadline, seq, attempts)."""
+        deadline = seg.sent + self.rto_estimator.get_timeout()
+        heapq.heappush(self.rtx_heap, (deadline, seq, seg.attempts))
+
+    def _timer_is_live(self, seq, attempts):
+        # Las entradas viejas del heap se descartan perezosamente: el segmento ya fue
+        # confirmado/SACKeado, o se reenvió y tiene una entrada más nueva.
+        seg = self.in_flight.get(seq)
+        return seg is not None and not seg.sacked and seg.attempts == attempts
+
+    def _next_rtx_deadline(self):
+        heap = self.rtx_heap
+        while heap and not self._timer_is_live(heap[0][1], heap[0][2]):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _pop_expired_timers(self, now):
+        """Saca del heap todos los timers vencidos; devuelve [(seq, seg)] en orden de deadline."""
+        heap = self.rtx_heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            _, seq, attempts = heapq.heappop(heap)
+            if self._timer_is_live(seq, attempts):
+                expired.append((seq, self.in_flight[seq]))
+        return expired
+
+    def _apply_sack_blocks(self, blocks, send_base):
+        """Marca como SACKeados los segmentos cubiertos por los bloques.
+
+        Los segmentos del emisor coinciden con los del receptor, así que cada bloque se
+        recorre saltando de segmento en segmento; sacked_until recuerda hasta dónde ya se
+        recorrió cada bloque para no repetir trabajo en los ACKs siguientes.
+        """
+        in_flight = self.in_flight
+        sample_sent = None
+        for start, end in blocks:
+            if end <= send_base:
+                continue
+            seq = max(start, self.sacked_until.get(start, start))
+            while seq < end:
+                seg = in_flight.get(seq)
+                if seg is None:
                     break
-
-                self._send_packet(FLAG_PSH, chunk)
-                in_flight[next_seq] = {
-                    "data": chunk,
-                    "sent": time.time(),
-                    "attempts": 1,
-                }
-                logger.vprint(f"[SR] Sent chunk SEQ={next_seq} LEN={len(chunk)}")
-                next_seq += len(chunk)
-
-            # 2.Compute the nearest timer expiry for blocking receive
-            if in_flight:
-                now = time.time()
-                rto = self.rto_estimator.get_timeout()
-                # time left for each in-flight seg
-                min_left = min(max(0.0, (seg["sent"] + rto) - now) for seg in in_flight.values())
-            else:
-                # Nothing in flight, but still have data to send (rare). Don't block long.
-                min_left = 0.05
-
-            # 3x. Wait for an ACK up to the nearest timeout
-            header, _, _ = self._receive_packet(timeout=min_left)
-
-            if header and (header[2] & FLAG_ACK):
-                ack_val = header[1]  # cumulative next expected by receiver
-                # Only process forward progress
-                if ack_val > send_base:
-                    # Use the oldest newly-acked segment to compute RTT
-                    now = time.time()
-                    # Collect acks to remove (seq < ack_val)
-                    acked_seqs = sorted([seq for seq in in_flight.keys() if seq < ack_val])
-                    if acked_seqs:
-                        oldest_seq = acked_seqs[0]
-                        # RTT sample from that segment
-                        rtt_sample = now - in_flight[oldest_seq]["sent"]
-                        self.rto_estimator.note_sample(rtt_sample)
-                        logger.vprint(f"[SR] ACK advanced to {ack_val}, RTT={rtt_sample:.4f}, RTO={self.rto_estimator.get_timeout():.4f}")
-
-                    # Drop all fully acked segments
-                    for seq in acked_seqs:
-                        in_flight.pop(seq, None)
-
-                    # Slide the window
-                    send_base = ack_val
-                    self.seq_num = ack_val  # keep sender seq in sync with peer’s cumulative ACK
-                else:
-                    # Duplicate/old ACK -> ignore (optionally count for fast retransmit)
-                    logger.vprint(f"[SR] Dup/old ACK={ack_val} (base={send_base})")
-            else:
-                # 4. Timeout path: retransmit any expired segments (oldest first to be gentle)
-                if in_flight:
-                    now = time.time()
-                    rto = self.rto_estimator.get_timeout()
-
-                    # Find expired segments
-                    expired = sorted(
-                        (seq for seq, seg in in_flight.items() if now - seg["sent"] >= rto)
-                    )
-                    if expired:
-                        # Retransmit the earliest expired one first (avoid burst)
-                        seq = expired[0]
-                        seg = in_flight[seq]
-                        if seg["attempts"] >= attempts_limit:
-                            logger.vprint(f"[SR] Attempts exceeded for SEQ={seq}. Aborting.")
-                            return False
-
-                        self._send_packet(FLAG_PSH, seg["data"])
-                        seg["sent"] = time.time()
-                        seg["attempts"] += 1
-                        # Apply backoff once per expiry event
-                        self.rto_estimator.backoff()
-                        logger.vprint(f"[SR] Retransmit SEQ={seq} (attempt {seg['attempts']}), new RTO={self.rto_estimator.get_timeout():.4f}")
-                    # else: no expired (race with receive timeout); loop again
-                # else: nothing in flight; loop will refill window
-
-    def _recv_selective_repeat(self, buffer_size: int):
+                seq_end = seq + len(seg.data)
+                if seq_end > end:
+                    break
+                if not seg.sacked:
+                    seg.sacked = True
+                    if seg.attempts == 1 and (sample_sent is None or seg.sent > sample_sent):
+                        sample_sent = seg.sent
+                    self.stats["sack_skips"] += 1
+                    logger.vprint(f"[SR] SACKed SEQ={seq}, won't retransmit")
+                seq = seq_end
+            self.sacked_until[start] = seq
+        if sample_sent is not None:
+            # First acknowledgement of these segments: valid RTT sample
+            self.rto_estimator.note_sample(time.time() - sample_sent)
+        if len(self.sacked_until) > 4 * MAX_SACK_BLOCKS:
+            self.sacked_until = {k: v for k, v in self.sacked_until.items() if v > send_base}
+
+    def _recv_selective_repeat(self, out):
         if not self.is_connected:
-            return None, b""
+            return None, 0
 
         expected_seq_from_client = self.ack_num           # next in-order byte we want
-        received_data = bytearray()
-        buffer = {}                           # seq -> bytes (out-of-order)
-        window_bytes = WINDOW_SIZE * PAYLOAD_SIZE
+        pos = self._take_pending(out)                     # bytes already written into out
+        if pos >= len(out):
+            return None, pos
+        buffer = self.sr_buffer               # seq -> bytes (out-of-order), SACKed
+        window_bytes = WINDOW_SIZE * self.mss
+
+        def deliver(chunk):
+            # in-order data: copy straight from the receive buffer into out
+            nonlocal pos
+            pos = self._deliver(out, pos, chunk)
 
         deadline = time.monotonic() + IDLE_TIME
 
         while True:
-            remaining = max(0.0, deadline - time.monotonic())
+            now = time.monotonic()
+            if self.ack_deadline is not None and now >= self.ack_deadline:
+                self._send_sr_ack(expected_seq_from_client)
+            remaining = max(0.0, deadline - now)
+            if self.ack_deadline is not None:
+                remaining = min(remaining, max(0.0, self.ack_deadline - now))
             header, data, _ = self._receive_packet(timeout=remaining if remaining > 0 else 0)
             if not header:
                 if time.monotonic() >= deadline:
                     logger.vprint("Idle timeout in recv SR. Closing.")
                     self.is_connected = False
-                    return None, bytes(received_data)
+                    return None, pos
                 continue
 
             # reset idle timer on any valid packet
@@ -656,67 +1665,97 @@ class Protocol:
             # Control messages used in the handshake payload path 
             if (flags & FLAG_OP) or (flags & FLAG_FNAME):
                 if seq == expected_seq_from_client:
-                    received_data.extend(data)
+                    pos = self._deliver(out, pos, data)
                     expected_seq_from_client += len(data)
                     self.ack_num = expected_seq_from_client
                     self._send_packet(FLAG_ACK)
-                    return header, bytes(received_data)
+                    return header, pos
                 else:
                     # Out-of-order control payload → buffer and ACK cumulative expected
                     if expected_seq_from_client <= seq < expected_seq_from_client + window_bytes and seq not in buffer:
-                        buffer[seq] = data
+                        buffer[seq] = bytes(data)
                     self.ack_num = expected_seq_from_client
                     self._send_packet(FLAG_ACK)
                     # keep waiting until we can deliver in order
                     continue
 
-            # Data path (PSH) 
+            # Data path (PSH)
             if flags & FLAG_PSH:
-                if seq == expected_seq_from_client:
-                    # in-order: deliver and drain any contiguous buffered chunks
-                    received_data.extend(data)
-                    expected_seq_from_client += len(data)
-
-                    # promote buffered contiguous data
-                    while expected_seq_from_client in buffer:
-                        chunk = buffer.pop(expected_seq_from_client)
-                        received_data.extend(chunk)
-                        expected_seq_from_client += len(chunk)
-
-                    self.ack_num = expected_seq_from_client
-                    self._send_packet(FLAG_ACK)
-
-                    if len(received_data) >= buffer_size:
-                        return header, bytes(received_data)
-                    continue
-
-                # Out-of-order but inside window → buffer, ACK cumulative
-                if expected_seq_from_client <= seq < expected_seq_from_client + window_bytes:
-                    if seq not in buffer:
-                        buffer[seq] = data
-                        logger.vprint(f"[SR] Buffered out-of-order SEQ={seq} LEN={len(data)}")
-                    # Even if we got further data, cumulative ACK remains the left edge
-                    self.ack_num = expected_seq_from_client
-                    self._send_packet(FLAG_ACK)
-                    continue
-
-                # Too old or outside window → just re-ACK current expected
-                logger.vprint(f"[SR] SEQ={seq} out of window (expected={expected_seq_from_client}). Re-ACKing.")
-                self.ack_num = expected_seq_from_client
-                self._send_packet(FLAG_ACK)
+                if self._sr_on_data(seq, data, deliver) and pos >= len(out):
+                    return header, pos
+                expected_seq_from_client = self.ack_num
                 continue
 
             # Connection teardown
             if flags & FLAG_FIN:
                 logger.vprint("FIN received (SR). Closing.")
                 self.ack_num = seq + 1
-                self._send_packet(FLAG_ACK | FLAG_FIN)
-                self.is_connected = False
-                return None, bytes(received_data)
+                # ACK inmediato con el veredicto del digest; nuestro FIN (FIN+ACK) sale desde close()
+                self._send_packet(FLAG_ACK, self._on_peer_fin(data))
+                return None, pos
 
             # Anything else
             logger.vprint(f"[SR] Unexpected packet flags={bin(flags)} SEQ={seq}. Ignoring (ACK last).")
-            self.ack_num = expected_seq_from_client
-            self._send_packet(FLAG_ACK)
+            self._send_sr_ack(expected_seq_from_client)
+
+    def _sr_on_data(self, seq, data, deliver):
+        """Procesa un segmento de datos en el receptor SR.
+
+        deliver(chunk) recibe, en orden, los datos que quedan disponibles (el segmento y
+        lo que estaba esperando en sr_buffer detrás de él). Devuelve True si entregó algo.
+        """
+        buffer = self.sr_buffer
+        expected = self.ack_num           # next in-order byte we want
+        window_bytes = WINDOW_SIZE * self.mss
+
+        if seq == expected:
+            self.rx_digest.update(data)
+            deliver(data)
+            expected += len(data)
+
+            # promote buffered contiguous data
+            filled_hole = expected in buffer
+            while expected in buffer:
+                chunk = buffer.pop(expected)
+                self.rx_digest.update(chunk)
+                deliver(chunk)
+                expected += len(chunk)
+
+            if filled_hole:
+                # A retransmission closed a gap: tell the sender right away
+                self._send_sr_ack(expected)
+            else:
+                self._delay_sr_ack(expected)
+            return True
+
+        # Out-of-order but inside window → buffer, ACK cumulative
+        if expected <= seq < expected + window_bytes:
+            if seq not in buffer:
+                # Out-of-order data outlives the receive buffer: keep a copy
+                buffer[seq] = bytes(data)
+                logger.vprint(f"[SR] Buffered out-of-order SEQ={seq} LEN={len(data)}")
+            # Cumulative ACK remains the left edge; SACK blocks report what's above it
+            self._send_sr_ack(expected)
+            return False
+
+        # Too old or outside window → just re-ACK current expected
+        logger.vprint(f"[SR] SEQ={seq} out of window (expected={expected}). Re-ACKing.")
+        self._send_sr_ack(expected)
+        return False
+
+    def _close_now(self):
+        """Cierre sincrónico best-effort: un FIN suelto, sin esperar confirmación, y se cierra el socket."""
+        sock = getattr(self, "socket", None)
+        if not sock:
+            return
+        if getattr(self, "is_connected", False):
+            self.is_connected = False
+            try:
+                self._send_packet(FLAG_FIN, self._fin_payload())
+            except Exception:
+                pass
+        sock.close()
+
     def __del__(self):
-        self.close()
+        # Nunca el thread de teardown desde acá: puede correr durante la finalización
+        self._close_now()
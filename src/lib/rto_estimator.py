@@ -1,12 +1,13 @@
 import time
 
 class RTOEstimator:
-    def __init__(self, alpha=1/8, beta=1/4, k=4, g=0.001):
+    def __init__(self, alpha=1/8, beta=1/4, k=4, g=0.001, min_rto=0.01):
         # RFC 6298 parámetros
         self.alpha = alpha
         self.beta = beta
         self.k = k
         self.g = g  # granularidad de clock en segundos
+        self.min_rto = min_rto  # piso del RTO (p. ej. para tolerar ACKs demorados)
 
         # Estado
         self.srtt = None
@@ -25,7 +26,7 @@ class RTOEstimator:
             self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt_sample
 
         self.rto = self.srtt + max(self.g, self.k * self.rttvar)
-        self.rto = min(max(self.rto, 0.01), 5.0)
+        self.rto = min(max(self.rto, self.min_rto), 5.0)
 
     def get_timeout(self) -> float:
         """Devolver RTO actual (en segundos)."""
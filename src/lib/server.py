@@ -1,15 +1,161 @@
 import os
+import queue
 import threading
 
-from .file_manager import FileManager
+from .compression import CODEC_NONE, MAX_LEVEL, CompressedReader, CompressedWriter, is_supported
+from .file_manager import DURABILITY_NONE, FileManager, RangeWriter, prefix_digest
 from .logger import logger
 from .protocolo import HEADER_SIZE as PROTO_HEADER_SIZE
-from .protocolo import Protocol
+from .protocolo import DEFAULT_CONGESTION, Protocol
+from .session import SessionReader, SessionWriter, expand_entries, safe_name
 
 CHUNK_SIZE = 1024 * 4
+SYN_BACKLOG = 128  # Handshakes en curso (SYN recibido, conexión aún no establecida)
+MAX_WORKERS = 64   # Transferencias simultáneas
+MAX_PENDING = 64   # Conexiones establecidas esperando un worker; más allá se rechaza el SYN
 
 
-def handle_client(client_protocol: Protocol, storage_dir: str):
+def transfer_reply(storage_dir, client_protocol, filename):
+    """Payload del ACK del FNAME: tamaño del archivo (download), offset de reanudación, compresión y rango.
+
+    Deja en client_protocol.resume_offset desde dónde arranca la transferencia, en
+    client_protocol.compression el códec acordado y en client_protocol.byte_range el rango.
+    Levanta FileNotFoundError / ValueError si la transferencia no se puede aceptar.
+    """
+    path = os.path.join(storage_dir, filename)
+    local_size = os.path.getsize(path) if os.path.isfile(path) else None
+    request = client_protocol.resume_request
+    client_protocol.resume_offset = 0
+
+    codec = None
+    compression = client_protocol.compression_request
+    if compression is not None:
+        codec = CODEC_NONE
+        if is_supported(compression[0]) and compression[1] <= MAX_LEVEL:
+            codec = compression[0]
+            client_protocol.compression = tuple(compression)
+
+    if client_protocol.session_request:
+        # Varios archivos por esta conexión: no se combina con rangos ni con reanudar
+        client_protocol.session = True
+        if client_protocol.operation != 1:
+            safe_name(filename)
+            return client_protocol.pack_transfer_reply(None, codec=codec, session_files=0)
+        entries, missing = expand_entries(storage_dir, filename.split("\n"))
+        for name in missing:
+            logger.info(f"[SERVER] Session download: {name} not found, skipping it.")
+        client_protocol.session_entries = entries
+        total = sum(os.path.getsize(path) for path, _ in entries)
+        return client_protocol.pack_transfer_reply(total, codec=codec, session_files=len(entries))
+
+    if client_protocol.operation == 1 and local_size is None:
+        # Con fast open, el cliente recibe este motivo en el rechazo del SYN-ACK
+        raise FileNotFoundError(f"{filename} not found")
+
+    if client_protocol.range_request is not None:
+        # Una de varias conexiones en paralelo sobre el mismo archivo (no se combina con reanudar)
+        offset, length = client_protocol.range_request
+        if client_protocol.operation == 1:
+            offset = min(offset, local_size or 0)
+            length = min(length, (local_size or 0) - offset)
+        client_protocol.byte_range = (offset, length)
+        size = local_size if client_protocol.operation == 1 else None
+        return client_protocol.pack_transfer_reply(size, codec=codec, byte_range=(offset, length))
+
+    if client_protocol.operation == 1:
+        if request is None:
+            return client_protocol.pack_transfer_reply(local_size, codec=codec)
+        offset, verify, digest = request
+        # Sólo se reanuda si el prefijo del cliente coincide con el nuestro
+        if local_size is None or offset > local_size:
+            offset = 0
+        elif verify and digest is not None and prefix_digest(path, offset) != digest:
+            offset = 0
+        client_protocol.resume_offset = offset
+        return client_protocol.pack_transfer_reply(local_size, offset, codec=codec)
+
+    if request is None:
+        return client_protocol.pack_transfer_reply(None, codec=codec)
+    # Upload: ofrecer lo que ya tenemos; el cliente compara el digest y decide
+    offset = local_size or 0
+    expected = client_protocol.peer_file_size
+    if expected is not None and offset > expected:
+        offset = 0
+    _, verify, _ = request
+    digest = prefix_digest(path, offset) if verify and offset else None
+    client_protocol.resume_offset = offset
+    return client_protocol.pack_transfer_reply(None, offset, digest, codec=codec)
+
+
+def open_transfer(storage_dir, client_protocol, durability=DURABILITY_NONE):
+    """Abre el archivo de la transferencia acordada en el handshake; devuelve (file_manager, stream).
+
+    stream es de donde salen (download) o adonde van (upload) los datos de la conexión: el
+    mismo file_manager o sus envoltorios de rango y compresión. En una sesión, file_manager
+    es el SessionReader / SessionWriter de todos los archivos.
+    """
+    if client_protocol.session:
+        if client_protocol.operation == 1:
+            file_manager = SessionReader(client_protocol.session_entries, client_protocol.io_size(CHUNK_SIZE))
+            stream = file_manager
+            if client_protocol.compression:
+                stream = CompressedReader(file_manager, *client_protocol.compression)
+        else:
+            directory = os.path.join(storage_dir, safe_name(client_protocol.filename))
+            file_manager = SessionWriter(directory, durability)
+            stream = file_manager
+            if client_protocol.compression:
+                stream = CompressedWriter(file_manager)
+        return file_manager, stream
+
+    filepath = os.path.join(storage_dir, client_protocol.filename)
+    byte_range = client_protocol.byte_range
+    if client_protocol.operation == 1:
+        # Downloads are packetized straight out of the page cache (mmap), in whole segments
+        file_manager = FileManager(filepath, "r", chunk_size=client_protocol.io_size(CHUNK_SIZE), use_mmap=True)
+        if byte_range is not None:
+            file_manager.seek(*byte_range)
+        else:
+            file_manager.seek(client_protocol.resume_offset)
+        stream = file_manager
+        if client_protocol.compression:
+            stream = CompressedReader(file_manager, *client_protocol.compression)
+        return file_manager, stream
+
+    file_manager = FileManager(filepath, "w", chunk_size=CHUNK_SIZE, durability=durability,
+                               resume_from=client_protocol.resume_offset, in_place=byte_range is not None)
+    if client_protocol.peer_file_size is not None:
+        if byte_range is not None and os.path.getsize(filepath) > client_protocol.peer_file_size:
+            # Sin truncar al abrir, un archivo viejo más largo dejaría su cola al final
+            os.truncate(filepath, client_protocol.peer_file_size)
+        file_manager.preallocate(client_protocol.peer_file_size)
+    # Con rangos, cada conexión escribe en su offset con write_chunk(offset=...)
+    stream = file_manager if byte_range is None else RangeWriter(file_manager, byte_range[0])
+    if client_protocol.compression:
+        # El stream trae frames: se descomprimen hacia el archivo
+        stream = CompressedWriter(stream)
+    return file_manager, stream
+
+
+def expected_end(client_protocol):
+    """Offset en el que debería terminar un upload (None si el cliente no anunció el tamaño)."""
+    if client_protocol.byte_range is not None:
+        return sum(client_protocol.byte_range)
+    return client_protocol.peer_file_size
+
+
+def log_session(client_protocol, writer):
+    """Loguea el resultado de cada archivo de una sesión de upload."""
+    for name, size, ok in writer.results:
+        logger.info(f"[SERVER] Session file {name}: {size} bytes" + ("" if ok else " (digest mismatch)"))
+    if not writer.complete():
+        logger.info(
+            f"[SERVER] Session from {client_protocol.peer_address} ended before its end marker "
+            f"({len(writer.results)} files received)."
+        )
+
+
+def handle_client(client_protocol: Protocol, storage_dir: str, durability=DURABILITY_NONE):
 
     try:
 
@@ -20,80 +166,175 @@ def handle_client(client_protocol: Protocol, storage_dir: str):
 
         filepath = os.path.join(storage_dir, filename)
         logger.info(f"[Thread {threading.get_ident()}] Saving in: {filepath}")
-        modo = "r" if client_protocol.operation == 1 else "w"
-        file_manager = FileManager(filepath, modo, chunk_size=CHUNK_SIZE)
-        chunk_size = file_manager.getChunkSize()
+        if client_protocol.byte_range is not None:
+            logger.vprint(f"[Thread {threading.get_ident()}] Range {client_protocol.byte_range} of {filename}")
+        file_manager, stream = open_transfer(storage_dir, client_protocol, durability)
 
         header_size = PROTO_HEADER_SIZE
-        size = chunk_size
+        size = client_protocol.io_size(CHUNK_SIZE)
 
-        if modo == "w":
+        if client_protocol.operation != 1:
+            expected = expected_end(client_protocol)
+            # One reusable buffer: the protocol writes payloads straight into it
+            buffer = bytearray(size)
+            view = memoryview(buffer)
             while True:
 
-                chunk = client_protocol.recv(size, type=client_protocol.recovery_mode)
-                if not chunk:
+                n = client_protocol.recv_into(buffer, type=client_protocol.recovery_mode)
+                if not n:
                     logger.info(
                         f"[Thread {threading.get_ident()}] End of transmission for {filename}."
                     )
+                    if client_protocol.session:
+                        log_session(client_protocol, file_manager)
+                    elif expected is not None and file_manager.write_pos != expected:
+                        logger.info(
+                            f"[Thread {threading.get_ident()}] Upload of {filename} is incomplete: "
+                            f"{file_manager.write_pos}/{expected} bytes."
+                        )
+                    if client_protocol.compression and not stream.complete():
+                        logger.info(
+                            f"[Thread {threading.get_ident()}] Upload of {filename} ended in the middle of a compressed frame."
+                        )
+                    if client_protocol.stream_verified() is False:
+                        logger.info(
+                            f"[Thread {threading.get_ident()}] Upload of {filename} is corrupted (digest mismatch)."
+                        )
                     break
 
-                file_manager.write_chunk(chunk)
+                stream.write_chunk(view[:n])
                 logger.vprint(
-                    f"[Thread {threading.get_ident()}] Receiving {len(chunk)} bytes for {filename}"
+                    f"[Thread {threading.get_ident()}] Receiving {n} bytes for {filename}"
                 )
         else:
-            chunk = file_manager.read_chunk()
-            while chunk:
-                size = client_protocol.send(chunk, type=client_protocol.recovery_mode)
-                logger.vprint(
-                    f"[Thread {threading.get_ident()}] Received {size} bytes for {filename}"
-                )
-                logger.vprint(
-                    f"[Thread {threading.get_ident()}] Received {len(chunk)} bytes for {filename}"
-                )
-                chunk = file_manager.read_chunk()
+            sent = client_protocol.sendfile(stream, type=client_protocol.recovery_mode)
+            logger.vprint(
+                f"[Thread {threading.get_ident()}] Sent {sent} bytes for {filename}"
+                + (f" ({stream.consumed} bytes of the file)" if stream is not file_manager else "")
+            )
 
             logger.info(
                 f"[Thread {threading.get_ident()}] Download completed for {filename}."
             )
+            stats = client_protocol.stats
+            logger.vprint(
+                f"[Thread {threading.get_ident()}] Retransmissions for {filename}: "
+                f"timeout={stats['timeout_retransmits']}, fast={stats['fast_retransmits']}, "
+                f"avoided by SACK={stats['sack_skips']}"
+            )
     except Exception as e:
         logger.info(
             f"[Thread {threading.get_ident()}] Error with client {client_protocol.peer_address}: {e}"
         )
     finally:
-        if "file_manager" in locals():
-            file_manager.close()
-        client_protocol.close()
+        # El FIN (o FIN+ACK) y el TIME-WAIT siguen en el thread de teardown: el worker queda libre.
+        # Sale antes de cerrar el archivo, así el fsync de -D no demora el veredicto al cliente
+        try:
+            client_protocol.close(wait=False)
+        finally:
+            if "file_manager" in locals():
+                file_manager.close()
         logger.info(
             f"[Thread {threading.get_ident()}] Connection with {client_protocol.peer_address} closed."
         )
 
 
 class Server:
-    def __init__(self, host, port, storage_dir="."):
+    def __init__(self, host, port, storage_dir=".", congestion=DEFAULT_CONGESTION, offload=False, shared=False,
+                 backlog=SYN_BACKLOG, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, durability=DURABILITY_NONE,
+                 max_mss=None):
         self.host = host
         self.port = port
         self.storage_dir = storage_dir
+        self.durability = durability
+        self.backlog = backlog
+        self.max_workers = max_workers
+        self.max_pending = max_pending
 
-        self.main_protocol = Protocol(self.host, self.port)
-        self.threads = []
+        # max_mss None: el MSS sale del MTU de la ruta hacia cada cliente
+        self.main_protocol = Protocol(self.host, self.port, congestion=congestion, offload=offload, shared=shared,
+                                      max_mss=max_mss)
+        # Pool fijo de workers que atienden las transferencias de la cola pending
+        self.workers = []
+        self.pending = queue.Queue()
+        # Threads de handshake vivos; cada uno se saca solo de acá al terminar
+        self.threads = set()
+        # (address, ISN del cliente) de los handshakes en curso: es el backlog de SYNs
+        self.half_open = set()
+        self.admitted = 0  # conexiones establecidas en la cola o en un worker
+        self.lock = threading.Lock()
         if not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
             logger.info(f"Storage directory:'{self.storage_dir}' created.")
 
     def start(self):
         logger.info(f"Main thread from server listening on {self.host}:{self.port}")
+        for _ in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
         while True:
-            client_protocol = self.main_protocol.accept()
+            # The accept path only reads SYNs; each handshake completes in its own thread
+            header, address, syn_data = self.main_protocol.next_syn()
+            key = (address, header[0])
+            with self.lock:
+                if key in self.half_open:
+                    # Duplicate SYN: that handshake retransmits its own SYN-ACK
+                    continue
+                if len(self.half_open) + self.admitted >= self.max_workers + self.max_pending:
+                    # Every worker is busy and the pending queue is full: tell the client now
+                    self.main_protocol.reject(header, address)
+                    continue
+                if len(self.half_open) >= self.backlog:
+                    logger.vprint(f"[SERVER] SYN backlog full ({self.backlog}). Dropping SYN from {address}.")
+                    continue
+                self.half_open.add(key)
 
-            if client_protocol:
                 client_thread = threading.Thread(
-                    target=handle_client, args=(client_protocol, self.storage_dir)
+                    target=self._handshake, args=(header, address, key, syn_data)
                 )
-                client_thread.start()
-                self.threads.append(client_thread)
+                self.threads.add(client_thread)
+            client_thread.start()
+
+    def _handshake(self, header, address, key, syn_data=b""):
+        client_protocol = None
+        try:
+            client_protocol = self.main_protocol.handshake(header, address, fname_reply=self._fname_reply,
+                                                           syn_data=syn_data)
+        finally:
+            with self.lock:
+                self.half_open.discard(key)
+                if client_protocol:
+                    self.admitted += 1
+                self.threads.discard(threading.current_thread())
+        if client_protocol:
+            self.pending.put(client_protocol)
+
+    def _fname_reply(self, client_protocol, filename):
+        return transfer_reply(self.storage_dir, client_protocol, filename)
+
+    def _worker(self):
+        while True:
+            client_protocol = self.pending.get()
+            if client_protocol is None:
+                return
+            try:
+                handle_client(client_protocol, self.storage_dir, self.durability)
+            except Exception as e:
+                # handle_client sólo deja escapar errores de su limpieza (el cierre): el worker sigue
+                logger.info(f"[SERVER] Worker error with client {client_protocol.peer_address}: {e}")
+            finally:
+                with self.lock:
+                    self.admitted -= 1
 
     def close(self):
         self.main_protocol.close()
-        for thread in self.threads:
+        with self.lock:
+            threads = list(self.threads)
+        for thread in threads:
             thread.join()
+        for _ in self.workers:
+            self.pending.put(None)
+        for worker in self.workers:
+            worker.join()
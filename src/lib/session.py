@@ -0,0 +1,221 @@
+import hashlib
+import os
+import posixpath
+import struct
+
+from .file_manager import DURABILITY_NONE, FileManager
+
+# Stream de una sesión (varios archivos por una sola conexión). Por cada archivo:
+#   header (largo del nombre, tamaño) + nombre en UTF-8 + datos + SHA-256 de los datos
+# El SHA-256 hace de marca de fin del archivo; un header con nombre vacío cierra la sesión.
+ENTRY_STRUCT = struct.Struct("!HQ")
+END_OF_SESSION = ENTRY_STRUCT.pack(0, 0)
+ENTRY_DIGEST = hashlib.sha256
+ENTRY_DIGEST_SIZE = ENTRY_DIGEST().digest_size
+MAX_NAME = 4096
+
+_HEADER, _NAME, _DATA, _DIGEST = range(4)
+
+
+def safe_name(name):
+    """Ruta relativa normalizada (con "/"); ValueError si es absoluta o sale del directorio."""
+    name = name.replace("\\", "/")
+    normalized = posixpath.normpath(name)
+    if not name or name.startswith("/") or normalized == ".." or normalized.startswith("../"):
+        raise ValueError(f"Invalid file name in session: {name!r}")
+    return normalized
+
+
+def collect_entries(paths):
+    """[(ruta local, nombre en la sesión)] de archivos y directorios (recursivos, con su nombre)."""
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            root = os.path.dirname(os.path.abspath(path))
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    full = os.path.join(dirpath, filename)
+                    entries.append((full, os.path.relpath(os.path.abspath(full), root).replace(os.sep, "/")))
+        elif os.path.isfile(path):
+            entries.append((path, os.path.basename(path)))
+        else:
+            raise ValueError(f"File does not exist: {path}")
+    return entries
+
+
+def expand_entries(directory, names):
+    """Entradas de una sesión de download: cada nombre es un archivo o un directorio de directory.
+
+    Devuelve (entries, missing) con los nombres que no existen en missing.
+    """
+    entries = []
+    missing = []
+    for name in names:
+        try:
+            relative = safe_name(name)
+        except ValueError:
+            missing.append(name)
+            continue
+        path = os.path.join(directory, relative)
+        if os.path.isdir(path):
+            for full, entry in collect_entries([path]):
+                entries.append((full, posixpath.join(posixpath.dirname(relative), entry)))
+        elif os.path.isfile(path):
+            entries.append((path, relative))
+        else:
+            missing.append(name)
+    return entries, missing
+
+
+class SessionReader:
+    """read_chunk() del stream de una sesión, armado a partir de [(ruta, nombre)].
+
+    Los archivos chicos se juntan en chunks de chunk_size para no mandar segmentos diminutos.
+    """
+
+    def __init__(self, entries, chunk_size):
+        self.entries = entries
+        self.chunk_size = chunk_size
+        self.pending = bytearray()
+        self.pieces = self._pieces()
+        self.bytes_read = 0      # bytes de archivos ya leídos
+        self.files_sent = 0
+
+    def _pieces(self):
+        for path, name in self.entries:
+            file_manager = FileManager(path, "r", chunk_size=self.chunk_size)
+            try:
+                size = file_manager.get_file_size()
+                encoded = name.encode("utf-8")
+                yield ENTRY_STRUCT.pack(len(encoded), size) + encoded
+                # El header ya anunció size: se lee exactamente eso aunque el archivo cambie
+                file_manager.seek(0, size)
+                digest = ENTRY_DIGEST()
+                sent = 0
+                chunk = file_manager.read_chunk()
+                while chunk:
+                    digest.update(chunk)
+                    sent += len(chunk)
+                    self.bytes_read += len(chunk)
+                    yield chunk
+                    chunk = file_manager.read_chunk()
+                if sent != size:
+                    raise ValueError(f"{path} changed while it was being sent")
+                yield digest.digest()
+            finally:
+                file_manager.close()
+            self.files_sent += 1
+        yield END_OF_SESSION
+
+    def read_chunk(self):
+        pending = self.pending
+        while len(pending) < self.chunk_size:
+            piece = next(self.pieces, None)
+            if piece is None:
+                break
+            if not pending and len(piece) >= self.chunk_size:
+                return piece
+            pending += piece
+        chunk = bytes(pending[:self.chunk_size])
+        del pending[:self.chunk_size]
+        return chunk
+
+    def close(self):
+        self.pieces.close()
+
+
+class SessionWriter:
+    """write_chunk() que separa el stream de una sesión en archivos dentro de directory.
+
+    results tiene (nombre, tamaño, digest correcto) de cada archivo terminado.
+    """
+
+    def __init__(self, directory, durability=DURABILITY_NONE):
+        self.directory = directory
+        self.durability = durability
+        self.state = _HEADER
+        self.pending = bytearray()   # header/nombre/digest a medio llegar
+        self.needed = ENTRY_STRUCT.size
+        self.file_manager = None
+        self.name = None
+        self.size = 0
+        self.remaining = 0
+        self.digest = None
+        self.bytes_written = 0
+        self.results = []
+        self.finished = False
+
+    def write_chunk(self, data):
+        view = memoryview(data)
+        while view:
+            if self.finished:
+                raise ValueError("Data after the end of the session")
+            if self.state == _DATA:
+                n = min(len(view), self.remaining)
+                piece = view[:n]
+                self.file_manager.write_chunk(piece)
+                self.digest.update(piece)
+                self.remaining -= n
+                self.bytes_written += n
+                view = view[n:]
+                if not self.remaining:
+                    self._expect(_DIGEST, ENTRY_DIGEST_SIZE)
+                continue
+            n = min(len(view), self.needed - len(self.pending))
+            self.pending += view[:n]
+            view = view[n:]
+            if len(self.pending) == self.needed:
+                field = bytes(self.pending)
+                self.pending.clear()
+                self._on_field(field)
+
+    def _expect(self, state, needed):
+        self.state = state
+        self.needed = needed
+
+    def _on_field(self, field):
+        if self.state == _HEADER:
+            name_len, self.size = ENTRY_STRUCT.unpack(field)
+            if not name_len:
+                self.finished = True
+            elif name_len > MAX_NAME:
+                raise ValueError("File name too long in session")
+            else:
+                self._expect(_NAME, name_len)
+        elif self.state == _NAME:
+            self.name = field.decode("utf-8")
+            self._open(self.name, self.size)
+            if self.size:
+                self._expect(_DATA, None)
+                self.remaining = self.size
+            else:
+                self._expect(_DIGEST, ENTRY_DIGEST_SIZE)
+        else:
+            ok = field == self.digest.digest()
+            self.file_manager.close()
+            self.file_manager = None
+            self.results.append((self.name, self.size, ok))
+            self._expect(_HEADER, ENTRY_STRUCT.size)
+
+    def _open(self, name, size):
+        path = os.path.join(self.directory, safe_name(name))
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.file_manager = FileManager(path, "w", durability=self.durability)
+        self.file_manager.preallocate(size)
+        self.digest = ENTRY_DIGEST()
+
+    def flush(self):
+        if self.file_manager is not None:
+            self.file_manager.flush()
+
+    def complete(self):
+        """True si llegó la marca de fin de la sesión."""
+        return self.finished
+
+    def close(self):
+        if self.file_manager is not None:
+            self.file_manager.close()
+            self.file_manager = None
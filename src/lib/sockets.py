@@ -1,13 +1,54 @@
 import socket
+import struct
+import sys
+from collections import deque
 
 from .logger import logger
 
+# sendmsg no existe en todas las plataformas (p. ej. Windows)
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+# UDP GSO/GRO de Linux (no todas las versiones de Python exponen las constantes)
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+UDP_GRO = getattr(socket, "UDP_GRO", 104)
+GSO_MAX_SEGMENTS = 64      # límite del kernel de segmentos por envío
+GSO_MAX_BYTES = 65000      # el datagrama "grande" tiene que entrar en un paquete IP
+GRO_BUFFER_SIZE = 65535
+IP_MTU = getattr(socket, "IP_MTU", 14)  # MTU de la ruta de un socket conectado (Linux)
+
+
+def path_mtu(address):
+    """MTU de la ruta hacia address según el kernel (sólo Linux); None si no se puede saber."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(address)
+            return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+
+def grow_receive_buffer(sock, nbytes):
+    """Agranda SO_RCVBUF de sock hasta nbytes (nunca lo achica); devuelve el que quedó o None.
+
+    El kernel lo limita a net.core.rmem_max y en Linux informa el doble de lo pedido
+    (la mitad es para su propia contabilidad).
+    """
+    try:
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < nbytes:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, nbytes)
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    except OSError:
+        return None
+
 
 class Socket:
     SOCK_STREAM = socket.SOCK_STREAM
     SOCK_DGRAM = socket.SOCK_DGRAM
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, offload=False):
         self.addr = (host, port)
         self.socket = None
         try:
@@ -15,6 +56,39 @@ class Socket:
         except Exception as e:
             raise e
 
+        # I/O en lotes con UDP GSO/GRO (sólo Linux); se apaga solo si el kernel no lo soporta
+        self.gso = False
+        self.gro = False
+        self._gro_buffer = None
+        self._gro_pending = deque()  # (offset, length) de datagramas del último lote GRO
+        self._gro_addr = None
+        if offload:
+            self.enable_offload()
+
+    def enable_offload(self):
+        """Activa UDP GSO (envío) y GRO (recepción) si el kernel los soporta."""
+        if not HAS_SENDMSG or not sys.platform.startswith("linux"):
+            return False
+        try:
+            self.socket.getsockopt(SOL_UDP, UDP_SEGMENT)
+            self.gso = True
+        except OSError:
+            self.gso = False
+        try:
+            self.socket.setsockopt(SOL_UDP, UDP_GRO, 1)
+            self._gro_buffer = bytearray(GRO_BUFFER_SIZE)
+            self.gro = True
+        except OSError:
+            self.gro = False
+        logger.vprint(f"UDP offload: GSO={'on' if self.gso else 'off'}, GRO={'on' if self.gro else 'off'}")
+        return self.gso or self.gro
+
+    def settimeout(self, timeout):
+        self.socket.settimeout(timeout)
+
+    def grow_receive_buffer(self, nbytes):
+        return grow_receive_buffer(self.socket, nbytes)
+
     def bind(self):
         self.socket.bind(self.addr)
         logger.vprint(f"UDP server listening on {self.addr}")
@@ -29,12 +103,94 @@ class Socket:
             message = message.encode()
         self.socket.sendto(message, addr)
 
+    def sendmsg(self, buffers, addr=None):
+        """Envía un único datagrama formado por varios buffers (header, payload) sin concatenarlos."""
+        if addr is None:
+            addr = self.addr
+        if not self.socket:
+            raise ConnectionError("Socket is not initialized or is closed.")
+        if HAS_SENDMSG:
+            self.socket.sendmsg(buffers, (), 0, addr)
+        else:
+            self.socket.sendto(b"".join(buffers), addr)
+
+    def sendmsg_batch(self, datagrams, addr=None):
+        """Envía varios datagramas, cada uno como lista de buffers.
+
+        Con GSO, las corridas de datagramas del mismo tamaño (el último puede ser más
+        corto) salen en una sola syscall y el kernel las segmenta. Si el kernel rechaza
+        GSO, se desactiva y se vuelve a un sendmsg por datagrama.
+        """
+        if addr is None:
+            addr = self.addr
+        if not self.gso or len(datagrams) < 2:
+            for buffers in datagrams:
+                self.sendmsg(buffers, addr)
+            return
+
+        sizes = [sum(len(b) for b in buffers) for buffers in datagrams]
+        i = 0
+        while i < len(datagrams):
+            size = sizes[i]
+            j = i + 1
+            while (j < len(datagrams) and j - i < GSO_MAX_SEGMENTS
+                   and (j - i + 1) * size <= GSO_MAX_BYTES and sizes[j] <= size):
+                j += 1
+                if sizes[j - 1] < size:
+                    break  # sólo el último segmento puede ser más corto
+            if j - i == 1 or not self.gso:
+                for buffers in datagrams[i:j]:
+                    self.sendmsg(buffers, addr)
+            else:
+                iov = [b for buffers in datagrams[i:j] for b in buffers]
+                try:
+                    self.socket.sendmsg(iov, [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, addr)
+                except OSError as e:
+                    logger.vprint(f"UDP GSO not available ({e}). Falling back to one datagram per syscall.")
+                    self.gso = False
+                    for buffers in datagrams[i:j]:
+                        self.sendmsg(buffers, addr)
+            i = j
+
     def recvfrom(self, buffer_size):
         if not self.socket:
             raise ConnectionError("Socket is not initialized or is closed.")
         data, address = self.socket.recvfrom(buffer_size)
         return data, address
 
+    def recvfrom_into(self, buffer):
+        """Recibe un datagrama directamente en buffer (sin alocar); devuelve (nbytes, address).
+
+        Con GRO, un recvmsg puede traer varios datagramas coalescidos: se separan y se
+        van entregando de a uno en las llamadas siguientes, sin volver al kernel.
+        """
+        if not self.socket:
+            raise ConnectionError("Socket is not initialized or is closed.")
+        if self._gro_pending:
+            return self._next_gro_datagram(buffer)
+        if not self.gro:
+            return self.socket.recvfrom_into(buffer)
+
+        nbytes, ancdata, _, address = self.socket.recvmsg_into(
+            [self._gro_buffer], socket.CMSG_SPACE(4)
+        )
+        if nbytes == 0:
+            return 0, address
+        seg_size = nbytes
+        for level, ctype, cdata in ancdata:
+            if level == SOL_UDP and ctype == UDP_GRO:
+                seg_size = struct.unpack("=i", cdata[:4])[0] or nbytes
+        for off in range(0, nbytes, seg_size):
+            self._gro_pending.append((off, min(seg_size, nbytes - off)))
+        self._gro_addr = address
+        return self._next_gro_datagram(buffer)
+
+    def _next_gro_datagram(self, buffer):
+        off, length = self._gro_pending.popleft()
+        length = min(length, len(buffer))
+        buffer[:length] = memoryview(self._gro_buffer)[off:off + length]
+        return length, self._gro_addr
+
     def close(self):
         if self.socket:
             try:
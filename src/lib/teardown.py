@@ -0,0 +1,143 @@
+import atexit
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from .logger import logger
+
+EXIT_LINGER = 3.0  # Segundos que el proceso espera al salir a que terminen los cierres (TIME-WAIT incluido)
+
+
+class Teardown:
+    """Un solo thread para todas las conexiones que están cerrando (FIN, LAST-ACK, TIME-WAIT).
+
+    Protocol.close() manda su FIN y le pasa la conexión: en lugar de un loop bloqueante por
+    conexión, acá hay un selector sobre sus sockets y un heap con sus deadlines. Cada vez
+    que llega algo o vence su deadline se llama a conn._teardown_step(), que devuelve el
+    próximo deadline (time.monotonic()) o None cuando terminó; ahí se llama a
+    conn._teardown_done() para cerrar el socket.
+
+    Los DemuxSocket (socket de escucha compartido) no tienen descriptor propio: el
+    Demultiplexer avisa con su hook on_datagram.
+    """
+
+    def __init__(self):
+        self.selector = None
+        self.heap = []            # (deadline, n, conn); las entradas viejas se descartan al salir
+        self.deadlines = {}       # conn -> deadline vigente
+        self.incoming = deque()   # conexiones nuevas (se registran desde el thread de teardown)
+        self.ready = deque()      # conexiones con datagramas avisados por on_datagram
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.thread = None
+        self._wake_r = self._wake_w = None
+
+    def add(self, conn):
+        thread = None
+        with self.lock:
+            if self.thread is None:
+                self.selector = selectors.DefaultSelector()
+                self._wake_r, self._wake_w = socket.socketpair()
+                self._wake_r.setblocking(False)
+                self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+                self.thread = thread = threading.Thread(target=self._run, name="teardown", daemon=True)
+            self.incoming.append(conn)
+        # Fuera del lock: start() espera a que el thread arranque
+        if thread is not None:
+            thread.start()
+        self._wake()
+
+    def pending(self):
+        """Conexiones que todavía no terminaron de cerrar."""
+        with self.lock:
+            return len(self.deadlines) + len(self.incoming)
+
+    def drain(self, timeout=EXIT_LINGER):
+        """Espera, hasta timeout, a que terminen los cierres en curso.
+
+        El thread es daemon: sin esto, un proceso que sale apenas vuelve close() no atiende
+        su TIME-WAIT y el peer reintenta su FIN+ACK contra un puerto cerrado.
+        """
+        deadline = time.monotonic() + timeout
+        while self.thread is not None and self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _notify(self, conn):
+        with self.lock:
+            self.ready.append(conn)
+        self._wake()
+
+    def _register(self, conn):
+        raw = getattr(conn.socket, "socket", None)
+        if raw is not None:
+            self.selector.register(raw, selectors.EVENT_READ, conn)
+        else:
+            conn.socket.on_datagram = lambda: self._notify(conn)
+        self._schedule(conn, conn._teardown_deadline)
+
+    def _schedule(self, conn, deadline):
+        self.deadlines[conn] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), conn))
+
+    def _step(self, conn):
+        if conn not in self.deadlines:
+            return
+        try:
+            deadline = conn._teardown_step()
+        except Exception as e:
+            logger.vprint(f"[TEARDOWN] Error closing connection with {conn.peer_address}: {e}")
+            deadline = None
+        if deadline is None:
+            del self.deadlines[conn]
+            raw = getattr(conn.socket, "socket", None)
+            if raw is not None:
+                self.selector.unregister(raw)
+            else:
+                conn.socket.on_datagram = None
+            conn._teardown_done()
+        elif deadline != self.deadlines[conn]:
+            self._schedule(conn, deadline)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                incoming, self.incoming = self.incoming, deque()
+                ready, self.ready = self.ready, deque()
+                # Bajo el lock, para que pending() no las pierda de vista entre una cola y otra
+                for conn in incoming:
+                    self._register(conn)
+            for conn in ready:
+                self._step(conn)
+
+            timeout = None
+            if self.heap:
+                timeout = max(0.0, self.heap[0][0] - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                else:
+                    self._step(key.data)
+
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, _, conn = heapq.heappop(self.heap)
+                if self.deadlines.get(conn) == deadline:
+                    self._step(conn)
+
+
+teardown = Teardown()
+atexit.register(teardown.drain)
@@ -1,7 +1,10 @@
 import argparse
 
+from lib.async_server import MAX_CONNECTIONS, AsyncServer
+from lib.file_manager import DURABILITY_NONE, DURABILITY_POLICIES
 from lib.logger import logger
-from lib.server import Server
+from lib.protocolo import MAX_MSS, MIN_MSS
+from lib.server import MAX_PENDING, MAX_WORKERS, SYN_BACKLOG, Server
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -23,6 +26,63 @@ if __name__ == "__main__":
     parser.add_argument(
         "-s", "--dirpath", type=str, default="", help="storage dir path"
     )
+    parser.add_argument(
+        "-c",
+        "--congestion",
+        type=str,
+        default="reno",
+        help="congestion control for Selective Repeat [reno or cubic]",
+    )
+    parser.add_argument(
+        "--offload",
+        action="store_true",
+        help="batched UDP I/O with GSO/GRO when the kernel supports it (Linux)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="single-threaded asyncio server instead of one thread per client (no --offload)",
+    )
+    parser.add_argument(
+        "--shared-socket",
+        action="store_true",
+        help="serve every connection on the listening socket, routed by connection ID",
+    )
+    parser.add_argument(
+        "-b",
+        "--backlog",
+        type=int,
+        default=SYN_BACKLOG,
+        help="max handshakes in progress; further SYNs are dropped until one completes",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help=f"max concurrent transfers (size of the worker pool, default {MAX_WORKERS}; "
+        f"with --async, open connections, default {MAX_CONNECTIONS})",
+    )
+    parser.add_argument(
+        "--pending",
+        type=int,
+        default=MAX_PENDING,
+        help="connections waiting for a worker; beyond this new clients are rejected as busy (not with --async)",
+    )
+    parser.add_argument(
+        "-D",
+        "--durability",
+        choices=DURABILITY_POLICIES,
+        default=DURABILITY_NONE,
+        help="when uploaded data is forced to disk: none, fsync at close, or periodic fdatasync",
+    )
+    parser.add_argument(
+        "--mss",
+        type=int,
+        default=None,
+        help="max payload bytes per segment to accept (default: what fits in the route MTU to each client)",
+    )
     args = parser.parse_args()
 
     if args.quiet and args.verbose:
@@ -30,8 +90,19 @@ if __name__ == "__main__":
             "argument -q/--quiet: it is not permitted with the argument -v/--verbose"
         )
 
+    if args.mss is not None and not MIN_MSS <= args.mss <= MAX_MSS:
+        parser.error(f"argument --mss: must be between {MIN_MSS} and {MAX_MSS}")
+
     logger.info("Initializing server...")
-    server = Server(args.addr, args.port, storage_dir=args.dirpath)
+    if args.use_async:
+        server = AsyncServer(args.addr, args.port, storage_dir=args.dirpath, congestion=args.congestion,
+                             shared=args.shared_socket, durability=args.durability, max_mss=args.mss,
+                             backlog=args.backlog, max_connections=args.workers or MAX_CONNECTIONS)
+    else:
+        server = Server(args.addr, args.port, storage_dir=args.dirpath, congestion=args.congestion,
+                        offload=args.offload, shared=args.shared_socket, backlog=args.backlog,
+                        max_workers=args.workers or MAX_WORKERS, max_pending=args.pending, durability=args.durability,
+                        max_mss=args.mss)
 
     try:
         logger.info("Starting listening thread")
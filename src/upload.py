@@ -19,9 +19,16 @@ if __name__ == "__main__":
     )
     parser.add_argument("-p", "--port", type=int, default=65432, help="server port")
     parser.add_argument(
-        "-s", "--filepath", type=str, required=True, help="src source file path"
+        "-s",
+        "--filepath",
+        type=str,
+        nargs="+",
+        required=True,
+        help="src source file path; several files or a directory are sent in one session",
+    )
+    parser.add_argument(
+        "-n", "--filename", type=str, default="", help="file name (remote directory when sending several files)"
     )
-    parser.add_argument("-n", "--filename", type=str, default="", help="file name")
     parser.add_argument(
         "-r",
         "--protocol",
@@ -29,6 +36,50 @@ if __name__ == "__main__":
         default="",
         help="Stop & Wait or Selective Repeat[SW or SR]",
     )
+    parser.add_argument(
+        "-c",
+        "--congestion",
+        type=str,
+        default="reno",
+        help="congestion control for Selective Repeat [reno or cubic]",
+    )
+    parser.add_argument(
+        "--offload",
+        action="store_true",
+        help="batched UDP I/O with GSO/GRO when the kernel supports it (Linux)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted transfer from the prefix the destination already has",
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        type=str,
+        default=None,
+        help="compress the data in transit [zlib or lzma]; incompressible chunks are sent as is",
+    )
+    parser.add_argument(
+        "--level", type=int, default=None, help="compression level [0-9] (default depends on the codec)"
+    )
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=1,
+        help="parallel connections; each one transfers its own byte range of the file",
+    )
+    parser.add_argument(
+        "--mss",
+        type=int,
+        default=None,
+        help="max payload bytes per segment to advertise (default: what fits in the route MTU)",
+    )
+    parser.add_argument(
+        "--probe-mtu",
+        action="store_true",
+        help="probe the path with larger datagrams and use the largest one delivered intact",
+    )
     args = parser.parse_args()
 
     if args.quiet and args.verbose:
@@ -45,6 +96,14 @@ if __name__ == "__main__":
         args.quiet,
         0,
         args.protocol,
+        args.congestion,
+        args.offload,
+        args.resume,
+        args.compress,
+        args.level,
+        args.streams,
+        args.mss,
+        args.probe_mtu,
     )
 
     try: